@@ -31,6 +31,8 @@ CREATE TABLE t_clock_schedules (
   run_date timestamp,
   applied enum_task_status default 'pending',
   active boolean,
+  lease_owner text,
+  lease_expires timestamp,
   FOREIGN KEY (user_id) references m_users(user_id) ON DELETE cascade,
   FOREIGN KEY (work_type_id) references m_work_types(id) ON DELETE cascade,
   PRIMARY KEY (user_id, run_date, run_type)
@@ -63,6 +65,8 @@ CREATE TABLE t_applied_schedules (
   apply_date timestamp,
   applied enum_task_status,
   active boolean,
+  lease_owner text,
+  lease_expires timestamp,
   FOREIGN KEY (user_id) references m_users(user_id) ON DELETE cascade,
   FOREIGN KEY (schedule_type_id) references m_work_schedule_types(id) ON DELETE cascade,
   PRIMARY KEY (user_id, run_date)
@@ -79,10 +83,23 @@ CREATE TABLE t_basic_types (
   FOREIGN KEY (schedule_type_name) references m_work_schedule_types(type_name) ON DELETE cascade
 );
 
+-- schedules of each user are built for days before built_until
+CREATE TABLE t_schedule_horizons (
+  user_id integer PRIMARY KEY,
+  built_until timestamp NOT NULL,
+  updated_at timestamp,
+  FOREIGN KEY (user_id) references m_users(user_id) ON DELETE cascade
+);
+
+-- holidays used by BUILD_MODE = "sql", synced from the holiday calendar
+CREATE TABLE m_holidays (
+  holiday date PRIMARY KEY
+);
+
 \COPY m_users from './m_user.csv' with csv header;
 \COPY m_work_schedule_types from './m_work_schedule_types.csv' with csv header;
 \COPY m_work_types from './m_work_types.csv' with csv header;
 
 \COPY t_basic_types from './t_basic_types.csv' with csv header;
-\COPY t_applied_schedules from './t_applied_schedules.csv' with csv header;
-\COPY t_clock_schedules from './t_clock_schedules.csv' with csv header;
\ No newline at end of file
+\COPY t_applied_schedules (user_id, schedule_type_id, run_type, run_date, run_time, apply_date, applied, active) from './t_applied_schedules.csv' with csv header;
+\COPY t_clock_schedules (user_id, work_type_id, run_type, run_time, run_date, applied, active) from './t_clock_schedules.csv' with csv header;
\ No newline at end of file
@@ -0,0 +1,4 @@
+"""Offline benchmarks
+
+Run from src/app, like `python -m bench.clocker`.
+"""
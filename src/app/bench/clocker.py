@@ -0,0 +1,256 @@
+"""Offline benchmark of the selenium `Clocker` flow
+
+Runs `Clocker` against the stub attendance site with in-memory fake
+WebDrivers and reports the wall time and WebDriver command count of
+every step. No network, selenium grid or account is needed.
+
+    python -m bench.clocker --runs 20
+    python -m bench.clocker --rtt 0.005 --json after.json --baseline before.json
+
+`--rtt` sleeps in every WebDriver command, like a round-trip to the
+grid, so changes removing commands show up in the wall time too.
+With `--pool-size` and `--users` several users take turns on the pooled
+sessions.
+"""
+from typing import Dict, List
+import argparse
+import datetime
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from bench.fake_driver import CommandLog, fake_driver_factory
+from stub_site import StubSite
+
+
+ACTIONS = ["clock_in", "clock_out", "apply_telework"]
+STEPS = ["init_driver", "login", *ACTIONS, "dispose_driver"]
+
+
+class StepTimer:
+    """Wall time and command count of every run of every step"""
+
+    def __init__(self, log: CommandLog) -> None:
+        self.log = log
+        self.seconds: Dict[str, List[float]] = {}
+        self.commands: Dict[str, List[int]] = {}
+        self.kinds: Dict[str, Dict[str, int]] = {}
+
+    @contextmanager
+    def step(self, name: str):
+        before = self.log.snapshot()
+        started = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - started
+        after = self.log.snapshot()
+
+        delta = {k: v - before.get(k, 0) for k, v in after.items()
+                 if v - before.get(k, 0)}
+        self.seconds.setdefault(name, []).append(elapsed)
+        self.commands.setdefault(name, []).append(sum(delta.values()))
+        kinds = self.kinds.setdefault(name, {})
+        for k, v in delta.items():
+            kinds[k] = kinds.get(k, 0) + v
+
+    def summary(self) -> Dict[str, dict]:
+        res = {}
+        for name in STEPS:
+            if name not in self.seconds:
+                continue
+            seconds = self.seconds[name]
+            runs = len(seconds)
+            res[name] = {
+                "runs": runs,
+                "mean_ms": statistics.fmean(seconds) * 1000,
+                "p50_ms": statistics.median(seconds) * 1000,
+                "max_ms": max(seconds) * 1000,
+                "commands": statistics.fmean(self.commands[name]),
+                "by_command": {
+                    k: v / runs for k, v in sorted(
+                        self.kinds[name].items(), key=lambda x: -x[1])},
+            }
+        return res
+
+
+def build_clocker(action: str, **kwds):
+    from core.clocker import Clocker
+    from database.model import ENUM_RUN_TYPE_NAME
+    from database.schemas import M_WORK_SCHEDULE_TYPES
+
+    if action == "apply_telework":
+        details = M_WORK_SCHEDULE_TYPES(
+            id=1,
+            type_name="bench",
+            memo="",
+            run_time=datetime.time(8, 0),
+            telework=True,
+            # not in the options, enters custom times
+            clock_type="bench",
+            clockin=datetime.time(9, 0),
+            clockout=datetime.time(18, 0),
+            breakin=datetime.time(12, 0),
+            breakout=datetime.time(13, 0),
+            msg="",
+        )
+        return Clocker(
+            schedule_type=details.clock_type,
+            details=details,
+            day2apply=datetime.date.today().strftime("%Y-%m-%d"),
+            runner="apply_telework",
+            backend="selenium",
+            **kwds)
+
+    run_type = {"clock_in": ENUM_RUN_TYPE_NAME.cin,
+                "clock_out": ENUM_RUN_TYPE_NAME.cout}[action]
+    return Clocker(
+        gps="35.681236,139.767125", runner=run_type,
+        backend="selenium", **kwds)
+
+
+def run(
+        runs: int,
+        rtt: float,
+        latency: float,
+        pool_size: int,
+        session_store: bool,
+        logger: logging.Logger,
+        users: int = 1) -> dict:
+    with StubSite(latency=latency) as site:
+        # core modules read the site origin on import
+        os.environ["ATTENDANCE_ORIGIN"] = site.origin
+        from core.driver_pool import DriverPool
+        from core.session_store import SessionStore
+
+        log = CommandLog(rtt=rtt)
+        timer = StepTimer(log)
+        driver_pool = DriverPool(
+            size=pool_size, factory=fake_driver_factory(log))
+        store = None
+        if session_store:
+            from cryptography.fernet import Fernet
+
+            store = SessionStore(
+                key=Fernet.generate_key(), path=tempfile.mkdtemp())
+
+        for i in range(runs):
+            for action in ACTIONS:
+                # users take turns, pooled sessions change hands
+                clocker = build_clocker(
+                    action,
+                    email=f"bench{i % users}@example.com",
+                    password="bench",
+                    driver_pool=driver_pool,
+                    session_store=store,
+                )
+                error = False
+                try:
+                    with timer.step("init_driver"):
+                        clocker.init_driver(logger)
+                    with timer.step("login"):
+                        clocker.login()
+                    with timer.step(action):
+                        getattr(clocker, action)()
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    with timer.step("dispose_driver"):
+                        clocker.dispose_driver(logger, error=error)
+        driver_pool.close(logger)
+
+        # every action must have reached the site
+        submitted = [x["action"] for x in site.events]
+        for action in ACTIONS:
+            if submitted.count(action) != runs:
+                raise RuntimeError(
+                    f"{action} submitted {submitted.count(action)} times, "
+                    f"expected {runs}")
+
+    return {
+        "config": {
+            "runs": runs,
+            "rtt": rtt,
+            "latency": latency,
+            "pool_size": pool_size,
+            "session_store": session_store,
+            "users": users,
+        },
+        "steps": timer.summary(),
+    }
+
+
+def report(result: dict, baseline: dict = None, file=sys.stdout) -> None:
+    steps = result["steps"]
+    base = (baseline or {}).get("steps", {})
+    print(f"config: {result['config']}", file=file)
+    header = f"{'step':<18}{'runs':>6}{'mean ms':>10}{'p50 ms':>10}" \
+             f"{'max ms':>10}{'commands':>10}"
+    if base:
+        header += f"{'d mean':>10}{'d cmds':>10}"
+    print(header, file=file)
+    for name, x in steps.items():
+        line = (f"{name:<18}{x['runs']:>6}{x['mean_ms']:>10.2f}"
+                f"{x['p50_ms']:>10.2f}{x['max_ms']:>10.2f}"
+                f"{x['commands']:>10.1f}")
+        if name in base:
+            b = base[name]
+            line += f"{(x['mean_ms'] / b['mean_ms'] - 1) * 100:>+9.1f}%"
+            line += f"{x['commands'] - b['commands']:>+10.1f}"
+        print(line, file=file)
+
+    print("\ncommands per run", file=file)
+    for name, x in steps.items():
+        top = ", ".join(f"{k}: {v:.3g}" for k, v in
+                        list(x["by_command"].items())[:6])
+        print(f"  {name:<16}{top}", file=file)
+
+
+def main(argv: List[str] = None) -> dict:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.clocker", description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=10,
+                        help="runs of every action")
+    parser.add_argument("--rtt", type=float, default=0.,
+                        help="seconds slept in every WebDriver command")
+    parser.add_argument("--latency", type=float, default=0.,
+                        help="seconds slept by the stub site per response")
+    parser.add_argument("--pool-size", type=int, default=0,
+                        help="idle sessions kept by the driver pool")
+    parser.add_argument("--session-store", action="store_true",
+                        help="restore saved login sessions")
+    parser.add_argument("--users", type=int, default=1,
+                        help="users taking turns to run the actions")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="results to compare with")
+    args = parser.parse_args(argv)
+
+    logger = logging.getLogger("bench")
+    logger.setLevel(logging.WARNING)
+    result = run(
+        runs=args.runs,
+        rtt=args.rtt,
+        latency=args.latency,
+        pool_size=args.pool_size,
+        session_store=args.session_store,
+        logger=logger,
+        users=args.users,
+    )
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    if args.json:
+        with open(args.json, mode="w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+if __name__ == "__main__":
+    main()
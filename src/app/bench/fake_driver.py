@@ -0,0 +1,395 @@
+"""In-memory WebDriver talking to the stub attendance site
+
+Implements the part of the selenium WebDriver API `Clocker`, `Waiter`,
+`Select` and `DriverPool` use. Pages are fetched with httpx and parsed
+with BeautifulSoup, clicks on submit buttons post their form like a
+browser does. Every call which would be a round-trip to a selenium grid
+is counted in a `CommandLog`.
+"""
+from typing import Callable, Dict, List
+import collections
+import json
+import re
+import secrets
+import threading
+import time
+from urllib.parse import urljoin
+
+import httpx
+from bs4 import BeautifulSoup
+from bs4.element import Tag
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    StaleElementReferenceException,
+)
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+
+
+class CommandLog:
+    """Count of WebDriver commands, shared by drivers of one run"""
+
+    def __init__(self, rtt: float = 0.) -> None:
+        # seconds slept in every command to simulate the grid round-trip
+        self.rtt = rtt
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+    def record(self, command: str) -> None:
+        with self._lock:
+            self.counts[command] += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+
+
+# xpath subset used by clocker.py and selenium's Select:
+#   //tag[@attr='v'][1]/child  .//tag[normalize-space(.) = "v"]
+#   .//tag[contains(., "v")]
+_PRED_BODY = r"""(?:'[^']*'|"[^"]*"|[^\]'"])*"""
+_STEP = re.compile(r"(//|/)([\w*-]+)((?:\[" + _PRED_BODY + r"\])*)")
+_PRED = re.compile(r"\[(" + _PRED_BODY + r")\]")
+_LITERAL = r"""\s*(?:'([^']*)'|"([^"]*)")\s*"""
+_ATTR_EQ = re.compile(r"^\s*@([\w-]+)\s*=" + _LITERAL + "$")
+_TEXT_EQ = re.compile(r"^\s*normalize-space\(\.\)\s*=" + _LITERAL + "$")
+_CONTAINS = re.compile(r"^\s*contains\(\s*\.\s*," + _LITERAL + r"\)\s*$")
+
+
+def _normalize_space(s: str) -> str:
+    return " ".join(s.split())
+
+
+def _match(tag: Tag, pred: str) -> bool:
+    m = _ATTR_EQ.match(pred)
+    if m:
+        value = tag.get(m.group(1))
+        if isinstance(value, list):
+            value = " ".join(value)
+        return value == (m.group(2) if m.group(2) is not None else m.group(3))
+    m = _TEXT_EQ.match(pred)
+    if m:
+        return _normalize_space(tag.get_text()) == (
+            m.group(1) if m.group(1) is not None else m.group(2))
+    m = _CONTAINS.match(pred)
+    if m:
+        return (m.group(1) if m.group(1) is not None else m.group(2)) in (
+            tag.get_text())
+    raise NotImplementedError(f"Unsupported xpath predicate: [{pred}]")
+
+
+def xpath(context: Tag, path: str) -> List[Tag]:
+    """Evaluate the xpath subset above from `context`"""
+    if path.startswith("."):
+        path = path[1:]
+    pos, nodes = 0, [context]
+    while pos < len(path):
+        m = _STEP.match(path, pos)
+        if m is None:
+            raise NotImplementedError(f"Unsupported xpath: {path}")
+        axis, name, preds = m.groups()
+        pos = m.end()
+
+        found = []
+        for node in nodes:
+            if axis == "//":
+                candidates = node.find_all(
+                    True if name == "*" else name, recursive=True)
+                # [n] counts among siblings sharing the same parent
+                groups = collections.defaultdict(list)
+                for x in candidates:
+                    groups[id(x.parent)].append(x)
+                groups = list(groups.values())
+            else:
+                groups = [node.find_all(
+                    True if name == "*" else name, recursive=False)]
+
+            for group in groups:
+                for pred in _PRED.findall(preds):
+                    if pred.strip().isdigit():
+                        n = int(pred)
+                        group = group[n - 1:n]
+                    else:
+                        group = [x for x in group if _match(x, pred)]
+                for x in group:
+                    if all(x is not y for y in found):
+                        found.append(x)
+        nodes = found
+    return nodes
+
+
+def find(context: Tag, by: str, value: str) -> List[Tag]:
+    if by == By.ID:
+        return context.find_all(id=value)
+    if by == By.CLASS_NAME:
+        return context.find_all(class_=value)
+    if by == By.TAG_NAME:
+        return context.find_all(value)
+    if by == By.NAME:
+        return context.find_all(attrs={"name": value})
+    if by == By.CSS_SELECTOR:
+        return context.select(value)
+    if by == By.XPATH:
+        return xpath(context, value)
+    raise NotImplementedError(f"Unsupported locator: {by}")
+
+
+class FakeElement:
+    def __init__(self, driver: "FakeWebDriver", tag: Tag) -> None:
+        self._driver = driver
+        self._tag = tag
+        self._generation = driver.generation
+
+    def _command(self, name: str) -> Tag:
+        self._driver.log.record(f"element.{name}")
+        if self._generation != self._driver.generation:
+            raise StaleElementReferenceException(
+                f"<{self._tag.name}> is not attached to the page document")
+        return self._tag
+
+    @property
+    def tag_name(self) -> str:
+        return self._command("tag_name").name
+
+    @property
+    def text(self) -> str:
+        return self._command("text").get_text().strip()
+
+    def get_attribute(self, name: str) -> str:
+        tag = self._command("get_attribute")
+        if name == "index" and tag.name == "option":
+            return str(tag.find_parent("select").find_all("option").index(tag))
+        return self._attr(tag, name)
+
+    def get_dom_attribute(self, name: str) -> str:
+        return self._attr(self._command("get_dom_attribute"), name)
+
+    def get_property(self, name: str) -> str:
+        return self._attr(self._command("get_property"), name)
+
+    @staticmethod
+    def _attr(tag: Tag, name: str) -> str:
+        value = tag.get(name)
+        if isinstance(value, list):
+            value = " ".join(value)
+        if value is None and name == "value" and tag.name == "textarea":
+            value = tag.get_text()
+        return value
+
+    def is_displayed(self) -> bool:
+        tag = self._command("is_displayed")
+        return not (tag.name == "input" and tag.get("type") == "hidden")
+
+    def is_enabled(self) -> bool:
+        return not self._command("is_enabled").has_attr("disabled")
+
+    def is_selected(self) -> bool:
+        tag = self._command("is_selected")
+        return tag.has_attr("selected") or tag.has_attr("checked")
+
+    def value_of_css_property(self, name: str) -> str:
+        self._command("value_of_css_property")
+        return {"visibility": "visible", "display": "block",
+                "opacity": "1"}.get(name, "")
+
+    def find_element(self, by: str = By.ID, value: str = None) -> "FakeElement":
+        found = self.find_elements(by, value)
+        if not found:
+            raise NoSuchElementException(f"{by}={value}")
+        return found[0]
+
+    def find_elements(
+            self, by: str = By.ID, value: str = None) -> List["FakeElement"]:
+        tag = self._command("find_elements")
+        return [FakeElement(self._driver, x)
+                for x in find(tag, by, value)]
+
+    def send_keys(self, *values: str) -> None:
+        tag = self._command("send_keys")
+        text = self._attr(tag, "value") or ""
+        for key in "".join(values):
+            text = text[:-1] if key == Keys.BACKSPACE else text + key
+        if tag.name == "textarea":
+            tag.string = text
+        else:
+            tag["value"] = text
+
+    def clear(self) -> None:
+        tag = self._command("clear")
+        if tag.name == "textarea":
+            tag.string = ""
+        else:
+            tag["value"] = ""
+
+    def click(self) -> None:
+        tag = self._command("click")
+        if tag.name == "option":
+            for x in tag.find_parent("select").find_all("option"):
+                if x.has_attr("selected"):
+                    del x["selected"]
+            tag["selected"] = ""
+        elif tag.name == "a" and tag.get("href"):
+            self._driver._load(self._driver.client.get(
+                urljoin(self._driver.current_url, tag["href"])))
+        elif (tag.name == "button" and tag.get("type", "submit") == "submit") or (
+                tag.name == "input" and tag.get("type") in ("submit", "image")):
+            self._driver._submit(tag)
+
+
+class _FakeExecutor:
+    """Answers CDP commands sent by `core.clocker.send_cdp`"""
+
+    def __init__(self, driver: "FakeWebDriver") -> None:
+        self._driver = driver
+        self._url = "http://fake-webdriver"
+
+    def _request(self, method: str, url: str, body: str = None) -> dict:
+        driver = self._driver
+        payload = json.loads(body)
+        cmd, params = payload["cmd"], payload.get("params", {})
+        driver.log.record(f"cdp.{cmd}")
+
+        value = {}
+        if cmd == "Emulation.setGeolocationOverride":
+            driver.geolocation = (params["latitude"], params["longitude"])
+        elif cmd == "Emulation.clearGeolocationOverride":
+            driver.geolocation = None
+        elif cmd == "Network.clearBrowserCookies":
+            driver.client.cookies.clear()
+        elif cmd == "Network.getAllCookies":
+            value = {"cookies": [{
+                "name": x.name,
+                "value": x.value,
+                "domain": x.domain,
+                "path": x.path,
+                "expires": -1 if x.expires is None else x.expires,
+                "secure": x.secure,
+            } for x in driver.client.cookies.jar]}
+        elif cmd == "Network.setCookies":
+            for x in params["cookies"]:
+                driver.client.cookies.set(
+                    x["name"], x["value"],
+                    domain=x.get("domain", ""), path=x.get("path", "/"))
+        return {"value": value}
+
+
+class FakeWebDriver:
+    """Stand-in of `webdriver.Remote` without a browser"""
+
+    def __init__(
+            self,
+            log: CommandLog = None,
+            user_agent: str = None,
+            timeout: float = 30) -> None:
+        self.log = log or CommandLog()
+        self.session_id = secrets.token_hex(16)
+        self.command_executor = _FakeExecutor(self)
+        self.client = httpx.Client(
+            follow_redirects=True, timeout=timeout,
+            headers={"User-Agent": user_agent} if user_agent else {})
+        self.soup = BeautifulSoup("<html></html>", "html.parser")
+        self.url = "about:blank"
+        self.geolocation = None
+        # bumped on every navigation, elements of older pages are stale
+        self.generation = 0
+
+    def _load(self, resp: httpx.Response) -> None:
+        self.url = str(resp.url)
+        self.soup = BeautifulSoup(resp.text, "html.parser")
+        self.generation += 1
+
+    def _submit(self, submitter: Tag) -> None:
+        # imported here, core modules read the site origin on import
+        from core.backends import form_fields
+
+        if submitter.get("form"):
+            form = self.soup.find("form", id=submitter["form"])
+        else:
+            form = submitter.find_parent("form")
+        if form is None:
+            return
+
+        # the attendance page fills the position by javascript
+        data = {}
+        for k, v in form_fields(form, submitter):
+            if self.geolocation is not None and k.endswith("[latitude]"):
+                v = str(self.geolocation[0])
+            elif self.geolocation is not None and k.endswith("[longitude]"):
+                v = str(self.geolocation[1])
+            data.setdefault(k, []).append(v)
+
+        action = urljoin(self.url, form.get("action") or self.url)
+        if form.get("method", "get").lower() == "post":
+            self._load(self.client.post(action, data=data))
+        else:
+            self._load(self.client.get(action, params=data))
+
+    @property
+    def current_url(self) -> str:
+        self.log.record("current_url")
+        return self.url
+
+    @property
+    def page_source(self) -> str:
+        self.log.record("page_source")
+        return str(self.soup)
+
+    def get(self, url: str) -> None:
+        self.log.record("get")
+        if url == "about:blank":
+            self.url = url
+            self.soup = BeautifulSoup("<html></html>", "html.parser")
+            self.generation += 1
+            return
+        self._load(self.client.get(url))
+
+    def execute_script(self, script: str, *args) -> str:
+        self.log.record("execute_script")
+        if "document.readyState" in script:
+            return "complete"
+        return None
+
+    def implicitly_wait(self, seconds: float) -> None:
+        self.log.record("implicitly_wait")
+
+    def find_element(self, by: str = By.ID, value: str = None) -> FakeElement:
+        found = self.find_elements(by, value)
+        if not found:
+            raise NoSuchElementException(f"{by}={value}")
+        return found[0]
+
+    def find_elements(
+            self, by: str = By.ID, value: str = None) -> List[FakeElement]:
+        self.log.record("find_elements")
+        return [FakeElement(self, x)
+                for x in find(self.soup, by, value)]
+
+    def close(self) -> None:
+        self.quit()
+
+    def quit(self) -> None:
+        self.log.record("quit")
+        self.client.close()
+
+
+def fake_driver_factory(
+        log: CommandLog) -> Callable[..., FakeWebDriver]:
+    """Factory for `DriverPool` creating drivers like `create_driver`"""
+    def factory(logger) -> FakeWebDriver:
+        from core.clocker import USER_AGENT, MY_PAGE_URL, send_cdp
+
+        driver = FakeWebDriver(log=log, user_agent=USER_AGENT)
+        log.record("new_session")
+        driver.implicitly_wait(0)
+        send_cdp(driver, "Browser.grantPermissions", {
+            "origin": MY_PAGE_URL,
+            "permissions": ["geolocation"],
+        })
+        return driver
+    return factory
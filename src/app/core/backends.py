@@ -0,0 +1,364 @@
+"""Backends performing the actions of a `Clocker`
+
+The selenium flow lives in `Clocker` itself. `HttpBackend` performs the
+same actions with plain http requests: it parses the pages with
+BeautifulSoup and posts the same form fields the selenium flow fills.
+"""
+from typing import Dict, List, Tuple, TYPE_CHECKING
+import logging
+from dataclasses import dataclass
+from urllib.parse import urljoin
+
+import httpx
+from bs4 import BeautifulSoup
+from bs4.element import Tag
+
+from core.config import settings
+from core.session_store import Cookies
+from core.clocker import (
+    USER_AGENT,
+    FIELD_SCHEDULE_TEMPLATE,
+    FIELD_SCHEDULE_START,
+    FIELD_SCHEDULE_END,
+    FIELD_BREAK_START,
+    FIELD_BREAK_END,
+    CLASS_TELEWORK_COUNTER,
+)
+
+if TYPE_CHECKING:
+    from core.clocker import Clocker
+
+
+Fields = List[Tuple[str, str]]
+
+
+class BackendError(RuntimeError):
+    pass
+
+
+class ClockerBackend:
+    """Interface of clocker backends
+
+    Subclasses implement `open`, `close` and the actions as coroutines.
+    `submitted` must be set once a request changing the attendance
+    record was sent, so callers know whether a retry is safe.
+    """
+
+    def __init__(self, clocker: "Clocker", logger: logging.Logger) -> None:
+        self.clocker = clocker
+        self.logger = logger
+        self.submitted = False
+
+    async def __call__(self) -> None:
+        await self.open()
+        try:
+            await self.login()
+            self.logger.info(f"[S] {self.clocker.runner}")
+            await getattr(self, self.clocker.runner)()
+            self.logger.info(f"[E] {self.clocker.runner}")
+        finally:
+            await self.close()
+
+    async def run_batch(self, clockers: List["Clocker"]) -> List[Exception]:
+        """Log in once and run the action of every clocker in order.
+
+        Return the exception of each clocker, None for success.
+        Raise if the session could not be opened or logged in.
+        """
+        results = []
+        await self.open()
+        try:
+            await self.login()
+            for clocker in clockers:
+                self.clocker = clocker
+                try:
+                    self.logger.info(f"[S] {clocker}")
+                    await getattr(self, clocker.runner)()
+                    self.logger.info(f"[E] {clocker.runner}")
+                    results.append(None)
+                except Exception as e:
+                    self.logger.error(f"Failed {clocker}: {e}")
+                    results.append(e)
+        finally:
+            await self.close()
+        return results
+
+    async def open(self) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        raise NotImplementedError
+
+    async def login(self) -> None:
+        raise NotImplementedError
+
+    async def clock_in(self) -> None:
+        raise NotImplementedError
+
+    async def clock_out(self) -> None:
+        raise NotImplementedError
+
+    async def apply_telework(self) -> None:
+        raise NotImplementedError
+
+
+@dataclass
+class Page:
+    url: str
+    soup: BeautifulSoup
+
+    @property
+    def csrf_token(self) -> str:
+        meta = self.soup.find("meta", attrs={"name": "csrf-token"})
+        return None if meta is None else meta.get("content")
+
+
+def form_fields(form: Tag, submitter: Tag = None) -> Fields:
+    """Collect fields a browser sends when `form` is submitted"""
+    fields = []
+    for elem in form.find_all(["input", "select", "textarea"]):
+        name = elem.get("name")
+        if (not name) or elem.has_attr("disabled"):
+            continue
+        if elem.name == "select":
+            opts = elem.find_all("option")
+            selected = [x for x in opts if x.has_attr("selected")] or opts[:1]
+            if selected:
+                fields.append((name, selected[0].get(
+                    "value", selected[0].get_text())))
+        elif elem.name == "textarea":
+            fields.append((name, elem.get_text()))
+        else:
+            itype = elem.get("type", "text").lower()
+            if itype in ("submit", "button", "image", "reset"):
+                continue
+            if itype in ("checkbox", "radio") and (
+                    not elem.has_attr("checked")):
+                continue
+            fields.append((name, elem.get("value", "")))
+
+    if (submitter is not None) and submitter.get("name"):
+        fields.append((submitter["name"], submitter.get("value", "")))
+    return fields
+
+
+def set_field(fields: Fields, name: str, value: str) -> Fields:
+    for i, (k, _) in enumerate(fields):
+        if k == name:
+            fields[i] = (name, value)
+            return fields
+    fields.append((name, value))
+    return fields
+
+
+def form_of(elem: Tag, page: Page) -> Tag:
+    if elem.get("form"):
+        return page.soup.find("form", id=elem["form"])
+    return elem.find_parent("form")
+
+
+class HttpBackend(ClockerBackend):
+    """Clocker actions over plain http without a browser"""
+
+    def __init__(
+            self,
+            clocker: "Clocker",
+            logger: logging.Logger,
+            origin: str = None,
+            timeout: float = None,
+            transport: httpx.AsyncBaseTransport = None) -> None:
+        super().__init__(clocker, logger)
+        self.origin = origin or settings.ATTENDANCE_ORIGIN
+        self.my_page_url = f"{self.origin}/my_page"
+        self.timeout = timeout or settings.HTTP_TIMEOUT_SECONDS
+        self.transport = transport
+        self.client: httpx.AsyncClient = None
+
+    async def open(self) -> None:
+        self.client = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=self.timeout,
+            headers={"User-Agent": USER_AGENT},
+            transport=self.transport,
+        )
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+
+    async def _page(self, resp: httpx.Response) -> Page:
+        resp.raise_for_status()
+        return Page(url=str(resp.url),
+                    soup=BeautifulSoup(resp.text, "html.parser"))
+
+    async def get(self, url: str) -> Page:
+        return await self._page(await self.client.get(url))
+
+    async def submit(
+            self,
+            page: Page,
+            form: Tag,
+            values: Dict[str, str] = {},
+            submitter: Tag = None) -> Page:
+        if form is None:
+            raise BackendError(f"Form not found in {page.url}")
+        fields = form_fields(form, submitter)
+        for name, value in values.items():
+            set_field(fields, name, value)
+
+        # rails reads the token from the form, or the header as fallback
+        headers = {}
+        if page.csrf_token is not None:
+            headers["X-CSRF-Token"] = page.csrf_token
+            if not any(k == "authenticity_token" for k, _ in fields):
+                fields.append(("authenticity_token", page.csrf_token))
+
+        action = urljoin(page.url, form.get("action") or page.url)
+        data = {}
+        for k, v in fields:
+            data.setdefault(k, []).append(v)
+        if form.get("method", "get").lower() == "post":
+            resp = await self.client.post(action, data=data, headers=headers)
+        else:
+            resp = await self.client.get(action, params=data)
+        return await self._page(resp)
+
+    def is_logged_in(self, page: Page) -> bool:
+        return page.url.startswith(self.my_page_url) and (
+            page.soup.select_one(".attendance-button-mfid") is None)
+
+    def get_cookies(self) -> Cookies:
+        return [{
+            "name": x.name,
+            "value": x.value,
+            "domain": x.domain,
+            "path": x.path,
+            "expires": -1 if x.expires is None else x.expires,
+            "secure": x.secure,
+        } for x in self.client.cookies.jar]
+
+    def set_cookies(self, cookies: Cookies) -> None:
+        for x in cookies:
+            self.client.cookies.set(
+                x["name"], x["value"],
+                domain=x.get("domain", ""), path=x.get("path", "/"))
+
+    async def login(self) -> None:
+        store = self.clocker.session_store
+        cookies = None if store is None else store.load(self.clocker.email)
+        if cookies is not None:
+            self.set_cookies(cookies)
+
+        page = await self.get(self.my_page_url)
+        if self.is_logged_in(page):
+            if store is not None:
+                store.hit()
+            return
+        if cookies is not None:
+            # start over, the csrf token of the page is bound to old cookies
+            store.expire(self.clocker.email)
+            self.client.cookies.clear()
+            page = await self.get(self.my_page_url)
+
+        button = page.soup.select_one(".attendance-button-mfid")
+        if button is None:
+            raise BackendError(f"MFID login button not found in {page.url}")
+        if button.name == "a":
+            page = await self.get(urljoin(page.url, button["href"]))
+        else:
+            page = await self.submit(
+                page, form_of(button, page), submitter=button)
+
+        elem = page.soup.find(id="mfid_user[email]")
+        if elem is None:
+            raise BackendError(f"Email field not found in {page.url}")
+        page = await self.submit(
+            page, form_of(elem, page),
+            {elem["name"]: self.clocker.email},
+            submitter=page.soup.find(id="submitto"))
+
+        elem = page.soup.find(id="mfid_user[password]")
+        if elem is None:
+            raise BackendError(f"Password field not found in {page.url}")
+        page = await self.submit(
+            page, form_of(elem, page),
+            {elem["name"]: self.clocker.password},
+            submitter=page.soup.find(id="submitto"))
+
+        if not self.is_logged_in(page):
+            raise BackendError(f"Login failed. Landed on {page.url}")
+        if store is not None:
+            store.save(self.clocker.email, self.get_cookies())
+
+    async def _clock(self, css_class: str) -> None:
+        page = await self.get(self.my_page_url)
+        button = page.soup.select_one(f'div[class="{css_class}"] > button')
+        if button is None:
+            raise BackendError(f"{css_class} button not found")
+        if button.has_attr("disabled"):
+            raise BackendError(f"{css_class} button is disabled")
+
+        # the browser fills geolocation by javascript
+        form = form_of(button, page)
+        values = {}
+        for name, _ in form_fields(form) if form is not None else []:
+            if "latitude" in name:
+                values[name] = str(self.clocker.latitude)
+            elif "longitude" in name:
+                values[name] = str(self.clocker.longitude)
+
+        self.submitted = True
+        await self.submit(page, form, values, submitter=button)
+
+    async def clock_in(self) -> None:
+        await self._clock("clock_in")
+
+    async def clock_out(self) -> None:
+        await self._clock("clock_out")
+
+    async def apply_telework(self) -> None:
+        clocker = self.clocker
+        page = await self.get(
+            f"{self.my_page_url}/workflow_requests"
+            f"/attendances/new?date={clocker.day2apply}")
+        comment = page.soup.find(id="workflow_request_comment")
+        if comment is None:
+            raise BackendError(f"Comment field not found in {page.url}")
+        form = form_of(comment, page)
+        if form is None:
+            raise BackendError(f"Form of the comment not found in {page.url}")
+        values = {comment["name"]: clocker.details.msg}
+
+        if clocker.details.telework:
+            counter = page.soup.find(
+                "input", attrs={"class": CLASS_TELEWORK_COUNTER})
+            if counter is None:
+                raise BackendError("Telework counter not found")
+            values[counter["name"]] = "1"
+
+        # select the defined schdule type or enter custom values
+        select = page.soup.find("select", attrs={"name": FIELD_SCHEDULE_TEMPLATE})
+        if select is None:
+            raise BackendError("Schedule type select not found")
+        opts = {x.get_text().strip(): x.get("value", "")
+                for x in select.find_all("option")}
+        if clocker.schedule_type in opts:
+            values[FIELD_SCHEDULE_TEMPLATE] = opts[clocker.schedule_type]
+        else:
+            values[FIELD_SCHEDULE_TEMPLATE] = ""
+            values[FIELD_SCHEDULE_START] = str(clocker.details.clockin)
+            values[FIELD_SCHEDULE_END] = str(clocker.details.clockout)
+            values[FIELD_BREAK_START] = str(clocker.details.breakin)
+            values[FIELD_BREAK_END] = str(clocker.details.breakout)
+
+        self.submitted = True
+        page = await self.submit(
+            page, form, values,
+            submitter=form.find("input", attrs={"name": "commit"}))
+        if page.url.split("?")[0].endswith("/new"):
+            raise BackendError(f"Apply rejected. Stayed on {page.url}")
+
+
+BACKENDS = {
+    "http": HttpBackend,
+}
@@ -0,0 +1,193 @@
+"""Schedule generation inside postgres (BUILD_MODE = "sql")
+
+Builds the same rows as `core.task.build_tasks` with set-based
+`INSERT ... SELECT` statements: business days come from `generate_series`
+minus weekends and the m_holidays table, jitter from `random()`.
+Apply dates are the next business days of `core.busday`, passed for the
+few days built. Nothing but the holidays and those dates crosses the
+wire, so memory of the api process stays flat however many users there
+are. tests/test_build_sql.py checks both modes build the same rows.
+"""
+from typing import List
+import datetime
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import DateTime, Integer, bindparam, delete, text
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import model
+from database.database import transaction
+from core.busday import next_business_day
+from core.holiday import HolidayCalendar, get_calendar
+from core.timing import PhaseTimer
+
+
+# shared by every statement. a user is built from the later of today
+# and its horizon, when that is before `until`
+_CTE = """
+WITH params AS (
+    SELECT CAST(:today AS timestamp) AS today,
+           CAST(:until AS timestamp) AS until,
+           CAST(:now AS timestamp) AS now,
+           CAST(:user_ids AS integer[]) AS user_ids,
+           CAST(:jitter AS integer) AS jitter
+),
+users AS (
+    SELECT b.user_id,
+           ARRAY[b.clockin_type_name, b.clockout_type_name,
+                 b.schedule_type_name] AS type_names,
+           GREATEST(COALESCE(h.built_until, p.today), p.today) AS build_from
+    FROM t_basic_types b
+    CROSS JOIN params p
+    LEFT JOIN t_schedule_horizons h ON h.user_id = b.user_id
+    WHERE b.clockin_type_name IS NOT NULL
+      AND b.clockout_type_name IS NOT NULL
+      AND b.schedule_type_name IS NOT NULL
+      AND (p.user_ids IS NULL OR b.user_id = ANY(p.user_ids))
+      AND GREATEST(COALESCE(h.built_until, p.today), p.today) < p.until
+),
+days AS (
+    SELECT d AS day
+    FROM params p,
+         generate_series(p.today, p.until - interval '1 day',
+                         interval '1 day') AS d
+    WHERE extract(isodow FROM d) < 6
+      AND NOT EXISTS (
+          SELECT 1 FROM m_holidays x WHERE x.holiday = CAST(d AS date))
+)
+"""
+
+_JITTER = "(floor(random() * 2 * p.jitter) - p.jitter) * interval '1 second'"
+
+INSERT_CLOCK_SCHEDULES = _CTE + f"""
+INSERT INTO t_clock_schedules
+    (user_id, work_type_id, run_type, run_date, run_time, applied, active)
+SELECT e.user_id, e.work_type_id, e.run_type,
+       date_trunc('day', e.run_time), e.run_time,
+       'pending'::enum_task_status, true
+FROM (
+    SELECT u.user_id, w.id AS work_type_id, w.run_type, p.now,
+           d.day + w.run_time + {_JITTER} AS run_time
+    FROM users u
+    CROSS JOIN params p
+    JOIN m_work_types w ON w.type_name = ANY(u.type_names)
+    JOIN days d ON d.day >= u.build_from
+) e
+WHERE e.run_time > e.now
+ON CONFLICT DO NOTHING
+"""
+
+# apply dates of the run dates, from `core.busday.next_business_day`
+# like the pandas mode
+INSERT_APPLIED_SCHEDULES = _CTE + f""",
+apply_days AS (
+    SELECT *
+    FROM unnest(CAST(:run_dates AS timestamp[]),
+                CAST(:apply_dates AS timestamp[])) AS x(run_date, apply_date)
+)
+INSERT INTO t_applied_schedules
+    (user_id, schedule_type_id, run_type, run_date, run_time, apply_date,
+     applied, active)
+SELECT e.user_id, e.schedule_type_id,
+       '実績スケジュール申請'::enum_run_type_name,
+       date_trunc('day', e.run_time), e.run_time, a.apply_date,
+       'pending'::enum_task_status, true
+FROM (
+    SELECT u.user_id, s.id AS schedule_type_id, p.now,
+           d.day + s.run_time + {_JITTER} AS run_time
+    FROM users u
+    CROSS JOIN params p
+    JOIN m_work_schedule_types s ON s.type_name = ANY(u.type_names)
+    JOIN days d ON d.day >= u.build_from
+) e
+LEFT JOIN apply_days a ON a.run_date = date_trunc('day', e.run_time)
+WHERE e.run_time > e.now
+ON CONFLICT DO NOTHING
+"""
+
+UPSERT_HORIZONS = _CTE + """
+INSERT INTO t_schedule_horizons (user_id, built_until, updated_at)
+SELECT u.user_id, p.until, p.now
+FROM users u
+CROSS JOIN params p
+ON CONFLICT (user_id) DO UPDATE
+SET built_until = EXCLUDED.built_until, updated_at = EXCLUDED.updated_at
+"""
+
+
+def _stmt(sql: str, *arrays: str):
+    return text(sql).bindparams(
+        bindparam("user_ids", type_=ARRAY(Integer)),
+        *[bindparam(x, type_=ARRAY(DateTime)) for x in arrays])
+
+
+def _to_datetimes(days: np.ndarray) -> List[datetime.datetime]:
+    return days.astype("datetime64[us]").astype(datetime.datetime).tolist()
+
+
+async def sync_holidays(
+        session: AsyncSession,
+        since: datetime.date,
+        calendar: HolidayCalendar = None) -> int:
+    """Replace m_holidays with holidays of the calendar from `since`.
+    Must run in a transaction.
+    """
+    calendar = calendar or get_calendar()
+    calendar.ensure_loaded()
+    holidays = calendar.holidays[
+        calendar.holidays >= np.datetime64(since, "D")]
+    await session.execute(delete(model.m_holidays))
+    if len(holidays):
+        await session.execute(insert(model.m_holidays).values(
+            [{"holiday": x} for x in holidays.astype(datetime.date)]))
+    return len(holidays)
+
+
+async def build_tasks_sql(
+        session: AsyncSession,
+        logger: logging.Logger,
+        n_days: int,
+        timer: PhaseTimer = None,
+        user_ids: List[int] = None,
+        jitter_seconds: int = 300) -> None:
+    """Build tasks of the next `n_days` days in one transaction.
+    See `core.task.build_tasks` for the arguments.
+    """
+    timer = timer or PhaseTimer()
+    now = datetime.datetime.now()
+    today = pd.Timestamp(now).normalize()
+    until = today + pd.Timedelta(n_days, "D")
+    # jitter may move a run time to the day before its build day. Raises
+    # or warns like the pandas mode if holidays are not covered
+    run_dates = np.arange(
+        np.datetime64(today.date() - datetime.timedelta(days=1), "D"),
+        np.datetime64(until.date(), "D"))
+    apply_dates = next_business_day(run_dates)
+
+    params = {
+        "today": today.to_pydatetime(),
+        "until": until.to_pydatetime(),
+        "now": now,
+        "user_ids": None if user_ids is None else [int(x) for x in user_ids],
+        "jitter": jitter_seconds,
+    }
+    async with transaction(session):
+        with timer.phase("sync_holidays") as phase:
+            phase.rows += await sync_holidays(session, since=today.date())
+        with timer.phase("insert_clock_schedules") as phase:
+            res = await session.execute(_stmt(INSERT_CLOCK_SCHEDULES), params)
+            phase.rows += max(res.rowcount, 0)
+        with timer.phase("insert_applied_schedules") as phase:
+            res = await session.execute(
+                _stmt(INSERT_APPLIED_SCHEDULES, "run_dates", "apply_dates"),
+                {**params,
+                 "run_dates": _to_datetimes(run_dates),
+                 "apply_dates": _to_datetimes(apply_dates)})
+            phase.rows += max(res.rowcount, 0)
+        with timer.phase("update_horizons") as phase:
+            res = await session.execute(_stmt(UPSERT_HORIZONS), params)
+            phase.rows += max(res.rowcount, 0)
+    logger.info(f"Built schedules in database: {timer.summary()}")
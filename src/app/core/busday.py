@@ -0,0 +1,88 @@
+"""Business day arithmetic over arrays of dates
+
+Every function takes a scalar or array-like of dates
+(str, datetime, pd.Timestamp, pd.Series, np.datetime64) and returns
+a numpy array, so schedules are computed in one vectorized pass.
+Business days are mon-fri excluding holidays of `core.holiday`.
+"""
+import numpy as np
+import pandas as pd
+
+from core.holiday import get_calendar, HolidayCalendar
+
+
+WEEKMASK = "1111100"
+
+_busdaycal: np.busdaycalendar = None
+_busdaycal_holidays: np.ndarray = None
+
+
+def get_busday_calendar(
+        calendar: HolidayCalendar = None) -> np.busdaycalendar:
+    """Return holiday mask for np.busday_* functions
+
+    The mask is rebuilt only when the holiday calendar is refreshed.
+    """
+    global _busdaycal, _busdaycal_holidays
+    calendar = calendar or get_calendar()
+    calendar.ensure_loaded()
+    holidays = calendar.holidays
+    if holidays is not _busdaycal_holidays:
+        _busdaycal = np.busdaycalendar(weekmask=WEEKMASK, holidays=holidays)
+        _busdaycal_holidays = holidays
+    return _busdaycal
+
+
+def to_days(dates) -> np.ndarray:
+    """Cast dates to a 1d datetime64[D] array"""
+    if isinstance(dates, (pd.Series, pd.Index)):
+        dates = dates.values
+    elif np.isscalar(dates) or not hasattr(dates, "__len__"):
+        dates = [pd.Timestamp(dates).to_datetime64()]
+    dates = pd.to_datetime(np.asarray(dates).ravel())
+    return dates.values.astype("datetime64[D]")
+
+
+def _check_covered(days: np.ndarray, calendar: HolidayCalendar) -> None:
+    if len(days):
+        calendar.check_covered(days.max().astype(object))
+
+
+def is_business_day(dates, calendar: HolidayCalendar = None) -> np.ndarray:
+    calendar = calendar or get_calendar()
+    days = to_days(dates)
+    mask = np.is_busday(days, busdaycal=get_busday_calendar(calendar))
+    _check_covered(days[mask], calendar)
+    return mask
+
+
+def offset_business_days(
+        dates, n, calendar: HolidayCalendar = None) -> np.ndarray:
+    """Shift dates by `n` business days
+
+    Non business days are rolled forward before shifting,
+    so `n=0` returns the date itself or the next business day.
+    """
+    calendar = calendar or get_calendar()
+    days = np.busday_offset(
+        to_days(dates), n, roll="forward",
+        busdaycal=get_busday_calendar(calendar))
+    _check_covered(days, calendar)
+    return days
+
+
+def next_business_day(dates, calendar: HolidayCalendar = None) -> np.ndarray:
+    """First business day strictly after each date"""
+    calendar = calendar or get_calendar()
+    days = to_days(dates) + np.timedelta64(1, "D")
+    return offset_business_days(days, 0, calendar=calendar)
+
+
+def business_days(start, end, calendar: HolidayCalendar = None) -> np.ndarray:
+    """Business days in [start, end)"""
+    calendar = calendar or get_calendar()
+    start, end = to_days(start)[0], to_days(end)[0]
+    days = np.arange(start, end, dtype="datetime64[D]")
+    days = days[np.is_busday(days, busdaycal=get_busday_calendar(calendar))]
+    _check_covered(days, calendar)
+    return days
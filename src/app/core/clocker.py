@@ -1,17 +1,17 @@
-from typing import Any
-import time
+from typing import Any, List, TYPE_CHECKING
+import asyncio
 import datetime
 import logging
 import re
 import os
 from dataclasses import dataclass
-from functools import wraps
+from concurrent.futures import Executor
+from functools import partial
 import json
 import traceback
 
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support.select import Select
 from selenium.webdriver.common.keys import Keys
 from selenium import webdriver
@@ -23,19 +23,91 @@ from database.model import (
 )
 
 from database.schemas import M_WORK_SCHEDULE_TYPES
+from core.config import settings
+from core.waits import Waiter
 
-
-DEFAULT_MSG = "現場規定により在宅勤務いたします。ご確認お願い致します。"
+if TYPE_CHECKING:
+    from core.driver_pool import DriverPool
+    from core.session_store import SessionStore
 
 
-def sleep(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        time.sleep(3)
-        r = func(*args, **kwargs)
-        time.sleep(3)
-        return r
-    return wrapper
+DEFAULT_MSG = "現場規定により在宅勤務いたします。ご確認お願い致します。"
+ORIGIN = settings.ATTENDANCE_ORIGIN
+MY_PAGE_URL = f"{ORIGIN}/my_page"
+
+# form fields of the attendance schedule request
+_FIELD_ATTENDANCE = (
+    "workflow_request[workflow_request_content_attendance_attributes]")
+_FIELD_SCHEDULE = (
+    f"{_FIELD_ATTENDANCE}"
+    "[workflow_request_content_attendance_attendance_schedule_attributes]")
+_FIELD_BREAK = (
+    f"{_FIELD_ATTENDANCE}"
+    "[workflow_request_content_attendance_break_time_schedules_attributes]")
+FIELD_SCHEDULE_TEMPLATE = f"{_FIELD_SCHEDULE}[attendance_schedule_template_id]"
+FIELD_SCHEDULE_START = f"{_FIELD_SCHEDULE}[start_time]"
+FIELD_SCHEDULE_END = f"{_FIELD_SCHEDULE}[end_time]"
+FIELD_BREAK_START = f"{_FIELD_BREAK}[0][start_time]"
+FIELD_BREAK_END = f"{_FIELD_BREAK}[0][end_time]"
+CLASS_TELEWORK_COUNTER = "custom-counter-input attendance-input-field-small"
+
+USER_AGENT = (
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 13_3_1 '
+    'like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
+    'Mobile/15E148 [FBAN/FBIOS;FBDV/iPhone9,1;FBMD/iPhone;'
+    'FBSN/iOS;FBSV/13.3.1;FBSS/2;FBID/phone;FBLC/en_US;'
+    'FBOP/5;FBCR/]')
+
+
+def send_cdp(driver, cmd, params={}):
+    """Supprt for remote driver.
+    Works like `driver.execute_cdp_cmd`
+    """
+    resource = ("/session/%s/chromium/send_command_and_get_result" %
+                driver.session_id)
+    url = driver.command_executor._url + resource
+    body = json.dumps({'cmd': cmd, 'params': params})
+    response = driver.command_executor._request('POST', url, body)
+    return response.get('value')
+
+
+def create_driver(logger) -> webdriver.Remote:
+    options = Options()
+
+    options.add_argument("--dns-prefetch-disable")
+    options.add_argument("--start-maximized")
+    options.add_argument("--enable-automation")
+    options.add_argument("--headless")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-infobars")
+    options.add_argument('--disable-extensions')
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-browser-side-navigation")
+    options.add_argument("--disable-gpu")
+    options.add_argument('--ignore-certificate-errors')
+    options.add_argument('--ignore-ssl-errors')
+    prefs = {"profile.default_content_setting_values.notifications" : 2}
+    options.add_experimental_option("prefs", prefs)
+    options.headless = True
+
+    options.add_argument(f'--user-agent={USER_AGENT}')
+
+    logger.info("    do init driver")
+    driver = webdriver.Remote(
+        command_executor = os.environ["SELENIUM_URL"],
+        options = options,
+        # enable_cdp_events=True,
+        # headless=True,
+    )
+    # every lookup waits explicitly with `Waiter`
+    driver.implicitly_wait(0)
+
+    send_cdp(driver, "Browser.grantPermissions", {
+            "origin": MY_PAGE_URL,
+            "permissions": ["geolocation"]
+        }
+    )
+    return driver
 
 
 class Clocker:
@@ -49,9 +121,19 @@ class Clocker:
             runner: ENUM_RUN_TYPE_NAME = None,
             day2apply: str = None,
             details: M_WORK_SCHEDULE_TYPES = None,
+            driver_pool: "DriverPool" = None,
+            session_store: "SessionStore" = None,
+            backend: str = None,
             debug: bool = False) -> None:
         self.email = email
         self.password = password
+        self.session_store = session_store
+        self.backend = backend or settings.CLOCKER_BACKEND
+        if self.backend not in ("selenium", "http"):
+            raise ValueError(
+                f"backend must be 'selenium' or 'http': '{self.backend}'")
+        self.driver_pool = driver_pool
+        self.driver = None
 
         # run clockin/out if schedule_type is not assgined
         if schedule_type is None:
@@ -96,6 +178,7 @@ class Clocker:
         )
 
     def __call__(self, logger, *args: Any, **kwds: Any) -> None:
+        error = False
         try:
             logger.info(f"RUNNING: {self.__str__()}")
             self.init_driver(logger)
@@ -104,14 +187,38 @@ class Clocker:
             getattr(self, self.runner)()
             logger.info(f"[E] {self.runner}")
         except Exception:
+            error = True
             logger.error(traceback.format_exc())
             raise
         finally:
             try:
-                self.driver.close()
+                if self.driver is not None:
+                    self.dispose_driver(logger, error=error)
             except Exception as e:
                 logger.error(f"Error when dispose driver: {e}")
 
+    async def arun(self, logger, executor: Executor = None) -> None:
+        """Run without blocking the event loop.
+
+        Selenium runs in `executor`. Other backends run on the loop and
+        fall back to selenium if they failed before submitting anything.
+        """
+        if self.backend != "selenium":
+            from core.backends import BACKENDS
+
+            backend = BACKENDS[self.backend](self, logger)
+            try:
+                logger.info(f"RUNNING ({self.backend}): {self.__str__()}")
+                return await backend()
+            except Exception:
+                logger.error(traceback.format_exc())
+                if backend.submitted or (not settings.CLOCKER_HTTP_FALLBACK):
+                    raise
+                logger.warning(f"Fallback to selenium: {self.__str__()}")
+
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, partial(self, logger=logger))
+
     def __transfer_enum_run_type(self, enum_type: ENUM_RUN_TYPE_NAME):
         if enum_type == ENUM_RUN_TYPE_NAME.cin:
             return "clock_in"
@@ -123,87 +230,86 @@ class Clocker:
 
     def init_driver(self, logger):
         logger.info("[S] init driver")
-        options = Options()
-
-        options.add_argument("--dns-prefetch-disable")
-        options.add_argument("--start-maximized")
-        options.add_argument("--enable-automation")
-        options.add_argument("--headless")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-infobars")
-        options.add_argument('--disable-extensions')
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--disable-browser-side-navigation")
-        options.add_argument("--disable-gpu")
-        options.add_argument('--ignore-certificate-errors')
-        options.add_argument('--ignore-ssl-errors')
-        prefs = {"profile.default_content_setting_values.notifications" : 2}
-        options.add_experimental_option("prefs", prefs)
-        options.headless = True
-
-        options.add_argument(
-            '--user-agent=Mozilla/5.0 (iPhone; CPU iPhone OS 13_3_1 '
-            'like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) '
-            'Mobile/15E148 [FBAN/FBIOS;FBDV/iPhone9,1;FBMD/iPhone;'
-            'FBSN/iOS;FBSV/13.3.1;FBSS/2;FBID/phone;FBLC/en_US;'
-            'FBOP/5;FBCR/]')
-        
-        logger.info("    do init driver")
-        self.driver = webdriver.Remote(
-            command_executor = os.environ["SELENIUM_URL"],
-            options = options,
-            # enable_cdp_events=True,
-            # headless=True,
-        )
-        self.driver.implicitly_wait(10)
+        if self.driver_pool is None:
+            self.driver = create_driver(logger)
+        else:
+            self.driver = self.driver_pool.checkout(logger, user=self.email)
+        self.wait = Waiter(self.driver, logger=logger)
         logger.info("[E] init driver")
 
         logger.info("[S] Access mypage")
-        self.driver.get('https://attendance.moneyforward.com/my_page')
-
-
-        def send(driver, cmd, params={}):
-            """Supprt for remote driver.
-            Works like `driver.execute_cdp_cmd`
-            """
-            resource = ("/session/%s/chromium/send_command_and_get_result" %
-                        driver.session_id)
-            url = driver.command_executor._url + resource
-            body = json.dumps({'cmd': cmd, 'params': params})
-            response = driver.command_executor._request('POST', url, body)
-            return response.get('value')
-
-        send(self.driver, "Browser.grantPermissions", {
-                "origin": "https://attendance.moneyforward.com/my_page",
-                "permissions": ["geolocation"]
-            }
-        )
+        self.driver.get(MY_PAGE_URL)
+        self.wait.navigation(ORIGIN, "page")
+        self.set_geolocation()
+        logger.info("[E] Access mypage")
 
+    def set_geolocation(self):
         # GPS geolocation setup
         if self.runner != "apply_telework":
-            send(self.driver, "Emulation.setGeolocationOverride", {
+            send_cdp(self.driver, "Emulation.setGeolocationOverride", {
                     "latitude": self.latitude,
                     "longitude": self.longitude,
                     "accuracy": 100,
                 },
         )
-        logger.info("[E] Access mypage")
+
+    def dispose_driver(self, logger, error: bool = False):
+        if self.driver_pool is None:
+            self.driver.close()
+        else:
+            self.driver_pool.checkin(
+                self.driver, logger, error=error, user=self.email)
 
     @staticmethod
     def today() -> str:
         return datetime.datetime.today().strftime("%Y-%m-%d")
 
+    def restore_session(self) -> bool:
+        """Restore saved cookies. Return True if still logged in."""
+        cookies = self.session_store.load(self.email)
+        if cookies is None:
+            return False
+
+        send_cdp(self.driver, "Network.setCookies", {"cookies": cookies})
+        self.driver.get(MY_PAGE_URL)
+        self.wait.navigation(ORIGIN, "login")
+        if self.is_logged_in():
+            self.session_store.hit()
+            return True
+        self.session_store.expire(self.email)
+        return False
+
+    def save_session(self) -> None:
+        cookies = send_cdp(self.driver, "Network.getAllCookies")["cookies"]
+        self.session_store.save(self.email, cookies)
+
+    def is_logged_in(self) -> bool:
+        return self.driver.current_url.startswith(MY_PAGE_URL) and (
+            not self.driver.find_elements(
+                By.CLASS_NAME, "attendance-button-mfid"))
+
     def login(self):
-        self.driver.find_element(
-            By.CLASS_NAME, "attendance-button-mfid").click()
-        self.driver.find_element(
-            By.ID, "mfid_user[email]").send_keys(self.email)
-        self.driver.find_element(By.ID, "submitto").click()
-        self.driver.find_element(
-            By.ID, "mfid_user[password]").send_keys(self.password)
-        self.driver.find_element(By.ID, "submitto").click()
-
-    # @sleep
+        # the pool kept the login of the last task of this user
+        if (self.driver_pool is not None) and (
+                self.driver_pool.session_user(self.driver) == self.email) \
+                and self.is_logged_in():
+            return
+        if (self.session_store is not None) and self.restore_session():
+            return
+
+        self.wait.enabled(
+            (By.CLASS_NAME, "attendance-button-mfid"), "login").click()
+        self.wait.visible(
+            (By.ID, "mfid_user[email]"), "login").send_keys(self.email)
+        self.wait.enabled((By.ID, "submitto"), "login").click()
+        self.wait.visible(
+            (By.ID, "mfid_user[password]"), "login").send_keys(self.password)
+        self.wait.enabled((By.ID, "submitto"), "login").click()
+        self.wait.navigation(MY_PAGE_URL, "login")
+
+        if self.session_store is not None:
+            self.save_session()
+
     # def open_edit_panel(self):
     #     """Must work with `set_telework` or `set_scheduled_time`
     #     """
@@ -214,47 +320,38 @@ class Clocker:
     #         f'{Clocker.today()}/edit" and @data-action="click->side-'
     #         'modal-link#openSideModal"]').click()
 
-    @sleep
     def commit_edit_panel(self):
         """Must work with `set_telework` or `set_scheduled_time`
         """
-        self.driver.find_element(
-            By.XPATH, "//input[@name='commit']").click()
+        elem = self.wait.enabled(
+            (By.XPATH, "//input[@name='commit']"), "apply_telework")
+        elem.click()
+        self.wait.confirmed(elem, "apply_telework")
 
     def set_telework(self):
-        revealed = self.driver.find_element(
-            By.XPATH,
-            "//input[@class='custom-counter-input "
-            "attendance-input-field-small']"
+        revealed = self.wait.visible(
+            (By.XPATH, f"//input[@class='{CLASS_TELEWORK_COUNTER}']"),
+            "apply_telework",
         )
-        wait = WebDriverWait(self.driver, timeout=5)
-        wait.until(lambda _: revealed.is_displayed())
         revealed.send_keys("1")
 
-    @sleep
     def set_scheduled_time(self):
-        def clear_and_input(elem, s: str):
+        def clear_and_input(locator, s: str):
             # Keys.CONTROL + "a may not work in mac
             # elem.send_keys(Keys.CONTROL + "a")
             if s is None:
                 return
 
+            elem = self.wait.visible(locator, "apply_telework")
             for _ in range(10):
                 elem.send_keys(Keys.BACKSPACE)
-            # time.sleep(3)
             elem.send_keys(s)
 
         # set schedule clock type
-        revealed = self.driver.find_element(
-            By.XPATH,
-            "//select[@name='workflow_request"
-            "[workflow_request_content_attendance_attributes]"
-            "[workflow_request_content_attendance_attendance_schedule_attributes]"
-            "[attendance_schedule_template_id]']",
+        revealed = self.wait.visible(
+            (By.XPATH, f"//select[@name='{FIELD_SCHEDULE_TEMPLATE}']"),
+            "apply_telework",
         )
-
-        wait = WebDriverWait(self.driver, timeout=5)
-        wait.until(lambda _: revealed.is_displayed())
         select = Select(revealed)
 
         # select the defined schdule type
@@ -270,85 +367,140 @@ class Clocker:
         # select.select_by_index(0)
 
         # enter schedule clock-in time
-        elem_in = self.driver.find_element(
-            By.XPATH,
-            "//input[@name='workflow_request"
-            "[workflow_request_content_attendance_attributes]"
-            "[workflow_request_content_attendance_attendance_schedule_attributes]"
-            "[start_time]']"
+        clear_and_input(
+            (By.XPATH, f"//input[@name='{FIELD_SCHEDULE_START}']"),
+            str(self.details.clockin),
         )
 
-        clear_and_input(elem_in, str(self.details.clockin))
-
         # enter schedule clock-out time
-        elem_out = self.driver.find_element(
-            By.XPATH,
-            "//input[@name='workflow_request"
-            "[workflow_request_content_attendance_attributes]"
-            "[workflow_request_content_attendance_attendance_schedule_attributes]"
-            "[end_time]']"
+        clear_and_input(
+            (By.XPATH, f"//input[@name='{FIELD_SCHEDULE_END}']"),
+            str(self.details.clockout),
         )
-        clear_and_input(elem_out, str(self.details.clockout))
 
         # enter schedule break-in time
-        elem_out = self.driver.find_element(
-            By.XPATH,
-            "//input[@name='workflow_request"
-            "[workflow_request_content_attendance_attributes]"
-            "[workflow_request_content_attendance_break_time_schedules_attributes]"
-            "[0][start_time]']"
+        clear_and_input(
+            (By.XPATH, f"//input[@name='{FIELD_BREAK_START}']"),
+            str(self.details.breakin),
         )
-        clear_and_input(elem_out, str(self.details.breakin))
 
         # enter schedule break-out time
-        elem_out = self.driver.find_element(
-            By.XPATH,
-            "//input[@name='workflow_request"
-            "[workflow_request_content_attendance_attributes]"
-            "[workflow_request_content_attendance_break_time_schedules_attributes]"
-            "[0][end_time]']"
+        clear_and_input(
+            (By.XPATH, f"//input[@name='{FIELD_BREAK_END}']"),
+            str(self.details.breakout),
         )
-        clear_and_input(elem_out, str(self.details.breakout))
 
-    @sleep
     def clock_in(self):
-        revealed = self.driver.find_element(
-            By.XPATH,
-            "//div[@class='clock_in'][1]/button"
-        )
-        wait = WebDriverWait(self.driver, timeout=10)
-        wait.until(lambda _: revealed.is_enabled())
+        revealed = self.wait.enabled(
+            (By.XPATH, "//div[@class='clock_in'][1]/button"), "clock_in")
         revealed.click()
+        self.wait.confirmed(revealed, "clock_in")
 
-    @sleep
     def apply_telework(self):
-        url = ("https://attendance.moneyforward.com/"
-               "my_page/workflow_requests"
+        url = (f"{MY_PAGE_URL}/workflow_requests"
                f"/attendances/new?date={self.day2apply}")
         self.driver.get(url)
+        self.wait.navigation(
+            f"{MY_PAGE_URL}/workflow_requests", "apply_telework")
         if self.details.telework:
             self.set_telework()
         self.set_scheduled_time()
-        elem = self.driver.find_element(By.ID, "workflow_request_comment")
+        elem = self.wait.visible(
+            (By.ID, "workflow_request_comment"), "apply_telework")
         elem.send_keys(self.details.msg)
         self.commit_edit_panel()
 
-    @sleep
     def clock_out(self):
-        revealed = self.driver.find_element(
-            By.XPATH,
-            "//div[@class='clock_out'][1]/button"
-        )
-        wait = WebDriverWait(self.driver, timeout=10)
-        wait.until(lambda _: revealed.is_enabled())
+        revealed = self.wait.enabled(
+            (By.XPATH, "//div[@class='clock_out'][1]/button"), "clock_out")
         revealed.click()
+        self.wait.confirmed(revealed, "clock_out")
 
-    # @sleep
     # def break_in(self):
     #     self.driver.find_element(
     #         By.XPATH, "//div[@class='start_break'][1]/button").click()
 
-    # @sleep
     # def break_out(self):
     #     self.driver.find_element(
     #         By.XPATH, "//div[@class='end_break'][1]/button").click()
+
+
+class ClockerBatch:
+    """Clockers of one user run in a single session
+
+    Logs in once with the first clocker, then runs the action of every
+    clocker in order. A failed action does not stop the following ones.
+    Running returns the exception of each clocker, None for success.
+    """
+
+    def __init__(self, clockers: List[Clocker]) -> None:
+        if len(set(x.email for x in clockers)) != 1:
+            raise ValueError("Clockers of a batch must share one user")
+        self.clockers = clockers
+        self.head = clockers[0]
+        self.backend = self.head.backend
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    def __str__(self) -> str:
+        return (
+            f"<ClockerBatch user: {self.head.email}, "
+            f"tasks: {[x.runner for x in self.clockers]}>"
+        )
+
+    def __call__(self, logger, *args: Any, **kwds: Any) -> List[Exception]:
+        head = self.head
+        results = [None] * len(self.clockers)
+        error = False
+        try:
+            logger.info(f"RUNNING: {self.__str__()}")
+            head.init_driver(logger)
+            head.login()
+            clockers = self.clockers
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            results = [e] * len(self.clockers)
+            error = True
+            clockers = []
+
+        for i, clocker in enumerate(clockers):
+            clocker.driver, clocker.wait = head.driver, head.wait
+            try:
+                logger.info(f"[S] {clocker}")
+                if clocker.runner != "apply_telework":
+                    clocker.driver.get(MY_PAGE_URL)
+                    clocker.wait.navigation(MY_PAGE_URL, "page")
+                    clocker.set_geolocation()
+                getattr(clocker, clocker.runner)()
+                logger.info(f"[E] {clocker.runner}")
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                results[i] = e
+                error = True
+
+        try:
+            if head.driver is not None:
+                head.dispose_driver(logger, error=error)
+        except Exception as e:
+            logger.error(f"Error when dispose driver: {e}")
+        return results
+
+    async def arun(
+            self, logger, executor: Executor = None) -> List[Exception]:
+        """Run without blocking the event loop. See `Clocker.arun`"""
+        if self.backend != "selenium":
+            from core.backends import BACKENDS
+
+            backend = BACKENDS[self.backend](self.head, logger)
+            try:
+                logger.info(f"RUNNING ({self.backend}): {self.__str__()}")
+                return await backend.run_batch(self.clockers)
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                if backend.submitted or (not settings.CLOCKER_HTTP_FALLBACK):
+                    return [e] * len(self.clockers)
+                logger.warning(f"Fallback to selenium: {self.__str__()}")
+
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, partial(self, logger=logger))
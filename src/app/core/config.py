@@ -0,0 +1,67 @@
+from typing import Dict
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    ATTENDANCE_ORIGIN: str = "https://attendance.moneyforward.com"
+
+    # holiday calendar
+    HOLIDAY_CSV_URL: str = (
+        "https://www8.cao.go.jp/chosei/shukujitsu/syukujitsu.csv")
+    HOLIDAY_CACHE_PATH: str = "holiday_cache.json"
+    # refetch the csv once the cache is older than this
+    HOLIDAY_REFRESH_HOURS: float = 24
+    # "raise" or "warn" when a date is not covered by the cached csv
+    HOLIDAY_STALE_POLICY: str = "raise"
+
+    # clocker jobs running at the same time
+    CLOCKER_POOL_SIZE: int = 4
+    # idle webdriver sessions kept for clocker jobs. 0 disables the pool
+    DRIVER_POOL_SIZE: int = 2
+    # recycle a session after this number of tasks
+    DRIVER_POOL_MAX_USES: int = 20
+
+    # seconds each clocker step waits for the page. Like: {"login": 20}
+    WAIT_TIMEOUTS: Dict[str, float] = {
+        "default": 10,
+        "login": 15,
+        "apply_telework": 15,
+    }
+    WAIT_POLL_SECONDS: float = 0.2
+    # confirmation banner shown after clock in/out and apply.
+    # Empty to skip the check
+    WAIT_BANNER_XPATH: str = ""
+
+    # "selenium" or "http"
+    CLOCKER_BACKEND: str = "selenium"
+    # rerun with selenium when the http backend failed before submitting
+    CLOCKER_HTTP_FALLBACK: bool = True
+    HTTP_TIMEOUT_SECONDS: float = 30
+
+    # Fernet key encrypting saved login sessions. Empty disables the store.
+    # Generate with `cryptography.fernet.Fernet.generate_key()`
+    SESSION_STORE_KEY: str = ""
+    SESSION_STORE_PATH: str = "sessions"
+    SESSION_STORE_MAX_AGE_HOURS: float = 12
+
+    # days ahead schedules are built for
+    N_DAYS2BUILD: int = 14
+    # "pandas" expands schedules in python, "sql" inside postgres
+    BUILD_MODE: str = "pandas"
+
+    # runner id stamped on claimed tasks. Empty for "<hostname>:<pid>"
+    WORKER_ID: str = ""
+    # running tasks not renewed for this long are run again by any runner
+    LEASE_SECONDS: float = 300
+
+    # tasks of a user due within this many seconds after the first one
+    # run in one login session, so they may run up to this much before
+    # their run_time. Keep it well below the jitter of the run times.
+    # 0 disables coalescing, only tasks already due run together
+    COALESCE_WINDOW_SECONDS: float = 60
+
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+
+settings = Settings()
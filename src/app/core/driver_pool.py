@@ -0,0 +1,253 @@
+from typing import Callable, Dict, List
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+
+from selenium import webdriver
+
+from core.clocker import ORIGIN, MY_PAGE_URL, create_driver, send_cdp
+
+
+@dataclass
+class PooledDriver:
+    driver: webdriver.Remote
+    uses: int = 0
+    # last time the session received a command from the pool
+    touched_at: float = field(default_factory=time.monotonic)
+    # user whose login the session kept, None once reset
+    user: str = None
+
+
+class DriverPool:
+    """Pool of pre-launched WebDriver sessions
+
+    `checkout` hands out an idle session (hit) or launches a new one
+    (miss). `checkin` keeps the session for the next task, unless it
+    failed, reached `max_uses` or the pool already holds `size` idle
+    sessions. A session checked in for a user keeps its login and page,
+    and is preferred by the next checkout of that user. Cookies, storage
+    and the geolocation override are reset before another user gets it.
+    Thread safe, sessions are used from `ClockerPool` workers.
+    """
+
+    def __init__(
+            self,
+            size: int,
+            max_uses: int = 20,
+            max_idle_seconds: float = 240,
+            factory: Callable[[logging.Logger], webdriver.Remote] =
+            create_driver) -> None:
+        self.size = size
+        self.max_uses = max_uses
+        # selenium grid drops sessions idle longer than its timeout (300s)
+        self.max_idle_seconds = max_idle_seconds
+        self.factory = factory
+
+        self._idle: List[PooledDriver] = []
+        self._in_use: Dict[str, PooledDriver] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+        self.checkout_seconds_total = 0.
+        self.checkout_seconds_max = 0.
+
+    def __repr__(self) -> str:
+        return (
+            f"<DriverPool size: {self.size}, "
+            f"idle: {len(self._idle)}, "
+            f"in_use: {len(self._in_use)}>"
+        )
+
+    def stats(self) -> Dict[str, float]:
+        checkouts = self.hits + self.misses
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "in_use": len(self._in_use),
+            "checkouts": checkouts,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / checkouts if checkouts else None,
+            "recycled": self.recycled,
+            "checkout_seconds_avg": (
+                self.checkout_seconds_total / checkouts
+                if checkouts else None),
+            "checkout_seconds_max": self.checkout_seconds_max,
+        }
+
+    def _launch(self, logger: logging.Logger) -> PooledDriver:
+        pooled = PooledDriver(driver=self.factory(logger))
+        # warm up the page cache of my_page
+        pooled.driver.get(MY_PAGE_URL)
+        return pooled
+
+    def _quit(self, pooled: PooledDriver, logger: logging.Logger) -> None:
+        with self._lock:
+            self.recycled += 1
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            logger.error(f"Error when quit driver: {e}")
+
+    def prefill(self, logger: logging.Logger) -> None:
+        """Launch sessions until `size` sessions are idle. Blocking."""
+        while len(self._idle) < self.size:
+            pooled = self._launch(logger)
+            with self._lock:
+                self._idle.append(pooled)
+        logger.info(f"Prefilled {self}")
+
+    def _pop_idle(
+            self, logger: logging.Logger, user: str = None) -> PooledDriver:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                # the session of the user, or the last used one
+                i = next((i for i, x in enumerate(self._idle)
+                          if (user is not None) and (x.user == user)), -1)
+                pooled = self._idle.pop(i)
+
+            idle_seconds = time.monotonic() - pooled.touched_at
+            if idle_seconds > self.max_idle_seconds:
+                self._quit(pooled, logger)
+                continue
+            try:
+                # health check, the grid may have dropped the session
+                pooled.driver.current_url
+                if pooled.user not in (None, user):
+                    self.reset(pooled.driver)
+                    pooled.user = None
+                return pooled
+            except Exception as e:
+                logger.warning(f"Drop dead driver session: {e}")
+                self._quit(pooled, logger)
+
+    def checkout(
+            self,
+            logger: logging.Logger,
+            user: str = None) -> webdriver.Remote:
+        """Hand out a session, the one `user` left logged in if idle"""
+        started = time.monotonic()
+        pooled = self._pop_idle(logger, user)
+        hit = pooled is not None
+        if not hit:
+            pooled = self._launch(logger)
+        pooled.uses += 1
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._in_use[pooled.driver.session_id] = pooled
+            self.checkout_seconds_total += elapsed
+            self.checkout_seconds_max = max(
+                self.checkout_seconds_max, elapsed)
+        return pooled.driver
+
+    def session_user(self, driver: webdriver.Remote) -> str:
+        """User whose login a checked out session kept, if any"""
+        with self._lock:
+            pooled = self._in_use.get(driver.session_id)
+        return None if pooled is None else pooled.user
+
+    def reset(self, driver: webdriver.Remote) -> None:
+        """Drop all state left by the previous task"""
+        send_cdp(driver, "Network.clearBrowserCookies")
+        send_cdp(driver, "Storage.clearDataForOrigin", {
+            "origin": ORIGIN,
+            "storageTypes": "local_storage,session_storage,indexeddb,"
+                            "cache_storage,service_workers",
+        })
+        send_cdp(driver, "Emulation.clearGeolocationOverride")
+        driver.get("about:blank")
+
+    def checkin(
+            self,
+            driver: webdriver.Remote,
+            logger: logging.Logger,
+            error: bool = False,
+            user: str = None) -> None:
+        """Return a session. With `user`, its login is kept for the next
+        task of the user instead of being reset
+        """
+        with self._lock:
+            pooled = self._in_use.pop(driver.session_id, None)
+        if pooled is None:
+            logger.warning("Checkin a driver not from this pool")
+            driver.quit()
+            return
+
+        if error or (pooled.uses >= self.max_uses):
+            self._quit(pooled, logger)
+            return
+
+        if user is None:
+            try:
+                self.reset(driver)
+            except Exception as e:
+                logger.warning(f"Failed to reset driver: {e}")
+                self._quit(pooled, logger)
+                return
+        pooled.user = user
+
+        pooled.touched_at = time.monotonic()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(pooled)
+                return
+        self._quit(pooled, logger)
+
+    def keepalive(self, logger: logging.Logger) -> None:
+        """Ping idle sessions before the grid drops them. Blocking."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        alive = []
+        for pooled in idle:
+            try:
+                pooled.driver.current_url
+                pooled.touched_at = time.monotonic()
+                alive.append(pooled)
+            except Exception as e:
+                logger.warning(f"Drop dead driver session: {e}")
+                self._quit(pooled, logger)
+        with self._lock:
+            self._idle.extend(alive)
+
+    def close(self, logger: logging.Logger) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._quit(pooled, logger)
+
+
+_driver_pool: DriverPool = None
+
+
+def get_driver_pool() -> DriverPool:
+    return _driver_pool
+
+
+def set_driver_pool(pool: DriverPool) -> DriverPool:
+    global _driver_pool
+    _driver_pool = pool
+    return _driver_pool
+
+
+async def background_driver_keeper(
+        pool: DriverPool,
+        logger: logging.Logger,
+        interval: float = 60):
+    while True:
+        try:
+            await asyncio.to_thread(pool.keepalive, logger)
+            await asyncio.to_thread(pool.prefill, logger)
+        except Exception as e:
+            logger.error(f"Failed to keep driver pool: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,84 @@
+"""Vectorized expansion of schedule types over business days
+
+Every row (a user with a work or schedule type) is crossed with the days
+to build as int64 nanoseconds, `run_time = day + time of day + jitter`,
+in one (rows, days) array. Days before the row's `build_from` and times
+already passed are masked out in the same pass, then the kept cells are
+gathered into the output columns.
+"""
+from typing import List
+import datetime
+
+import numpy as np
+import pandas as pd
+
+
+NS = 1_000_000_000
+NS_PER_DAY = 86400 * NS
+
+
+def time_of_day_ns(times) -> np.ndarray:
+    """Cast times of day (datetime.time, "HH:MM:SS") to int64 nanoseconds.
+    Missing values are cast to -1.
+    """
+    times = pd.Series(times)
+    not_na = times.notnull().values
+    res = np.full(len(times), -1, dtype="int64")
+    if not_na.any():
+        res[not_na] = pd.to_timedelta(times[not_na].astype(str)).to_numpy(
+            dtype="timedelta64[ns]").astype("int64")
+    return res
+
+
+def expand_schedules(
+        rows: pd.DataFrame,
+        days: np.ndarray,
+        columns: List[str],
+        time_col: str = "run_time",
+        from_col: str = "build_from",
+        jitter_seconds: int = 300,
+        now: datetime.datetime = None,
+        rng: np.random.Generator = None) -> pd.DataFrame:
+    """Cross `rows` with `days` into one row per (row, day)
+
+    Parameters
+    ----------
+    rows : pd.DataFrame
+        `time_col` holds times of day in nanoseconds, see `time_of_day_ns`.
+        Days before `from_col` (datetime64) are skipped, if the column exists
+    days : np.ndarray
+        datetime64[D] days to build
+    columns : List[str]
+        columns of `rows` copied to the output
+    jitter_seconds : int, optional
+        run times are shifted randomly in [-jitter, jitter), by default 300
+    now : datetime.datetime, optional
+        run times not after `now` are dropped, by default now
+
+    Returns
+    -------
+    pd.DataFrame
+        `columns`, `run_time` and `run_date` (the day of `run_time`)
+    """
+    rng = rng or np.random.default_rng()
+    now_ns = pd.Timestamp(now or datetime.datetime.now()).value
+    day_ns = np.asarray(days, dtype="datetime64[D]").astype(
+        "datetime64[ns]").view("int64")
+    tod = rows[time_col].to_numpy(dtype="int64", na_value=-1)
+
+    run = day_ns[None, :] + tod[:, None]
+    if jitter_seconds:
+        run += rng.integers(
+            -jitter_seconds, jitter_seconds, size=run.shape) * NS
+
+    mask = (tod >= 0)[:, None] & (run > now_ns)
+    if from_col in rows.columns:
+        build_from = rows[from_col].to_numpy(dtype="datetime64[ns]")
+        mask &= day_ns[None, :] >= build_from.view("int64")[:, None]
+
+    idx_row, idx_day = np.nonzero(mask)
+    run = run[idx_row, idx_day]
+    res = {col: rows[col].to_numpy()[idx_row] for col in columns}
+    res["run_time"] = run.view("datetime64[ns]")
+    res["run_date"] = (run - run % NS_PER_DAY).view("datetime64[ns]")
+    return pd.DataFrame(res)
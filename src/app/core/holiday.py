@@ -0,0 +1,215 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import pathlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+from core.config import settings
+
+
+PATH_CURR_DIR = pathlib.Path(__file__).parent
+# bundled copy of syukujitsu.csv. Used as seed before the first fetch
+# and as fixture to run the calendar without network.
+PATH_FIXTURE_CSV = PATH_CURR_DIR / "data" / "syukujitsu.csv"
+HOLIDAY_DATE_COL = "国民の祝日・休日月日"
+
+logger = logging.getLogger(__name__)
+
+
+class HolidayCalendarOutdated(ValueError):
+    pass
+
+
+def read_holiday_csv(source) -> np.ndarray:
+    """Parse syukujitsu.csv to a sorted and unique datetime64[D] array
+
+    Parameters
+    ----------
+    source : str or pathlib.Path
+        url or local path of the csv (SHIFT_JIS encoded)
+
+    Returns
+    -------
+    np.ndarray
+        holidays as datetime64[D]
+    """
+    df = pd.read_csv(source, encoding="SHIFT_JIS", dtype=object)
+    try:
+        holidays = pd.to_datetime(df[HOLIDAY_DATE_COL])
+    except KeyError:
+        raise ValueError("Japnese holiday csv format is changed")
+    return np.unique(holidays.values.astype("datetime64[D]"))
+
+
+class HolidayCalendar:
+    """In-memory index of japanese holidays
+
+    Holidays are loaded once from the persisted cache (or the bundled csv)
+    and kept as a sorted array plus a set for O(1) lookups.
+    Lookups never touch the network, `refresh` is the only method
+    which fetches `source` and is expected to be called from
+    `background_holiday_refresher`.
+    """
+
+    def __init__(
+            self,
+            source: str = settings.HOLIDAY_CSV_URL,
+            cache_path: str = settings.HOLIDAY_CACHE_PATH,
+            seed_path: str = PATH_FIXTURE_CSV,
+            refresh_interval: datetime.timedelta = datetime.timedelta(
+                hours=settings.HOLIDAY_REFRESH_HOURS),
+            stale_policy: str = settings.HOLIDAY_STALE_POLICY) -> None:
+        if stale_policy not in ("raise", "warn"):
+            raise ValueError(
+                f"stale_policy must be 'raise' or 'warn': '{stale_policy}'")
+        self.source = source
+        self.cache_path = pathlib.Path(cache_path)
+        self.seed_path = seed_path
+        self.refresh_interval = refresh_interval
+        self.stale_policy = stale_policy
+
+        self.holidays = np.array([], dtype="datetime64[D]")
+        self._index = frozenset()
+        self.fetched_at: datetime.datetime = None
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def __repr__(self) -> str:
+        return (
+            f"<HolidayCalendar source: {self.source}, "
+            f"holidays: {len(self.holidays)}, "
+            f"newest: {self.newest}, "
+            f"fetched_at: {self.fetched_at}>"
+        )
+
+    @property
+    def newest(self) -> datetime.date:
+        if len(self.holidays) == 0:
+            return None
+        return self.holidays[-1].astype(datetime.date)
+
+    def _set_index(
+            self, holidays: np.ndarray,
+            fetched_at: datetime.datetime) -> None:
+        holidays = np.unique(holidays.astype("datetime64[D]"))
+        index = frozenset(holidays.astype(datetime.date).tolist())
+        # swap references only, readers never see a half built index
+        self.holidays, self._index = holidays, index
+        self.fetched_at = fetched_at
+        self._loaded = True
+
+    def load(self) -> "HolidayCalendar":
+        """Load holidays from the local cache file or the bundled csv"""
+        with self._lock:
+            if self.cache_path.exists():
+                try:
+                    with open(self.cache_path, mode="r") as f:
+                        cache = json.load(f)
+                    self._set_index(
+                        np.array(cache["holidays"], dtype="datetime64[D]"),
+                        datetime.datetime.fromisoformat(cache["fetched_at"]),
+                    )
+                    return self
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(
+                        f"Ignore broken holiday cache {self.cache_path}: {e}")
+
+            # never fetched yet. fetched_at stays None to refresh soon
+            self._set_index(read_holiday_csv(self.seed_path), None)
+            return self
+
+    def ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.load()
+
+    def persist(self) -> None:
+        cache = {
+            "source": str(self.source),
+            "fetched_at": self.fetched_at.isoformat(),
+            "holidays": [str(x) for x in self.holidays],
+        }
+        tmp_path = self.cache_path.with_name(f".{self.cache_path.name}.tmp")
+        with open(tmp_path, mode="w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def refresh(self) -> "HolidayCalendar":
+        """Fetch `source` and replace the index. Blocking."""
+        holidays = read_holiday_csv(self.source)
+        if len(holidays) == 0:
+            raise ValueError(f"No holidays found in {self.source}")
+        with self._lock:
+            self._set_index(holidays, datetime.datetime.now())
+            self.persist()
+        logger.info(f"Refreshed {self}")
+        return self
+
+    def is_stale(self, now: datetime.datetime = None) -> bool:
+        self.ensure_loaded()
+        if self.fetched_at is None:
+            return True
+        now = now or datetime.datetime.now()
+        return now - self.fetched_at >= self.refresh_interval
+
+    def next_refresh_in(self, now: datetime.datetime = None) -> float:
+        """Seconds until the cache become stale"""
+        if self.is_stale(now):
+            return 0.
+        now = now or datetime.datetime.now()
+        return (self.fetched_at + self.refresh_interval - now).total_seconds()
+
+    def check_covered(self, date: datetime.date) -> None:
+        # if newest holiday older than date,
+        # the holiday csv relese site may changed their policy
+        newest = self.newest
+        if (newest is not None) and (date < newest):
+            return
+        msg = ("Japnese holiday csv may be outdated. "
+               f"Newest holiday in csv is {newest}")
+        if self.stale_policy == "raise":
+            raise HolidayCalendarOutdated(msg)
+        logger.warning(msg)
+
+    def is_holiday(self, date) -> bool:
+        self.ensure_loaded()
+        today = pd.Timestamp(date).date()
+
+        # if saturday or sunday. weekday start with 0
+        if today.weekday() >= 5:
+            return True
+
+        self.check_covered(today)
+        return today in self._index
+
+
+_calendar: HolidayCalendar = None
+
+
+def get_calendar() -> HolidayCalendar:
+    global _calendar
+    if _calendar is None:
+        _calendar = HolidayCalendar().load()
+    return _calendar
+
+
+async def background_holiday_refresher(
+        logger: logging.Logger,
+        retry_seconds: float = 600):
+    calendar = get_calendar()
+    while True:
+        wait = calendar.next_refresh_in()
+        if wait > 0:
+            logger.info(f"Refresh holiday calendar after {wait} seconds")
+            await asyncio.sleep(wait)
+
+        try:
+            await asyncio.to_thread(calendar.refresh)
+        except Exception as e:
+            # keep serving the cached holidays
+            logger.error(f"Failed to refresh holiday calendar: {e}")
+            await asyncio.sleep(retry_seconds)
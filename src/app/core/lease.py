@@ -0,0 +1,110 @@
+"""Lease based claiming of due tasks
+
+Any number of runner processes may run tasks. A runner claims due rows
+with `SELECT ... FOR UPDATE SKIP LOCKED`, so no two runners get the same
+row, and stamps them with its owner id and a lease expiry, see
+`core.task.claim_due_tasks`. A heartbeat renews the leases of rows still
+running. Rows whose lease expired (their runner crashed) are put back to
+pending, to be claimed again.
+"""
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import traceback
+
+from sqlalchemy import and_, update
+
+from database import model
+from database.database import unit_of_work
+from core.config import settings
+
+
+TABLES = (model.t_clock_schedules, model.t_applied_schedules)
+
+
+def get_worker_id() -> str:
+    return settings.WORKER_ID or f"{socket.gethostname()}:{os.getpid()}"
+
+
+def lease_until(now: datetime.datetime) -> datetime.datetime:
+    return now + datetime.timedelta(seconds=settings.LEASE_SECONDS)
+
+
+async def release(table, owner: str, key: dict,
+                  status: model.ENUM_TASK_STATUS) -> bool:
+    """Set the final status of a row leased by `owner`
+
+    Return False if the lease was lost, i.e. the row was reclaimed
+    by another runner after the lease expired. Joins the unit of work
+    of the caller, if any.
+    """
+    stmt = update(table).where(
+        and_(
+            *[table.c[col] == v for col, v in key.items()],
+            table.c.lease_owner == owner,
+        )
+    ).values(applied=status, lease_owner=None, lease_expires=None)
+
+    async with unit_of_work() as session:
+        res = await session.execute(stmt)
+    return res.rowcount > 0
+
+
+async def renew(owner: str) -> int:
+    """Extend the leases of all rows `owner` is running"""
+    now = datetime.datetime.now()
+    n = 0
+    async with unit_of_work() as session:
+        for table in TABLES:
+            res = await session.execute(update(table).where(
+                and_(
+                    table.c.applied == model.ENUM_TASK_STATUS.running,
+                    table.c.lease_owner == owner,
+                )
+            ).values(lease_expires=lease_until(now)))
+            n += res.rowcount
+    return n
+
+
+async def reclaim_expired() -> int:
+    """Put running rows whose lease expired back to pending"""
+    now = datetime.datetime.now()
+    n = 0
+    async with unit_of_work() as session:
+        for table in TABLES:
+            res = await session.execute(update(table).where(
+                and_(
+                    table.c.applied == model.ENUM_TASK_STATUS.running,
+                    table.c.lease_expires < now,
+                )
+            ).values(
+                applied=model.ENUM_TASK_STATUS.pending,
+                lease_owner=None,
+                lease_expires=None,
+            ))
+            n += res.rowcount
+    return n
+
+
+async def background_lease_keeper(
+        owner: str,
+        logger: logging.Logger,
+        on_reclaimed=None):
+    """Renew leases of `owner` and reclaim expired ones periodically.
+
+    `on_reclaimed` is awaited after rows were put back to pending.
+    """
+    interval = settings.LEASE_SECONDS / 3
+    while True:
+        try:
+            await renew(owner)
+            n = await reclaim_expired()
+            if n:
+                logger.warning(f"Reclaimed {n} tasks of expired leases")
+                if on_reclaimed is not None:
+                    await on_reclaimed()
+        except Exception:
+            logger.error(traceback.format_exc())
+        await asyncio.sleep(interval)
@@ -0,0 +1,94 @@
+from typing import Any, Dict, Hashable, Union
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from core.clocker import Clocker, ClockerBatch
+
+
+class ClockerPool:
+    """Run `Clocker` jobs without blocking the event loop
+
+    At most `max_workers` selenium jobs run at the same time in worker
+    threads, and jobs sharing the same key (user) never run concurrently.
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="clocker")
+        # per key lock and the number of jobs holding or waiting it
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self.running = 0
+        self.succeeded = 0
+        self.failed = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"<ClockerPool max_workers: {self.max_workers}, "
+            f"running: {self.running}, "
+            f"queued: {self.queued}>"
+        )
+
+    @property
+    def queued(self) -> int:
+        return sum(self._waiters.values()) - self.running
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "max_workers": self.max_workers,
+            "running": self.running,
+            "queued": self.queued,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+        }
+
+    async def run(
+            self, key: Hashable, clocker: Union[Clocker, ClockerBatch],
+            logger: logging.Logger) -> Any:
+        """Run `clocker` with its backend.
+
+        Exceptions raised by the clocker are re-raised here. A batch
+        returns the exception of each of its clockers instead.
+        """
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                self.running += 1
+                try:
+                    r = await clocker.arun(logger, executor=self.executor)
+                except Exception:
+                    self.failed += 1
+                    raise
+                finally:
+                    self.running -= 1
+                if isinstance(clocker, ClockerBatch):
+                    n_failed = sum(x is not None for x in r)
+                    self.failed += n_failed
+                    self.succeeded += len(r) - n_failed
+                else:
+                    self.succeeded += 1
+                return r
+        finally:
+            self._waiters[key] -= 1
+            if self._waiters[key] == 0:
+                del self._waiters[key]
+                del self._locks[key]
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: ClockerPool = None
+
+
+def get_pool() -> ClockerPool:
+    return _pool
+
+
+def set_pool(pool: ClockerPool) -> ClockerPool:
+    global _pool
+    _pool = pool
+    return _pool
@@ -0,0 +1,139 @@
+from typing import Awaitable, Callable, List
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass, field
+
+import asyncpg
+
+from database.database import PG_DSN
+
+
+# postgres channel notified when t_clock_schedules/t_applied_schedules change
+CHANNEL_SCHEDULES_CHANGED = "schedules_changed"
+
+
+@dataclass(order=True)
+class ScheduleEntry:
+    run_time: datetime.datetime
+    table_name: str = field(compare=False)
+    # primary key values of the row. Like: {"user_id": 1, ...}
+    key: dict = field(compare=False)
+
+
+class DeadlineScheduler:
+    """Min-heap of upcoming task deadlines
+
+    `next_due` sleeps until the earliest deadline and pops it.
+    The heap is reloaded with `loader` on start, when woken by `wake`
+    (schedules changed in this process or NOTIFY from other processes),
+    when drained, and every `resync_seconds` as a safety net.
+    """
+
+    def __init__(
+            self,
+            loader: Callable[[int], Awaitable[List[ScheduleEntry]]],
+            logger: logging.Logger,
+            prefetch: int = 100,
+            resync_seconds: float = 600) -> None:
+        self.loader = loader
+        self.logger = logger
+        self.prefetch = prefetch
+        self.resync_seconds = resync_seconds
+
+        self._heap: List[tuple] = []
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dirty = True
+        self._exhausted = False
+        self._synced_at: datetime.datetime = None
+        self._listener: asyncpg.Connection = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def wake(self, *args) -> None:
+        """Reload the heap before the next deadline.
+
+        Signature matches asyncpg listener callbacks.
+        """
+        self._dirty = True
+        self._wakeup.set()
+
+    async def reload(self) -> None:
+        # clear first, so a wake during loading triggers another reload
+        self._wakeup.clear()
+        self._dirty = False
+        entries = await self.loader(self.prefetch)
+        self._heap = [(x, next(self._counter)) for x in entries]
+        heapq.heapify(self._heap)
+        self._exhausted = len(entries) < self.prefetch
+        self._synced_at = datetime.datetime.now()
+        if self._heap:
+            self.logger.info(
+                f"Loaded {len(self._heap)} schedules. "
+                f"Next task: {self._heap[0][0].run_time}")
+
+    def peek(self) -> ScheduleEntry:
+        if not self._heap:
+            return None
+        return self._heap[0][0]
+
+    async def next_due(self) -> ScheduleEntry:
+        while True:
+            now = datetime.datetime.now()
+            if (self._synced_at is None) or (
+                    (now - self._synced_at).total_seconds()
+                    >= self.resync_seconds):
+                self._dirty = True
+            if self._dirty:
+                await self.reload()
+                now = datetime.datetime.now()
+
+            timeout = self.resync_seconds
+            if self._heap:
+                head = self._heap[0][0]
+                timeout = (head.run_time - now).total_seconds()
+                if timeout <= 0:
+                    heapq.heappop(self._heap)
+                    if (not self._heap) and (not self._exhausted):
+                        self._dirty = True
+                    return head
+                timeout = min(timeout, self.resync_seconds)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def listen(self) -> None:
+        """Wake on NOTIFY from other processes. Reconnect on failures."""
+        while True:
+            try:
+                if (self._listener is None) or self._listener.is_closed():
+                    self._listener = await asyncpg.connect(PG_DSN)
+                    await self._listener.add_listener(
+                        CHANNEL_SCHEDULES_CHANGED, self.wake)
+                    self.logger.info(
+                        f"Listen on '{CHANNEL_SCHEDULES_CHANGED}'")
+                    # changes may be missed while disconnected
+                    self.wake()
+            except Exception as e:
+                self.logger.error(f"Failed to listen schedule changes: {e}")
+                self._listener = None
+            await asyncio.sleep(30)
+
+
+_scheduler: DeadlineScheduler = None
+
+
+def get_scheduler() -> DeadlineScheduler:
+    return _scheduler
+
+
+def set_scheduler(scheduler: DeadlineScheduler) -> DeadlineScheduler:
+    global _scheduler
+    _scheduler = scheduler
+    return _scheduler
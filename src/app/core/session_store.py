@@ -0,0 +1,133 @@
+from typing import Dict, List
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from core.config import settings
+
+
+# cookies are stored in the format of CDP `Network.Cookie`.
+# Like: {"name": ..., "value": ..., "domain": ..., "path": ...,
+#        "expires": ..., "secure": ..., "httpOnly": ...}
+Cookies = List[Dict]
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """Encrypted per-user store of authenticated session cookies
+
+    Saved after a successful login and restored into new sessions,
+    so the MFID login flow runs only when the saved session expired.
+    Files are encrypted with Fernet and named by the hash of the email.
+    """
+
+    def __init__(
+            self,
+            key: str,
+            path: str = settings.SESSION_STORE_PATH,
+            max_age_seconds: float = settings.SESSION_STORE_MAX_AGE_HOURS
+            * 3600) -> None:
+        self.fernet = Fernet(key)
+        self.path = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.saved = 0
+
+    def __repr__(self) -> str:
+        return f"<SessionStore path: {self.path}>"
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "saved": self.saved,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
+
+    def _file(self, email: str) -> pathlib.Path:
+        return self.path / hashlib.sha256(email.encode("utf-8")).hexdigest()
+
+    def load(self, email: str) -> Cookies:
+        """Return saved cookies, None if nothing valid is saved"""
+        fname = self._file(email)
+        try:
+            with open(fname, mode="rb") as f:
+                token = f.read()
+            data = json.loads(self.fernet.decrypt(
+                token, ttl=int(self.max_age_seconds)))
+        except FileNotFoundError:
+            data = None
+        except (InvalidToken, ValueError) as e:
+            logger.warning(f"Drop unreadable or too old session: {e}")
+            self.invalidate(email)
+            data = None
+
+        if data is None:
+            self.miss()
+            return None
+
+        # drop cookies expired since they were saved
+        now = time.time()
+        return [x for x in data["cookies"]
+                if x.get("expires", -1) <= 0 or x["expires"] > now]
+
+    def save(self, email: str, cookies: Cookies) -> None:
+        token = self.fernet.encrypt(json.dumps({
+            "email": email,
+            "cookies": cookies,
+        }).encode("utf-8"))
+        fname = self._file(email)
+        tmp = fname.with_name(f".{fname.name}.tmp")
+        with open(tmp, mode="wb") as f:
+            f.write(token)
+        os.replace(tmp, fname)
+        with self._lock:
+            self.saved += 1
+
+    def invalidate(self, email: str) -> None:
+        try:
+            os.remove(self._file(email))
+        except FileNotFoundError:
+            pass
+
+    def hit(self) -> None:
+        with self._lock:
+            self.hits += 1
+
+    def miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def expire(self, email: str) -> None:
+        """Restored cookies were rejected by the site"""
+        self.invalidate(email)
+        with self._lock:
+            self.expired += 1
+            self.misses += 1
+
+
+_session_store: SessionStore = None
+
+
+def get_session_store() -> SessionStore:
+    return _session_store
+
+
+def set_session_store(store: SessionStore) -> SessionStore:
+    global _session_store
+    _session_store = store
+    return _session_store
@@ -1,4 +1,7 @@
-from typing import List, Dict
+from typing import ClassVar, Dict, List
+import base64
+import binascii
+import json
 import logging
 import os
 import datetime
@@ -7,138 +10,370 @@ import traceback
 import random
 
 import pandas as pd
-import numpy as np
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, delete, func, and_, text, column
+from sqlalchemy import literal, tuple_, union_all
+from sqlalchemy import Table, String, Integer, DateTime
+from sqlalchemy.dialects.postgresql import JSONB
 from filelock import Timeout, FileLock
 
-from database import model, db_utils
-from database.database import async_session
+from database import model, db_utils, cache
+from database.database import (
+    after_commit,
+    transaction,
+    unit_of_work,
+)
 from database import schemas
-from core.clocker import Clocker
-from core.utils import is_holiday
+from core.clocker import Clocker, ClockerBatch
+from core.config import settings
+from core.pool import ClockerPool, set_pool
+from core.session_store import SessionStore, set_session_store
+from core.timing import PhaseTimer
+from core.driver_pool import (
+    DriverPool,
+    background_driver_keeper,
+    set_driver_pool,
+)
+from core.busday import business_days, next_business_day
+from core.expand import expand_schedules, time_of_day_ns
+from core.build_sql import build_tasks_sql
+from core import lease
+from core.scheduler import (
+    CHANNEL_SCHEDULES_CHANGED,
+    DeadlineScheduler,
+    ScheduleEntry,
+    get_scheduler,
+    set_scheduler,
+)
+
+
+N_DAYS2BUILD = settings.N_DAYS2BUILD
+
+
+class Task(BaseModel):
+    """A task row with its type info and user, see `fetch_tasks`"""
+    table_name: ClassVar[str]
+    task: BaseModel
+    sup_info: BaseModel
+    user: schemas.M_USERS
+
+    @property
+    def table(self) -> Table:
+        return model.metadata.tables[self.table_name]
+
+    @property
+    def user_id(self) -> int:
+        return self.task.user_id
+
+    @property
+    def run_time(self) -> datetime.datetime:
+        return self.task.run_time
+
+    @property
+    def key(self) -> dict:
+        pkeys = db_utils.get_db_keys(self.table, primary=True)
+        return {col: getattr(self.task, col) for col in pkeys}
+
+    @staticmethod
+    def from_row(row) -> "Task":
+        """Map a row of `TASKS_SQL` to a ClockTask or an ApplyTask"""
+        cls = {x.table_name: x for x in (ClockTask, ApplyTask)}[
+            row.table_name]
+        return cls(task=row.task, sup_info=row.type_info, user=row.user_info)
 
 
-N_DAYS2BUILD = 14
+class ClockTask(Task):
+    table_name: ClassVar[str] = "t_clock_schedules"
+    task: schemas.T_CLOCK_SCHEDULES
+    sup_info: schemas.M_WORK_TYPES
 
 
-class Task:
-    ...
+class ApplyTask(Task):
+    table_name: ClassVar[str] = "t_applied_schedules"
+    task: schemas.T_APPLIED_SCHEDULES
+    sup_info: schemas.M_WORK_SCHEDULE_TYPES
+
+
+# rows of the `clock` and `applied` relations joined with their type and
+# user, in deadline order. Rows without a type or user are kept with a
+# null type_info or user_info, so claimed ones can be failed.
+# The primary key is selected typed, to address rows which fail to map
+TASKS_SQL = """
+SELECT 't_clock_schedules' AS table_name, t.run_time, t.user_id,
+       t.run_date, t.run_type,
+       to_jsonb(t) AS task, to_jsonb(w) AS type_info,
+       to_jsonb(u) AS user_info
+FROM clock t
+LEFT JOIN m_work_types w ON w.id = t.work_type_id
+LEFT JOIN m_users u ON u.user_id = t.user_id
+UNION ALL
+SELECT 't_applied_schedules' AS table_name, t.run_time, t.user_id,
+       t.run_date, t.run_type,
+       to_jsonb(t) AS task, to_jsonb(s) AS type_info,
+       to_jsonb(u) AS user_info
+FROM applied t
+LEFT JOIN m_work_schedule_types s ON s.id = t.schedule_type_id
+LEFT JOIN m_users u ON u.user_id = t.user_id
+ORDER BY run_time, user_id, table_name
+"""
+
+SELECT_TASKS = """
+WITH clock AS (
+    SELECT * FROM t_clock_schedules
+    WHERE active AND applied = 'pending' AND run_time <= :until
+    ORDER BY run_time LIMIT :limit
+),
+applied AS (
+    SELECT * FROM t_applied_schedules
+    WHERE active AND applied = 'pending' AND run_time <= :until
+    ORDER BY run_time LIMIT :limit
+)
+""" + TASKS_SQL + """
+LIMIT :limit
+"""
+
+# users with due tasks, the earliest first, and all of their tasks due
+# within `window` seconds after their earliest one
+CLAIM_TASKS = """
+WITH due AS (
+    SELECT user_id, run_time FROM t_clock_schedules
+    WHERE active AND applied = 'pending' AND run_time <= :now
+    UNION ALL
+    SELECT user_id, run_time FROM t_applied_schedules
+    WHERE active AND applied = 'pending' AND run_time <= :now
+),
+due_users AS (
+    SELECT user_id,
+           min(run_time)
+           + CAST(:window AS double precision) * interval '1 second'
+           AS until
+    FROM due
+    GROUP BY user_id
+    ORDER BY min(run_time)
+    LIMIT :limit
+),
+clock AS (
+    UPDATE t_clock_schedules t
+    SET applied = 'running', lease_owner = :owner, lease_expires = :expires
+    WHERE (t.user_id, t.run_date, t.run_type) IN (
+        SELECT c.user_id, c.run_date, c.run_type
+        FROM t_clock_schedules c
+        JOIN due_users d ON d.user_id = c.user_id
+        WHERE c.active AND c.applied = 'pending' AND c.run_time <= d.until
+        FOR UPDATE OF c SKIP LOCKED)
+    RETURNING t.*
+),
+applied AS (
+    UPDATE t_applied_schedules t
+    SET applied = 'running', lease_owner = :owner, lease_expires = :expires
+    WHERE (t.user_id, t.run_date, t.run_type) IN (
+        SELECT c.user_id, c.run_date, c.run_type
+        FROM t_applied_schedules c
+        JOIN due_users d ON d.user_id = c.user_id
+        WHERE c.active AND c.applied = 'pending' AND c.run_time <= d.until
+        FOR UPDATE OF c SKIP LOCKED)
+    RETURNING t.*
+)
+""" + TASKS_SQL
+
+
+def _tasks_stmt(sql: str):
+    return text(sql).columns(
+        column("table_name", String),
+        column("run_time", DateTime),
+        column("user_id", Integer),
+        column("run_date", DateTime),
+        column("run_type", model.t_clock_schedules.c.run_type.type),
+        column("task", JSONB),
+        column("type_info", JSONB),
+        column("user_info", JSONB),
+    )
 
 
-class ClockTask(Task):
-    ...
+def _row_key(row) -> dict:
+    """Primary key of the task of a `TASKS_SQL` row"""
+    table = model.metadata.tables[row.table_name]
+    return {col: getattr(row, col)
+            for col in db_utils.get_db_keys(table, primary=True)}
 
 
-class ApplyTask(Task):
-    ...
+def get_built_columns(table) -> List[str]:
+    """Columns of a task table written by build_tasks"""
+    return [x for x in db_utils.get_db_keys(table)
+            if x not in model.LEASE_COLUMNS]
 
 
-async def build_tasks(session: AsyncSession, logger: logging.Logger) -> pd.DataFrame:
+async def build_tasks(
+        session: AsyncSession,
+        logger: logging.Logger,
+        timer: PhaseTimer = None,
+        user_ids: List[int] = None) -> pd.DataFrame:
+    """Insert clock and apply tasks of the next `N_DAYS2BUILD` days.
+
+    Only days after the horizon of each user in t_schedule_horizons
+    are built, so a daily run writes one day per user.
+    Phases are timed with `timer`, see `bench.build_tasks`.
+    With `BUILD_MODE = "sql"` rows are generated inside postgres,
+    see `core.build_sql`.
+
+    Parameters
+    ----------
+    user_ids : List[int], optional
+        build only these users, by default all users
+    """
+    timer = timer or PhaseTimer()
+    if settings.BUILD_MODE == "sql":
+        return await build_tasks_sql(
+            session, logger, N_DAYS2BUILD, timer=timer, user_ids=user_ids)
 
-    def get_radnom_time_delta(
-            size: int, delta_seconds: int = 300) -> pd.Series:
-        return pd.to_timedelta(np.random.randint(
-            -delta_seconds, delta_seconds, size=size), unit="s")
-        
     # filter users ready to build
-    basic = await db_utils.get_rows(
-        session=session, table=model.t_basic_types, logger=logger)
-    pkeys = set(db_utils.get_db_keys(model.t_basic_types, primary=True))
-    sub_keys = set(db_utils.get_db_keys(model.t_basic_types)) - pkeys
+    users = {} if user_ids is None else {
+        "user_id__in": [int(x) for x in user_ids]}
+    with timer.phase("read") as phase:
+        basic = await db_utils.get_rows(
+            session=session, table=model.t_basic_types, logger=logger,
+            **users)
+        phase.rows += len(basic)
+        horizons = await db_utils.get_rows(
+            session=session, table=model.t_schedule_horizons, logger=logger,
+            columns=["user_id", "built_until"], **users)
+        phase.rows += len(horizons)
+    pkeys = db_utils.get_db_keys(model.t_basic_types, primary=True)
+    sub_keys = db_utils.get_db_sub_keys(model.t_basic_types)
     basic.dropna(subset=sub_keys, inplace=True, how="any")
 
+    # skip days already built
+    today = pd.Timestamp.now().normalize()
+    until = today + pd.Timedelta(N_DAYS2BUILD, "d")
+    basic = pd.merge(basic, horizons,
+                     on="user_id", how="left")
+    basic["build_from"] = pd.to_datetime(
+        basic["built_until"]).fillna(today).clip(lower=today)
+    basic = basic[basic["build_from"] < until]
+
     # do nothing if no user is ready
     if basic.empty:
         return []
 
     # format t_basic to long-type-dataframe
     # 3 rows(cin time, cout time, schedule time) for every email
-    df = pd.melt(basic, value_vars=sub_keys, id_vars=pkeys,
+    df = pd.melt(basic, value_vars=sub_keys, id_vars=pkeys + ["build_from"],
                  var_name="types", value_name="tasks")
 
     # merge real time
-    work_types = await db_utils.get_rows(
-        session=session, table=model.m_work_types, logger=logger)
-
-    tcs = pd.merge(df, work_types, how="left",
-                   left_on="tasks", right_on="type_name")
-    tcs.dropna(subset="id", inplace=True)
-    tcs.rename(columns={"id": "work_type_id"}, inplace=True)
-    tcs["applied"] = model.ENUM_TASK_STATUS.pending.value
-
-    now = pd.Timestamp.now()
-    tasks = []
-    for n in range(N_DAYS2BUILD):
-        tmp = tcs.copy(deep=True)
-        rundate = (now + pd.Timedelta(n, "d")).date()
-        if is_holiday(rundate):
-            continue
-        tmp["run_time"] = tmp["run_time"].apply(
-            lambda x: pd.Timestamp.combine(rundate, x))
-        tasks.append(tmp)
-
-    # random diff 5 min
-    res = pd.concat(tasks, axis=0)
-    res = res[pd.to_datetime(res["run_time"]) >
-              pd.Timestamp.now()].reset_index(drop=True)
-    res["run_time"] = res["run_time"] + get_radnom_time_delta(size=len(res))
-    res["run_date"] = res["run_time"].dt.date
-    res["active"] = True
-
-    await db_utils.insert_rows(
-        df=res[db_utils.get_db_keys(model.t_clock_schedules)],
-        session=session,
-        table=model.t_clock_schedules,
-        logger=logger,
-        on_conflict_do_nothing=True,
-    )
+    with timer.phase("read") as phase:
+        work_types = await db_utils.get_rows(
+            session=session, table=model.m_work_types, logger=logger,
+            columns=["id", "type_name", "run_type", "run_time"])
+        phase.rows += len(work_types)
+
+    with timer.phase("expand_clock_schedules") as phase:
+        work_types["run_time"] = time_of_day_ns(work_types["run_time"])
+        tcs = pd.merge(df, work_types, how="left",
+                       left_on="tasks", right_on="type_name")
+        tcs = tcs[tcs["id"].notnull()]
+
+        # one row for every user, type and day. random diff 5 min
+        rundates = business_days(today, until)
+        res = expand_schedules(
+            tcs.astype({"id": "int64"}), rundates,
+            columns=["user_id", "id", "run_type"])
+        res.rename(columns={"id": "work_type_id"}, inplace=True)
+        res["applied"] = model.ENUM_TASK_STATUS.pending.value
+        res["active"] = True
+        phase.rows += len(res)
+
+    with timer.phase("insert_clock_schedules") as phase:
+        # rows skipped on conflict are not counted
+        if not res.empty:
+            phase.rows += await db_utils.insert_rows(
+                df=res[get_built_columns(model.t_clock_schedules)],
+                session=session,
+                table=model.t_clock_schedules,
+                logger=logger,
+                on_conflict_do_nothing=True,
+            )
 
     # merge real time
-    stypes = await db_utils.get_rows(
-        session=session, table=model.m_work_schedule_types, logger=logger)
+    with timer.phase("read") as phase:
+        stypes = await db_utils.get_rows(
+            session=session, table=model.m_work_schedule_types, logger=logger,
+            columns=["id", "type_name", "run_time"])
+        phase.rows += len(stypes)
+
+    with timer.phase("expand_applied_schedules") as phase:
+        stypes["run_time"] = time_of_day_ns(stypes["run_time"])
+        tas = pd.merge(df, stypes, how="left",
+                       left_on="tasks", right_on="type_name")
+        tas = tas[tas["id"].notnull()]
+
+        # random diff 5 min
+        res = expand_schedules(
+            tas.astype({"id": "int64"}), rundates,
+            columns=["user_id", "id"])
+        res.rename(columns={"id": "schedule_type_id"}, inplace=True)
+        res["applied"] = model.ENUM_TASK_STATUS.pending.value
+        res["active"] = True
+        res["run_type"] = model.ENUM_RUN_TYPE_NAME.schedule
+        res["apply_date"] = next_business_day(res["run_time"])
+        phase.rows += len(res)
+
+    with timer.phase("insert_applied_schedules") as phase:
+        # rows skipped on conflict are not counted
+        if not res.empty:
+            phase.rows += await db_utils.insert_rows(
+                df=res[get_built_columns(model.t_applied_schedules)],
+                session=session,
+                table=model.t_applied_schedules,
+                logger=logger,
+                on_conflict_do_nothing=True,
+            )
 
-    tas = pd.merge(df, stypes, how="left",
-                   left_on="tasks", right_on="type_name")
-    tas.dropna(subset="id", inplace=True)
-    tas.rename(columns={"id": "schedule_type_id"}, inplace=True)
-    tas["applied"] = "pending"
+    with timer.phase("update_horizons") as phase:
+        phase.rows += await db_utils.upsert_rows(
+            df=pd.DataFrame({
+                "user_id": basic["user_id"].values,
+                "built_until": until.to_pydatetime(),
+                "updated_at": datetime.datetime.now(),
+            }),
+            session=session,
+            table=model.t_schedule_horizons,
+            logger=logger,
+        )
 
-    tasks = []
-    for n in range(N_DAYS2BUILD):
-        tmp = tas.copy(deep=True)
-        rundate = (now + pd.Timedelta(n, "d")).date()
-        if is_holiday(rundate):
-            continue
-        tmp["run_time"] = tmp["run_time"].apply(
-            lambda x: pd.Timestamp.combine(rundate, x))
-        tasks.append(tmp)
-    
-    # random diff 5 min
-    res = pd.concat(tasks, axis=0)
-    res = res[pd.to_datetime(res["run_time"]) >
-              pd.Timestamp.now()].reset_index(drop=True)
-    res["run_time"] = res["run_time"] + get_radnom_time_delta(len(res))
-    res["run_date"] = res["run_time"].dt.date
-    res["active"] = True
-    res["run_type"] = model.ENUM_RUN_TYPE_NAME.schedule
-    res["apply_date"] = res["run_time"].apply(get_next_work_day)
-
-    await db_utils.insert_rows(
-        df=res[db_utils.get_db_keys(model.t_applied_schedules)],
-        session=session,
-        table=model.t_applied_schedules,
-        logger=logger,
-        on_conflict_do_nothing=True,
-    )
+
+async def rebuild_tasks(
+        session: AsyncSession,
+        logger: logging.Logger,
+        user_ids: List[int]):
+    """Rebuild schedules of users whose t_basic_types changed
+
+    Future pending tasks are deleted and built again from today.
+    Tasks deactivated by hand are kept.
+    """
+    if len(user_ids) == 0:
+        return
+    user_ids = [int(x) for x in user_ids]
+    async with transaction(session):
+        for table in (model.t_clock_schedules, model.t_applied_schedules):
+            await session.execute(delete(table).where(and_(
+                table.c.user_id.in_(user_ids),
+                table.c.active == True,
+                table.c.applied == model.ENUM_TASK_STATUS.pending,
+                table.c.run_time > datetime.datetime.now(),
+            )))
+        table = model.t_schedule_horizons
+        await session.execute(
+            delete(table).where(table.c.user_id.in_(user_ids)))
+    await build_tasks(session, logger, user_ids=user_ids)
 
 
 async def execute_stmt(stmt):
-    async with async_session() as session:
+    """Execute in the unit of work of the caller, or in a new one"""
+    async with unit_of_work() as session:
         res = await session.execute(stmt)
-        res = res.all()
-        await session.commit()
-    return res
+        return res.all()
 
 
 def render2pydantic(*, table, schema, values: List):
@@ -153,24 +388,42 @@ def render2pydantic(*, table, schema, values: List):
 
 
 def get_next_work_day(x: pd.Timestamp) -> datetime.date:
-    nextday = pd.Timestamp(x) + pd.Timedelta(days=1)
-    while is_holiday(nextday):
-        nextday = pd.Timestamp(nextday) + pd.Timedelta(days=1)
-    return nextday.date()
+    return next_business_day(x)[0].astype(datetime.date)
 
 
-async def get_user_info(uid: int):
-    table = model.m_users
-    stmt = select(table).where(table.c.user_id == uid)
+async def get_master_info(table, schema, logger=None, **filter_kwargs):
+    logger = logger or logging.getLogger(__name__)
+    async with unit_of_work() as session:
+        df = await cache.get_master_rows(
+            session=session, table=table, logger=logger, **filter_kwargs)
+    df = df.astype(object).where(df.notnull(), None)
     return render2pydantic(
         table=table,
-        schema=schemas.M_USERS,
-        values= await execute_stmt(stmt),
+        schema=schema,
+        values=list(df.itertuples(index=False, name=None)),
     )
 
 
+async def get_user_info(uid: int):
+    return await get_master_info(model.m_users, schemas.M_USERS, user_id=uid)
+
+
 async def background_updater(logger):
     write_pid(fname="updater.pid")
+    await asyncio.sleep(5)
+    if not check_pid(fname="updater.pid"):
+        logger.info(f"process [{os.getpid()}] updater quit")
+        return
+
+    # catch up days missed while the server was down
+    try:
+        async with unit_of_work() as session:
+            await build_tasks(session, logger, timer=PhaseTimer(logger))
+            await notify_schedules_changed(session)
+        logger.info("Catch up scheduler done")
+    except Exception:
+        logger.error(traceback.format_exc())
+
     while True:
         await asyncio.sleep(5)
         if not check_pid(fname="updater.pid"):
@@ -186,20 +439,15 @@ async def background_updater(logger):
         logger.info(f"Build scheduler after {sleep2tomorrow} seconds")
         await asyncio.sleep(sleep2tomorrow)
 
-        async with async_session() as session:
-            await build_tasks(session, logger)
-            await session.commit()
-        logger.info(f"Build scheduler done")
+        async with unit_of_work() as session:
+            await build_tasks(session, logger, timer=PhaseTimer(logger))
+            await notify_schedules_changed(session)
+        logger.info("Build scheduler done")
 
 
 async def get_work_type_info(tid):
-    table = model.m_work_types
-    stmt = select(table).where(table.c.id == tid)
-    return render2pydantic(
-        table=table,
-        schema=schemas.M_WORK_TYPES,
-        values= await execute_stmt(stmt),
-    )
+    return await get_master_info(
+        model.m_work_types, schemas.M_WORK_TYPES, id=tid)
 
 
 async def check_is_apply_day(date) -> bool:
@@ -216,71 +464,232 @@ async def check_is_apply_day(date) -> bool:
     return False
 
 
-async def get_tasks(logger):
-    # get nearest actived task from t_clock_schedules
-    table = model.t_clock_schedules
-
-    sub_stmt = select(table).where(
-        and_(
-            table.c.active == True,
-            table.c.applied == model.ENUM_TASK_STATUS.pending,
-        )
-    ).subquery()
-    stmt = select(sub_stmt).where(
-        sub_stmt.c.run_time ==
-        select(func.min(sub_stmt.c.run_time)).scalar_subquery(),
-    )
-    clock_task = render2pydantic(
-        table=table,
-        schema=schemas.T_CLOCK_SCHEDULES,
-        values= await execute_stmt(stmt),
+async def fetch_tasks(
+        until: datetime.datetime = None,
+        limit: int = None,
+        logger: logging.Logger = None) -> List[Task]:
+    """Get pending active tasks in deadline order in one query.
+
+    Parameters
+    ----------
+    until : datetime.datetime, optional
+        tasks due by this time, by default now, or any time if `limit`
+        is given
+    limit : int, optional
+        the first `limit` tasks, by default all
+    logger : logging.Logger, optional
+        warn about tasks skipped since their rows are invalid
+    """
+    if until is None:
+        until = datetime.datetime.max if limit else datetime.datetime.now()
+    rows = await execute_stmt(_tasks_stmt(SELECT_TASKS).bindparams(
+        until=until, limit=limit))
+    tasks = []
+    for row in rows:
+        try:
+            tasks.append(Task.from_row(row))
+        except ValidationError as e:
+            if logger is not None:
+                logger.warning(
+                    f"Skip invalid task of {row.table_name}: {e}")
+    return tasks
+
+
+async def claim_due_tasks(
+        owner: str,
+        logger: logging.Logger,
+        window: float = 0,
+        limit: int = None) -> List[Task]:
+    """Claim due tasks of the first `limit` users in one query.
+
+    Tasks of those users due within `window` seconds after their
+    earliest one are claimed too, even if not due yet, so they run up to
+    `window` seconds early, see `COALESCE_WINDOW_SECONDS`.
+    Claimed tasks are running and leased by `owner`, see core.lease.
+    Rows locked by other runners are skipped. Claimed rows which do not
+    map to a task, like rows without a type, are marked failed.
+    """
+    now = datetime.datetime.now()
+    stmt = _tasks_stmt(CLAIM_TASKS).bindparams(
+        now=now, window=window, limit=limit, owner=owner,
+        expires=lease.lease_until(now))
+    tasks = []
+    for row in await execute_stmt(stmt):
+        try:
+            tasks.append(Task.from_row(row))
+        except ValidationError as e:
+            logger.error(f"Invalid task of {row.table_name}: {e}")
+            try:
+                await lease.release(
+                    model.metadata.tables[row.table_name], owner,
+                    _row_key(row), model.ENUM_TASK_STATUS.failed)
+            except Exception:
+                logger.error(traceback.format_exc())
+    return tasks
+
+
+async def get_upcoming_tasks(limit: int) -> List[ScheduleEntry]:
+    """Get deadlines of the nearest `limit` actived tasks
+    from t_clock_schedules and t_applied_schedules
+    """
+    # invalid rows are kept, claiming them marks them failed
+    rows = await execute_stmt(_tasks_stmt(SELECT_TASKS).bindparams(
+        until=datetime.datetime.max, limit=limit))
+    return [
+        ScheduleEntry(
+            run_time=x.run_time, table_name=x.table_name, key=_row_key(x))
+        for x in rows]
+
+
+def encode_cursor(run_date: datetime.datetime,
+                  run_type: model.ENUM_RUN_TYPE_NAME) -> str:
+    """Opaque cursor of a page starting after this row"""
+    key = json.dumps([run_date.isoformat(), run_type.value])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Return (run_date, run_type) of `encode_cursor`. Raise ValueError"""
+    try:
+        run_date, run_type = json.loads(base64.urlsafe_b64decode(cursor))
+        return (datetime.datetime.fromisoformat(run_date),
+                model.ENUM_RUN_TYPE_NAME(run_type))
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _tasks_page_branch(table, types, type_id: str, apply_date,
+                       user_id, filters: list, limit: int):
+    stmt = select(
+        table.c.run_date,
+        table.c.run_type,
+        table.c.run_time,
+        apply_date.label("apply_date"),
+        table.c.applied,
+        table.c.active,
+        types.c.type_name,
+    ).select_from(
+        table.outerjoin(types, types.c.id == table.c[type_id])
+    ).where(
+        table.c.user_id == user_id,
+        *[f(table) for f in filters],
     )
-
-    # get nearest actived task from t_applied_schedules
-    table = model.t_applied_schedules
-    sub_stmt = select(table).where(
-        and_(
-            table.c.active == True,
-            table.c.applied == model.ENUM_TASK_STATUS.pending,
-        )
+    # each side is read in index order up to the page size
+    return stmt.order_by(table.c.run_date, table.c.run_type).limit(limit)
+
+
+async def get_tasks_page(
+        session: AsyncSession,
+        email: str,
+        limit: int = 1000,
+        cursor: str = None,
+        date_from: datetime.date = None,
+        date_to: datetime.date = None,
+        statuses: List[model.ENUM_TASK_STATUS] = None,
+        run_types: List[model.ENUM_RUN_TYPE_NAME] = None):
+    """Get a page of the clock and apply tasks of a user in one query.
+
+    Tasks are ordered by (run_date, run_type), unique for a user.
+
+    Parameters
+    ----------
+    limit : int, optional
+        page size, by default 1000
+    cursor : str, optional
+        next cursor of the previous page, by default the first page
+    date_from, date_to : datetime.date, optional
+        first and last run date, inclusive
+    statuses, run_types : list, optional
+        keep tasks of these statuses or run types only
+
+    Returns
+    -------
+    Tuple[List[Dict], str]
+        tasks in the format of the webapp, and the cursor of the next
+        page, None on the last page
+    """
+    filters = []
+    if date_from is not None:
+        filters.append(lambda t: t.c.run_date >= datetime.datetime.combine(
+            date_from, datetime.time()))
+    if date_to is not None:
+        filters.append(lambda t: t.c.run_date < datetime.datetime.combine(
+            date_to + datetime.timedelta(days=1), datetime.time()))
+    if statuses:
+        filters.append(lambda t: t.c.applied.in_(statuses))
+    if run_types:
+        filters.append(lambda t: t.c.run_type.in_(run_types))
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        filters.append(
+            lambda t: tuple_(t.c.run_date, t.c.run_type) > tuple_(
+                literal(after[0], t.c.run_date.type),
+                literal(after[1], t.c.run_type.type)))
+
+    user_id = select(model.m_users.c.user_id).where(
+        model.m_users.c.email == email).scalar_subquery()
+    ctable, atable = model.t_clock_schedules, model.t_applied_schedules
+    tasks = union_all(
+        _tasks_page_branch(
+            ctable, model.m_work_types, "work_type_id",
+            ctable.c.run_time, user_id, filters, limit),
+        _tasks_page_branch(
+            atable, model.m_work_schedule_types, "schedule_type_id",
+            atable.c.apply_date, user_id, filters, limit),
     ).subquery()
+    stmt = select(tasks).order_by(
+        tasks.c.run_date, tasks.c.run_type).limit(limit)
 
-    stmt = select(sub_stmt).where(
-        sub_stmt.c.run_time ==
-        select(func.min(sub_stmt.c.run_time)).scalar_subquery(),
-    )
+    async with transaction(session):
+        res = await session.execute(stmt)
+        rows = res.all()
+
+    def fmt(x: datetime.datetime, pattern: str) -> str:
+        return None if x is None else x.strftime(pattern)
+
+    tasks = [{
+        "task_name": x.run_type.value,
+        "task_type": x.type_name,
+        "runtime": fmt(x.run_time, "%Y-%m-%d %H:%M:%S"),
+        "status": None if x.applied is None else x.applied.value,
+        "actions": x.active,
+        "apply_date": fmt(x.apply_date, "%Y-%m-%d") or "",
+    } for x in rows]
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_cursor(rows[-1].run_date, rows[-1].run_type)
+    return tasks, next_cursor
+
+
+async def iter_tasks(
+        session: AsyncSession,
+        email: str,
+        cursor: str = None,
+        limit: int = 1000,
+        **filters):
+    """Tasks of every page from `cursor`, read `limit` at a time.
+    See `get_tasks_page` for the arguments.
+    """
+    while True:
+        tasks, cursor = await get_tasks_page(
+            session, email, limit=limit, cursor=cursor, **filters)
+        for x in tasks:
+            yield x
+        if cursor is None:
+            return
 
-    applied_task = render2pydantic(
-        table=table,
-        schema=schemas.T_APPLIED_SCHEDULES,
-        values=await execute_stmt(stmt),
-    )
 
-    # get id reference table
-    if clock_task.run_time < applied_task.run_time:
-        latest_task = clock_task
-        table = model.m_work_types
-        stmt = select(table).where(table.c.id == clock_task.work_type_id)
-        sup_info = render2pydantic(
-            table=table,
-            schema=schemas.M_WORK_TYPES,
-            values= await execute_stmt(stmt),
-        )
-    else:
-        latest_task = applied_task
-        table = model.m_work_schedule_types
-        stmt = select(table).where(table.c.id == applied_task.schedule_type_id)
-        sup_info = render2pydantic(
-            table=table,
-            schema=schemas.M_WORK_SCHEDULE_TYPES,
-            values= await execute_stmt(stmt),
-        )
+async def notify_schedules_changed(session: AsyncSession):
+    """Wake the runner of this process and of the other processes,
+    once the changes of `session` are committed
+    """
+    scheduler = get_scheduler()
+    if scheduler is not None:
+        after_commit(session, scheduler.wake)
 
-    if latest_task.run_time > datetime.datetime.now():
-        if datetime.datetime.now().minute == 0:
-            logger.info(f"Next task: {latest_task.run_time}")
-        return False, None
-    return latest_task, sup_info
+    async with transaction(session):
+        await session.execute(
+            select(func.pg_notify(CHANNEL_SCHEDULES_CHANGED, "")))
 
 
 def write_pid(fname):
@@ -298,78 +707,133 @@ def check_pid(fname):
 
 
 async def background_runner(logger: logging.Logger):
-    async def update_rows(*, table, item):
-        async with async_session() as session:
-            await db_utils.update_rows(
-                df=pd.DataFrame([item.__dict__]),
-                session=session,
-                table=table,
-                logger=logger,
-            )
-            await session.commit()
+    """Run due tasks. Any number of processes may run this,
+    tasks are claimed with leases, see core.lease.
+    """
+    async def notify():
+        async with unit_of_work() as session:
+            await notify_schedules_changed(session)
 
     logger = logger.getChild("bg")
-    logger.info(f"process [{os.getpid()}] runner started")
-    write_pid(fname="runner.pid")
-
-    while True:
-        await asyncio.sleep(5)
-
-        # keep process which have same pid
-        if not check_pid(fname="runner.pid"):
-            logger.info(f"process [{os.getpid()}] runner quit")
-            break
-
-        latest_task, sup_info = await get_tasks(logger)
-
-        # sleep until next task
-        if not latest_task:
-            await asyncio.sleep(30)
-            continue
-
-        # set running status of task
-        latest_task.applied = model.ENUM_TASK_STATUS.running
-        schema = latest_task.__class__.__name__
-        table = model.__dict__[schema.lower()]
-
-        # update to running status
-        await update_rows(table=table, item=latest_task)
-
-        # run
-        user = await get_user_info(latest_task.user_id)
-        if isinstance(latest_task, schemas.T_CLOCK_SCHEDULES):
-            runner = Clocker(
-                email=user.email,
-                password=user.password,
+    owner = lease.get_worker_id()
+    logger.info(f"process [{os.getpid()}] runner started as {owner}")
+    asyncio.create_task(
+        lease.background_lease_keeper(owner, logger, on_reclaimed=notify))
+
+    scheduler = set_scheduler(DeadlineScheduler(
+        loader=get_upcoming_tasks, logger=logger))
+    asyncio.create_task(scheduler.listen())
+    pool = set_pool(ClockerPool(max_workers=settings.CLOCKER_POOL_SIZE))
+    driver_pool = None
+    if settings.DRIVER_POOL_SIZE > 0:
+        driver_pool = set_driver_pool(DriverPool(
+            size=settings.DRIVER_POOL_SIZE,
+            max_uses=settings.DRIVER_POOL_MAX_USES,
+        ))
+        asyncio.create_task(background_driver_keeper(driver_pool, logger))
+    session_store = None
+    if settings.SESSION_STORE_KEY:
+        session_store = set_session_store(SessionStore(
+            key=settings.SESSION_STORE_KEY))
+    jobs = set()
+
+    def build_clocker(task: Task) -> Clocker:
+        sup_info = task.sup_info
+        if isinstance(task, ClockTask):
+            return Clocker(
+                email=task.user.email,
+                password=task.user.password,
                 gps=sup_info.gps,
                 runner=sup_info.run_type,
+                driver_pool=driver_pool,
+                session_store=session_store,
             )
-        elif isinstance(latest_task, schemas.T_APPLIED_SCHEDULES):
-            nextday = pd.Timestamp.now() + pd.Timedelta(days=1)
-            while is_holiday(nextday):
-                nextday = pd.Timestamp(nextday) + pd.Timedelta(days=1)
-            nextday = nextday.date()
-
-            runner = Clocker(
-                email=user.email,
-                password=user.password,
+        elif isinstance(task, ApplyTask):
+            # apply_date is the next work day of run_date, see build_tasks
+            day2apply = (
+                pd.Timestamp(task.task.apply_date)
+                if task.task.apply_date is not None
+                else get_next_work_day(pd.Timestamp.now()))
+            return Clocker(
+                email=task.user.email,
+                password=task.user.password,
                 schedule_type=sup_info.clock_type,
                 details=sup_info,
-                day2apply=nextday.strftime("%Y-%m-%d"),
+                day2apply=day2apply.strftime("%Y-%m-%d"),
                 runner="apply_telework",
+                driver_pool=driver_pool,
+                session_store=session_store,
             )
-        else:
-            raise NotImplementedError
-            
+        raise NotImplementedError
+
+    async def run_tasks(*, user_id, tasks: List[Task]):
+        """Run due tasks of a user in one session.
+        Every task gets its own status.
+        """
+        results = [None] * len(tasks)
         try:
-            runner(logger=logger)
-            latest_task.applied = model.ENUM_TASK_STATUS.success
-            await update_rows(table=table, item=latest_task)
+            batch = ClockerBatch([build_clocker(task) for task in tasks])
+            if len(tasks) == 1:
+                await pool.run(user_id, batch.head, logger=logger)
+            else:
+                results = await pool.run(user_id, batch, logger=logger)
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            results = [e] * len(tasks)
+
+        for task, error in zip(tasks, results):
+            if error is None:
+                task.task.applied = model.ENUM_TASK_STATUS.success
+            else:
+                logger.error(
+                    "An error occuered when running background task: "
+                    f"{task.task}")
+                task.task.applied = model.ENUM_TASK_STATUS.failed
+
+        # statuses of the batch in one transaction
+        async with unit_of_work():
+            for task in tasks:
+                released = await lease.release(
+                    task.table, owner, task.key, task.task.applied)
+                if not released:
+                    logger.warning(f"Lease of task was lost: {task.task}")
+
+    # the last claim took as many users as it could, more may be due
+    backlog = False
+    while True:
+        # claim no more users than there are free workers, so other
+        # runners get the rest of the due tasks
+        free = settings.CLOCKER_POOL_SIZE - len(jobs)
+        if free <= 0:
+            await asyncio.wait(set(jobs), return_when=asyncio.FIRST_COMPLETED)
+            if backlog:
+                # entries of the due tasks left may be popped already
+                scheduler.wake()
+            continue
 
+        # an error of one round must not stop the runner
+        try:
+            # sleep until next task or schedules are changed
+            await scheduler.next_due()
+
+            # claimed tasks are running and leased by this process.
+            # Due tasks of other entries are claimed too, their entries
+            # will find nothing left
+            tasks = await claim_due_tasks(
+                owner, logger,
+                window=settings.COALESCE_WINDOW_SECONDS,
+                limit=free)
+            by_user: Dict[int, List[Task]] = {}
+            for task in tasks:
+                by_user.setdefault(task.user_id, []).append(task)
+
+            # run in worker threads without blocking the event loop
+            for user_id, user_tasks in by_user.items():
+                job = asyncio.create_task(run_tasks(
+                    user_id=user_id, tasks=user_tasks))
+                jobs.add(job)
+                job.add_done_callback(jobs.discard)
+            backlog = len(by_user) >= free
         except Exception:
             logger.error(traceback.format_exc())
-            logger.error("An error occuered when running background task.")
-            latest_task.applied = model.ENUM_TASK_STATUS.failed
-
-            # update to failed status
-            await update_rows(table=table, item=latest_task)
+            await asyncio.sleep(5)
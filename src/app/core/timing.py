@@ -0,0 +1,57 @@
+from typing import Dict, Iterator, List
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+
+
+@dataclass
+class Phase:
+    name: str
+    seconds: float = 0.
+    rows: int = 0
+    # None unless tracemalloc is tracing
+    peak_bytes: int = None
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else None
+
+    def to_dict(self) -> Dict:
+        return {**asdict(self), "rows_per_second": self.rows_per_second}
+
+
+class PhaseTimer:
+    """Wall time, peak memory and rows of named phases
+
+    Phases entered several times accumulate. Peak memory is measured only
+    while `tracemalloc` is tracing, and phases must not be nested then,
+    since every phase resets the traced peak.
+    """
+
+    def __init__(self, logger: logging.Logger = None) -> None:
+        self.logger = logger
+        self.phases: Dict[str, Phase] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[Phase]:
+        """Time the block. Set `rows` of the yielded phase to report rows/s"""
+        phase = self.phases.setdefault(name, Phase(name=name))
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            phase.seconds += time.perf_counter() - started
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1]
+                phase.peak_bytes = max(phase.peak_bytes or 0, peak)
+            if self.logger is not None:
+                self.logger.info(
+                    f"[{name}] {phase.seconds:.3f} s, {phase.rows} rows")
+
+    def summary(self) -> List[Dict]:
+        return [x.to_dict() for x in self.phases.values()]
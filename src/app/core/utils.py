@@ -3,9 +3,10 @@ import pathlib
 import logging
 import datetime
 
-import pandas as pd
 from geopy.geocoders import Nominatim
 
+from core.holiday import get_calendar
+
 
 PATH_CURR_DIR = pathlib.Path(__file__).parent
 logger = logging.getLogger(__name__)
@@ -13,28 +14,7 @@ logger = logging.getLogger(__name__)
 
 
 def is_holiday(date) -> bool:
-    today = pd.Timestamp(pd.Timestamp(date).date())
-
-    # if saturday or sunday. dayofweek start with 0
-    if today.dayofweek >= 5:
-        return True
-
-    japanese_holiday_url = (
-        "https://www8.cao.go.jp/chosei/shukujitsu/syukujitsu.csv")
-    df = pd.read_csv(japanese_holiday_url, encoding="SHIFT_JIS", dtype=object)
-    try:
-        holidays = pd.to_datetime(df["国民の祝日・休日月日"])
-    except KeyError:
-        raise ValueError("Japnese holiday csv format is changed")
-
-    # if newest holiday older than today,
-    # the holiday csv relese site may changed their policy
-    if holidays.max() <= today:
-        raise ValueError("Japnese holiday csv may be outdated. "
-                         f"Newest holiday in csv is {holidays.max()}")
-    if (holidays == today).any():
-        return True
-    return False
+    return get_calendar().is_holiday(date)
 
 
 async def transfer_corrodinate2address(
@@ -0,0 +1,109 @@
+from typing import Callable, Dict, Tuple
+import logging
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.remote.webelement import WebElement
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from core.config import settings
+
+
+Locator = Tuple[str, str]
+
+
+class WaitTimeout(TimeoutError):
+    pass
+
+
+class Waiter:
+    """Explicit waits on page conditions
+
+    Every wait belongs to a step (like "login", "clock_in") which picks
+    its timeout from `timeouts`, falling back to `timeouts["default"]`.
+    Conditions are polled every `poll` seconds, so a step returns as soon
+    as the page is ready and raises `WaitTimeout` when it never becomes
+    ready.
+    """
+
+    def __init__(
+            self,
+            driver,
+            timeouts: Dict[str, float] = None,
+            poll: float = None,
+            banner_xpath: str = None,
+            logger: logging.Logger = None) -> None:
+        self.driver = driver
+        self.timeouts = timeouts or settings.WAIT_TIMEOUTS
+        self.poll = poll or settings.WAIT_POLL_SECONDS
+        self.banner_xpath = (
+            settings.WAIT_BANNER_XPATH if banner_xpath is None
+            else banner_xpath)
+        self.logger = logger or logging.getLogger(__name__)
+
+    def timeout(self, step: str) -> float:
+        return self.timeouts.get(step, self.timeouts.get("default", 10))
+
+    def until(self, condition: Callable, step: str, what: str):
+        timeout = self.timeout(step)
+        try:
+            return WebDriverWait(
+                self.driver, timeout=timeout, poll_frequency=self.poll,
+            ).until(condition)
+        except TimeoutException:
+            raise WaitTimeout(
+                f"[{step}] {what} not ready after {timeout} seconds "
+                f"(url: {self.driver.current_url})")
+
+    def visible(self, locator: Locator, step: str) -> WebElement:
+        return self.until(
+            EC.visibility_of_element_located(locator), step,
+            f"{locator} visible")
+
+    def enabled(self, locator: Locator, step: str) -> WebElement:
+        return self.until(
+            EC.element_to_be_clickable(locator), step,
+            f"{locator} enabled")
+
+    def navigation(self, url_prefix: str, step: str) -> None:
+        """Wait until the document of `url_prefix` is loaded"""
+        def committed(driver):
+            return driver.current_url.startswith(url_prefix) and (
+                driver.execute_script("return document.readyState")
+                == "complete")
+        self.until(committed, step, f"navigation to {url_prefix}")
+
+    def submitted(self, elem: WebElement, step: str) -> None:
+        """Wait until the server answered the form submitted by `elem`.
+        Either the page is replaced or the button gets disabled.
+        """
+        self.until(
+            EC.any_of(
+                EC.staleness_of(elem),
+                lambda _: not elem.is_enabled(),
+            ),
+            step, "form submission")
+
+    def confirmed(self, elem: WebElement, step: str) -> bool:
+        """Wait for the answer to the click on `elem`, see `submitted`
+        and `banner`.
+
+        The click is sent already, so a slow answer does not mean it
+        failed. Raising would mark the task failed and get it sent
+        again, so warn and return False instead.
+        """
+        try:
+            self.submitted(elem, step)
+            self.banner(step)
+        except WaitTimeout as e:
+            self.logger.warning(f"Submitted but not confirmed: {e}")
+            return False
+        return True
+
+    def banner(self, step: str) -> WebElement:
+        """Wait for the confirmation banner. Skip if no xpath is set."""
+        if not self.banner_xpath:
+            return None
+        return self.until(
+            EC.presence_of_element_located(("xpath", self.banner_xpath)),
+            step, "confirmation banner")
@@ -0,0 +1,286 @@
+"""Read-through cache of the master tables
+
+m_users, m_work_types and m_work_schedule_types are read by most
+endpoints but change only through their /update endpoints. Each worker
+process keeps them in memory, indexed by their lookup columns.
+
+Every table has a version, bumped on invalidation. A load started before
+an invalidation is not cached, so a concurrent write is never hidden.
+Writers call `notify_master_changed`, which invalidates this process and,
+through postgres NOTIFY, the other processes. Entries also expire after
+`MASTER_CACHE_TTL_SECONDS` as a safety net for missed notifications.
+"""
+from typing import Dict, List
+import asyncio
+import collections
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import asyncpg
+import numpy as np
+import pandas as pd
+from sqlalchemy import Table, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import config
+from . import db_utils
+from . import model
+from .database import (
+    PG_DSN,
+    after_commit,
+    async_session,
+    in_unit_of_work,
+    transaction,
+)
+
+
+settings = config.Settings()
+
+# postgres channel notified when a master table changes.
+# payload: "<table name>:<id of the notifying cache>"
+CHANNEL_MASTER_CHANGED = "master_changed"
+
+# session info key of master tables changed in a unit of work
+_CHANGED = "master_tables_changed"
+
+# table name: columns indexed for equality lookups
+INDEX_COLUMNS = {
+    model.m_users.name: ["user_id", "email"],
+    model.m_work_types.name: ["id", "type_name"],
+    model.m_work_schedule_types.name: ["id", "type_name"],
+}
+
+
+@dataclass
+class CacheEntry:
+    df: pd.DataFrame
+    version: int
+    loaded_at: float
+    # column: {value: row positions}
+    indexes: Dict[str, Dict] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, version: int, columns: List[str]):
+        df = df.reset_index(drop=True)
+        indexes = {
+            col: df.groupby(col, sort=False).indices for col in columns}
+        return cls(df=df, version=version,
+                   loaded_at=time.monotonic(), indexes=indexes)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.loaded_at
+
+
+class MasterCache:
+    """Versioned in-process cache of the tables in `INDEX_COLUMNS`
+
+    `get_rows` mirrors `db_utils.get_rows` for equality filters.
+    Filters on indexed columns are looked up, others are scanned.
+    """
+
+    def __init__(
+            self,
+            ttl_seconds: float = settings.MASTER_CACHE_TTL_SECONDS) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.id = uuid.uuid4().hex
+        self._entries: Dict[str, CacheEntry] = {}
+        self._versions: Dict[str, int] = collections.defaultdict(int)
+        self._locks: Dict[str, asyncio.Lock] = collections.defaultdict(
+            asyncio.Lock)
+        self._listener: asyncpg.Connection = None
+
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+        # reads which found an invalidated or expired entry
+        self.stale = collections.Counter()
+        self.invalidations = 0
+        self.remote_invalidations = 0
+
+    def __repr__(self) -> str:
+        return f"<MasterCache tables: {list(self._entries)}>"
+
+    def version(self, table_name: str) -> int:
+        return self._versions[table_name]
+
+    def stats(self) -> Dict:
+        hits = sum(self.hits.values())
+        lookups = hits + sum(self.misses.values())
+        tables = {}
+        for name in INDEX_COLUMNS:
+            entry = self._entries.get(name)
+            tables[name] = {
+                "version": self._versions[name],
+                "rows": None if entry is None else len(entry.df),
+                "age_seconds": None if entry is None else entry.age,
+                "hits": self.hits[name],
+                "misses": self.misses[name],
+                "stale": self.stale[name],
+            }
+        return {
+            "hits": hits,
+            "misses": lookups - hits,
+            "hit_rate": hits / lookups if lookups else None,
+            "invalidations": self.invalidations,
+            "remote_invalidations": self.remote_invalidations,
+            "listening": (self._listener is not None)
+            and not self._listener.is_closed(),
+            "tables": tables,
+        }
+
+    def invalidate(self, table_name: str = None) -> None:
+        """Drop the entry of `table_name`, all entries if None"""
+        names = list(INDEX_COLUMNS) if table_name is None else [table_name]
+        for name in names:
+            self._versions[name] += 1
+            self._entries.pop(name, None)
+        self.invalidations += 1
+
+    def _fresh(self, entry: CacheEntry, table_name: str) -> bool:
+        return (entry.version == self._versions[table_name]) and (
+            entry.age < self.ttl_seconds)
+
+    async def get_entry(
+            self,
+            table: Table,
+            logger: logging.Logger) -> CacheEntry:
+        """Loaded in a session of its own, so only committed rows
+        are cached
+        """
+        name = table.name
+        entry = self._entries.get(name)
+        if (entry is not None) and self._fresh(entry, name):
+            self.hits[name] += 1
+            return entry
+
+        async with self._locks[name]:
+            # loaded by a concurrent read while waiting
+            entry = self._entries.get(name)
+            if (entry is not None) and self._fresh(entry, name):
+                self.hits[name] += 1
+                return entry
+            if entry is not None:
+                self.stale[name] += 1
+            self.misses[name] += 1
+
+            version = self._versions[name]
+            async with async_session() as session:
+                df = await db_utils.get_rows(
+                    session=session, table=table, logger=logger)
+            entry = CacheEntry.build(df, version, INDEX_COLUMNS[name])
+            if version == self._versions[name]:
+                self._entries[name] = entry
+            else:
+                logger.info(f"{name} changed while loading, not cached")
+        return entry
+
+    async def get_rows(
+            self,
+            session: AsyncSession,
+            table: Table,
+            logger: logging.Logger,
+            columns: List[str] = None,
+            **filter_kwargs) -> pd.DataFrame:
+        """Cached `db_utils.get_rows`. Only equality filters are supported.
+        The returned frame is a copy and can be modified.
+        """
+        # a unit of work reads its own changes
+        changed = session.info.get(_CHANGED, ())
+        if (table.name not in INDEX_COLUMNS or self.ttl_seconds <= 0
+                or table.name in changed):
+            return await db_utils.get_rows(
+                session=session, table=table, logger=logger,
+                columns=columns, **filter_kwargs)
+
+        for key in filter_kwargs:
+            if key not in table.c:
+                raise ValueError(
+                    f"Cannot filter {table.name} by '{key}' in the cache")
+
+        entry = await self.get_entry(table, logger)
+        df = entry.df
+        positions = np.arange(len(df))
+        for key, v in filter_kwargs.items():
+            if key in entry.indexes:
+                found = entry.indexes[key].get(v)
+                positions = positions[:0] if found is None else (
+                    np.intersect1d(positions, found))
+            else:
+                mask = (df[key] == v).to_numpy()
+                positions = positions[mask[positions]]
+
+        columns = db_utils.get_db_keys(table) if columns is None else list(
+            columns)
+        return df.iloc[positions][columns].reset_index(drop=True)
+
+    def on_notify(self, connection, pid, channel, payload: str) -> None:
+        """asyncpg listener callback"""
+        table_name, _, sender = payload.partition(":")
+        if sender == self.id:
+            return
+        self.remote_invalidations += 1
+        self.invalidate(table_name or None)
+
+    async def listen(self, logger: logging.Logger) -> None:
+        """Invalidate on NOTIFY from other processes. Reconnect on failures."""
+        while True:
+            try:
+                if (self._listener is None) or self._listener.is_closed():
+                    self._listener = await asyncpg.connect(PG_DSN)
+                    await self._listener.add_listener(
+                        CHANNEL_MASTER_CHANGED, self.on_notify)
+                    logger.info(f"Listen on '{CHANNEL_MASTER_CHANGED}'")
+                    # changes may be missed while disconnected
+                    self.invalidate()
+            except Exception as e:
+                logger.error(f"Failed to listen master changes: {e}")
+                self._listener = None
+            await asyncio.sleep(30)
+
+
+_cache: MasterCache = None
+
+
+def get_master_cache() -> MasterCache:
+    return _cache
+
+
+def set_master_cache(cache: MasterCache) -> MasterCache:
+    global _cache
+    _cache = cache
+    return _cache
+
+
+async def get_master_rows(
+        session: AsyncSession,
+        table: Table,
+        logger: logging.Logger,
+        columns: List[str] = None,
+        **filter_kwargs) -> pd.DataFrame:
+    """Read through the cache of this process, if any"""
+    cache = get_master_cache()
+    if cache is None:
+        return await db_utils.get_rows(
+            session=session, table=table, logger=logger,
+            columns=columns, **filter_kwargs)
+    return await cache.get_rows(
+        session, table, logger, columns=columns, **filter_kwargs)
+
+
+async def notify_master_changed(session: AsyncSession, table: Table):
+    """Invalidate `table` in this process and in the other processes,
+    once the changes of `session` are committed
+    """
+    cache = get_master_cache()
+    sender = ""
+    if cache is not None:
+        after_commit(session, lambda: cache.invalidate(table.name))
+        sender = cache.id
+    if in_unit_of_work(session):
+        session.info.setdefault(_CHANGED, set()).add(table.name)
+
+    async with transaction(session):
+        await session.execute(select(func.pg_notify(
+            CHANNEL_MASTER_CHANGED, f"{table.name}:{sender}")))
@@ -7,4 +7,21 @@ class Settings(BaseSettings):
     DB_USER: str
     DB_PASS: str
 
+    # connections kept open per process, and opened beyond them at peaks
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    # seconds to wait for a connection before raising
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+
+    # "pandas" diffs update_table in python, "sql" in a staging table
+    UPDATE_TABLE_MODE: str = "pandas"
+    # "copy" writes rows with binary COPY into a temporary table,
+    # "insert" with chunked multi-row inserts
+    BULK_WRITE_MODE: str = "copy"
+    # master tables are cached in every process for this long at most,
+    # 0 disables the cache
+    MASTER_CACHE_TTL_SECONDS: float = 600
+
     model_config = SettingsConfigDict(env_file=".env")
@@ -1,16 +1,155 @@
+"""Engine, sessions and units of work
+
+A unit of work shares one session and one transaction across every db
+helper called in its block. Helpers enter `transaction(session)`, which
+joins the unit of work of the session instead of committing on their
+own, and `unit_of_work()` without a session joins the one of the
+current task, so nested calls of the runner share it too.
+"""
+from typing import Callable, Dict
+import contextvars
+import time
+from contextlib import asynccontextmanager
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from . import config
 
 
 settings = config.Settings()
-DB_URL = "postgresql+asyncpg://" \
+PG_DSN = "postgresql://" \
     f"{settings.DB_USER}:{settings.DB_PASS}@{settings.DB_HOST}:5432/{settings.DB_NAME}"
+DB_URL = PG_DSN.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool which records how long checkouts wait for a connection"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.wait_seconds = 0.
+        self.max_wait_seconds = 0.
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.waits += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
 
-engine = create_async_engine(DB_URL, echo=False)
+    def stats(self) -> Dict[str, float]:
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "in_use": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            "max_overflow": self._max_overflow,
+            "checkouts": self.waits,
+            "wait_seconds_avg": (
+                self.wait_seconds / self.waits if self.waits else None),
+            "wait_seconds_max": self.max_wait_seconds,
+            "timeouts": self.timeouts,
+        }
+
+
+engine = create_async_engine(
+    DB_URL,
+    echo=False,
+    poolclass=TimedQueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+)
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 
+def get_pool_stats() -> Dict[str, float]:
+    return engine.sync_engine.pool.stats()
+
+
 async def get_session():
     async with async_session() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+# session of the unit of work of the current task
+_current_session: contextvars.ContextVar = contextvars.ContextVar(
+    "current_session", default=None)
+_UOW = "unit_of_work"
+_AFTER_COMMIT = "after_commit"
+
+
+def in_unit_of_work(session: AsyncSession) -> bool:
+    return session.info.get(_UOW, False)
+
+
+@asynccontextmanager
+async def unit_of_work(session: AsyncSession = None):
+    """Share one transaction in this block. Commit at the end,
+    roll back on errors.
+
+    Parameters
+    ----------
+    session : AsyncSession, optional
+        session to run in, like the one of a request. By default the
+        session of the enclosing unit of work, or a new one.
+        Do not start tasks using the session in the block.
+    """
+    session = session or _current_session.get()
+    if session is not None and in_unit_of_work(session):
+        yield session
+        return
+
+    own = session is None
+    if own:
+        session = async_session()
+    token = _current_session.set(session)
+    # anything put in session.info by the block is dropped at its end
+    info = dict(session.info)
+    session.info[_UOW] = True
+    callbacks = session.info[_AFTER_COMMIT] = []
+    try:
+        async with session.begin():
+            yield session
+    finally:
+        session.info.clear()
+        session.info.update(info)
+        _current_session.reset(token)
+        if own:
+            await session.close()
+
+    for callback in callbacks:
+        callback()
+
+
+@asynccontextmanager
+async def transaction(session: AsyncSession):
+    """`session.begin()`, or nothing in a unit of work"""
+    if in_unit_of_work(session):
+        yield session
+    else:
+        async with session.begin():
+            yield session
+
+
+def after_commit(session: AsyncSession, callback: Callable[[], None]):
+    """Call `callback` once the changes of `session` are committed.
+    Changes outside a unit of work are committed already.
+    """
+    if in_unit_of_work(session):
+        session.info[_AFTER_COMMIT].append(callback)
+    else:
+        callback()
@@ -1,24 +1,31 @@
-from typing import Any
+from typing import Any, List
+from functools import lru_cache
+import itertools
 import logging
+import time
 # import datetime
 # import enum
-from distutils.util import strtobool
 import warnings
 
 import pandas as pd
 import numpy as np
 # from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete, bindparam, update, and_
+from sqlalchemy import select, delete, bindparam, update, and_, text
+from sqlalchemy import Table, Column, MetaData
 # from sqlalchemy.inspection import inspect
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy import Enum, Time, Boolean, Integer, DateTime
 
+from . import config
 from . import model as dbmodel
+from .database import transaction
 
 warnings.simplefilter('ignore', FutureWarning)
 pd.options.display.max_columns = 999
 
+settings = config.Settings()
+
 # async def get_user(db: AsyncSession, user_id: int):
 #     result = await (db.execute(select(dbmodel.M_USERS).filter_by(
 #         dbmodel.M_USERS.userId == user_id)))
@@ -53,123 +60,200 @@ def get_db_sub_keys(table: dbmodel.Base) -> list:
                 set(get_db_keys(table=table, primary=True)))
 
 
-def format_df(
-        df: pd.DataFrame,
-        table: dbmodel.Base,
-        logger: logging.Logger) -> pd.DataFrame:
-    df = df.copy(deep=True)
-    df = df.mask(df == "", np.nan)
+# strings accepted by strtobool
+BOOL_STRINGS = {
+    **{x: True for x in ("y", "yes", "t", "true", "on", "1")},
+    **{x: False for x in ("n", "no", "f", "false", "off", "0")},
+}
+_EPOCH = pd.Timestamp(0)
 
-    db_keys = get_db_keys(table)
 
-    diff_kesy = set(df.columns) - set(db_keys)
-    if diff_kesy:
-        logger.warning("Skip format columns since not exist "
-                       f"in input df: {diff_kesy}")
+def _to_time(s: pd.Series) -> pd.Series:
+    s = s.astype(str)
+    try:
+        return (_EPOCH + pd.to_timedelta(s)).dt.time
+    except ValueError:
+        # not "HH:MM:SS". Like: "2023-01-01 08:00:00"
+        return pd.to_datetime(s, format="mixed").dt.time
 
-    for col in db_keys:
-        if col not in df.columns:
-            continue
-        t_col = table.c[col]
-        dtype = t_col.type
-        ptype = dtype.python_type
-        df[col] = df[col].astype(object)
-        # logger.info(f"{col}: dtype - {dtype}, ptype - {ptype}")
-
-        not_na = df[col].notnull()
+
+def _to_datetime(s: pd.Series) -> pd.Series:
+    return pd.Series(
+        np.asarray(pd.to_datetime(s).dt.to_pydatetime()), index=s.index,
+        dtype=object)
+
+
+def _to_int(s: pd.Series) -> pd.Series:
+    return pd.to_numeric(s).astype("Int64")
+
+
+def _to_bool(s: pd.Series) -> pd.Series:
+    res = s.astype(str).str.lower().map(BOOL_STRINGS)
+    if res.isnull().any():
+        raise ValueError(
+            f"invalid truth value {s[res.isnull()].iloc[0]!r}")
+    return res
+
+
+@lru_cache(maxsize=None)
+def get_converters(table: dbmodel.Base) -> dict:
+    """Vectorized converter of each column of `table`,
+    applied to non-null values by `format_df`. None for no conversion.
+    """
+    converters = {}
+    for col in table.c:
+        dtype = col.type
         if isinstance(dtype, Time):
-            df.loc[not_na, col] = df.loc[not_na, col].astype(
-                str).apply(pd.Timestamp).apply(
-                    lambda x: x.time())
-            # logger.info(f"Format {col} to Time")
+            converters[col.name] = _to_time
         elif isinstance(dtype, DateTime):
-            df.loc[not_na, col] = pd.to_datetime(
-                df.loc[not_na, col]).dt.to_pydatetime()
-            # logger.info(f"Format {col} to Date")
-        elif isinstance(dtype, Enum):
-            # logger.info(f"Skip fromat enum {col}")
-            pass
+            converters[col.name] = _to_datetime
         elif isinstance(dtype, Integer):
-            df.loc[not_na, col] = df.loc[not_na, col].astype("Int64")
-            # logger.info(f"Format {col} to int")
+            converters[col.name] = _to_int
         elif isinstance(dtype, Boolean):
-            df.loc[not_na, col] = (
-                df.loc[not_na, col].apply(
-                    lambda x: bool(strtobool(str(x)))
-                )
-            )
-            # logger.info(f"Format {col} to bool")
+            converters[col.name] = _to_bool
+        else:
+            converters[col.name] = None
+    return converters
 
 
-    # format dtypes
-    df = df.astype(object)
-    df = df.mask(pd.isnull(df), None)
-    return df
+def format_df(
+        df: pd.DataFrame,
+        table: dbmodel.Base,
+        logger: logging.Logger) -> pd.DataFrame:
+    """Cast columns of `df` to the python types of `table`.
+    Empty strings and nulls are cast to None.
+    """
+    converters = get_converters(table)
+
+    diff_kesy = set(df.columns) - set(converters)
+    if diff_kesy:
+        logger.warning("Skip format columns since not exist "
+                       f"in input df: {diff_kesy}")
+
+    res = {}
+    for col in df.columns:
+        s = df[col]
+        not_na = s.notnull()
+        if s.dtype == object or pd.api.types.is_string_dtype(s):
+            not_na &= s != ""
+        values = np.full(len(s), None, dtype=object)
+        if not_na.any():
+            s = s[not_na]
+            convert = converters.get(col)
+            if convert is None:
+                values[not_na.to_numpy()] = s.to_numpy(dtype=object)
+            else:
+                # convert distinct values only, then broadcast them back
+                codes, uniques = pd.factorize(s)
+                x = convert(pd.Series(uniques))
+                x = x.astype(object).where(x.notnull(), None)
+                values[not_na.to_numpy()] = x.to_numpy(dtype=object)[codes]
+        res[col] = values
+    return pd.DataFrame(res, index=df.index, columns=df.columns, dtype=object)
+
+
+# suffixes of get_rows filters. Like: {"run_time__lt": now}
+FILTER_OPERATORS = {
+    "eq": lambda col, v: col == v,
+    "ne": lambda col, v: col != v,
+    "lt": lambda col, v: col < v,
+    "le": lambda col, v: col <= v,
+    "gt": lambda col, v: col > v,
+    "ge": lambda col, v: col >= v,
+    "in": lambda col, v: col.in_(v),
+}
+
+
+@lru_cache(maxsize=None)
+def get_enum_values(enum_cls) -> dict:
+    """Mapping of members to values of an Enum class"""
+    return {x: x.value for x in enum_cls}
+
+
+def _cast(t_col, v):
+    ptype = t_col.type.python_type
+    if v is None or isinstance(v, ptype):
+        return v
+    try:
+        return ptype(v)
+    except (TypeError, ValueError):
+        raise ValueError(f"Cast error. {v} to {ptype}")
+
+
+def build_filter(table: dbmodel.Base, key: str, v: Any):
+    """Compile a get_rows filter like `run_time__lt=now` to a clause"""
+    col, _, op = key.partition("__")
+    if col not in table.c:
+        raise KeyError(f"{col} is not a column of {table}")
+    op = op or "eq"
+    if op not in FILTER_OPERATORS:
+        raise ValueError(f"Unknown filter operator: {op}")
+    t_col = table.c[col]
+
+    if op == "in":
+        v = [_cast(t_col, x) for x in v]
+    elif v is None:
+        raise NotImplementedError
+    else:
+        v = _cast(t_col, v)
+    return FILTER_OPERATORS[op](t_col, v)
 
 
 async def get_rows(
         session: AsyncSession,
         table: dbmodel.Base,
         logger: logging.Logger,
+        columns: List[str] = None,
+        order_by: List[str] = None,
+        limit: int = None,
         **filter_kwargs):
-    """Get first row from db
+    """Get rows from db
 
     Parameters
     ----------
     session : AsyncSession
-        _description_
     table : dbmodel.Base
-        _description_
+    columns : List[str], optional
+        columns to select, by default all
+    order_by : List[str], optional
+        columns to sort by. Prefix with "-" for descending order
+    limit : int, optional
+        max number of rows
     **filter_kwargs : Any
-        Used to filter records in db. Like: {"name": "liu", "userId": 1}
+        Used to filter records in db. Like: {"name": "liu", "userId": 1}.
+        Suffix a column with `__ne`, `__lt`, `__le`, `__gt`, `__ge`
+        or `__in` for other comparisons. Like: {"user_id__in": [1, 2]}
 
     Returns
     -------
-    _type_
-        _description_
-
-    Raises
-    ------
-    AssertionError
-        _description_
-    HTTPException
-        _description_
+    pd.DataFrame
+        Enum columns are decoded to their values
     """
-    stmt = select(table)
-    sup_values = {}
-    for col, v in filter_kwargs.items():
-        t_col = table.c[col]
-        dtype = t_col.type
-
-        if col not in table.c:
-            raise
-
-        if v is None:
-            raise NotImplementedError
-        
-        stmt = stmt.where(t_col == bindparam(col, dtype))
-        try:
-            sup_values[col] = dtype.python_type(v)
-        except ValueError:
-            raise ValueError(f"Cast error. {v} to {dtype.python_type}")
-
-    async with session.begin():
-        res = await session.execute(stmt, sup_values)
+    columns = get_db_keys(table) if columns is None else list(columns)
+    stmt = select(*[table.c[col] for col in columns])
+    stmt = stmt.where(*[
+        build_filter(table, k, v) for k, v in filter_kwargs.items()])
+    for col in order_by or []:
+        if col.startswith("-"):
+            stmt = stmt.order_by(table.c[col[1:]].desc())
+        else:
+            stmt = stmt.order_by(table.c[col])
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    # rows are unique if their primary key is selected
+    pkeys = get_db_keys(table, primary=True)
+    if not (pkeys and set(pkeys) <= set(columns)):
+        stmt = stmt.distinct()
+
+    async with transaction(session):
+        res = await session.execute(stmt)
         res = res.all()
-        await session.commit()
-    
-    df = pd.DataFrame(res, columns=[x.name for x in table.c])
-    df = df.drop_duplicates().reset_index(drop=True)
 
-    db_keys = get_db_keys(table)
-    for col in db_keys:
-        if col not in df.columns:
-            continue
-        t_col = table.c[col]
-        dtype = t_col.type
-        # ptype = dtype.python_type
-        if isinstance(dtype, Enum):
-            df[col] = df[col].apply(lambda x: x.value)
+    df = pd.DataFrame(res, columns=columns)
+    for col in columns:
+        dtype = table.c[col].type
+        if isinstance(dtype, Enum) and dtype.enum_class is not None:
+            df[col] = df[col].map(get_enum_values(dtype.enum_class))
     return df
 
 
@@ -180,6 +264,12 @@ async def update_table(
         unique_keys: list[str],
         logger: logging.Logger,
         set_increment: str = None):
+    if settings.UPDATE_TABLE_MODE == "sql":
+        return await merge_table(
+            df=df, session=session, table=table, unique_keys=unique_keys,
+            logger=logger, set_increment=set_increment)
+    if isinstance(unique_keys, str):
+        unique_keys = [unique_keys]
     db_keys = get_db_keys(table)
     pkeys = get_db_keys(table, primary=True)
 
@@ -214,7 +304,8 @@ async def update_table(
     df = df[df["_merge"]!="right_only"]
     if set_increment is not None:
         df = df.sort_values(by=set_increment).reset_index(drop=True)
-        inc_frm = df[set_increment].max()
+        # after the largest id of the table, not of the changed rows only
+        inc_frm = exsit[set_increment].max()
         if pd.isnull(inc_frm):
             inc_frm = 0
         df[set_increment] = df[set_increment].fillna(
@@ -230,27 +321,223 @@ async def update_table(
     return df.reset_index(drop=True)
 
 
+async def merge_table(
+        *, df: pd.DataFrame,
+        session: AsyncSession,
+        table: dbmodel.Base,
+        unique_keys: list[str],
+        logger: logging.Logger,
+        set_increment: str = None) -> pd.DataFrame:
+    """Server side version of `update_table`
+
+    `df` is loaded into a temporary staging table, then in one transaction
+    rows of `table` missing from it are deleted and new or changed rows
+    (`IS DISTINCT FROM` on any column) are upserted. Rows are matched on
+    `unique_keys`. New rows get `set_increment` from the sequence
+    "<table>_<set_increment>_seq", see migration 0005.
+
+    Returns
+    -------
+    pd.DataFrame
+        upserted rows with the columns of `table`
+    """
+    if isinstance(unique_keys, str):
+        unique_keys = [unique_keys]
+    db_keys = get_db_keys(table)
+    pkeys = get_db_keys(table, primary=True)
+    cols = [x for x in db_keys if x in df.columns]
+    records = format_df(
+        df[cols], table=table, logger=logger).to_dict("records")
+
+    stage = Table(
+        f"stage_{table.name}_{next(_bulk_tables)}", MetaData(),
+        *[Column(x, table.c[x].type) for x in cols])
+    match = " AND ".join(
+        f"s.{x} IS NOT DISTINCT FROM t.{x}" for x in unique_keys)
+    changed = " OR ".join(
+        f"s.{x} IS DISTINCT FROM t.{x}" for x in cols
+        if x not in unique_keys + [set_increment])
+    where = f"t.{pkeys[0]} IS NULL" + (f" OR {changed}" if changed else "")
+
+    insert_cols = cols + [
+        x for x in [set_increment] if x is not None and x not in cols]
+    select_cols = [f"s.{x}" for x in insert_cols]
+    if set_increment is not None:
+        seq = f"{table.name}_{set_increment}_seq"
+        given = f"s.{set_increment}, " if set_increment in cols else ""
+        select_cols[insert_cols.index(set_increment)] = (
+            f"COALESCE({given}t.{set_increment}, nextval('{seq}'))")
+    updates = ", ".join(
+        f"{x} = EXCLUDED.{x}" for x in insert_cols if x not in pkeys)
+
+    async with transaction(session):
+        await session.execute(text(
+            f"CREATE TEMPORARY TABLE {stage.name} ON COMMIT DROP AS "
+            f"SELECT {', '.join(cols)} FROM {table.name} WITH NO DATA"))
+        if records:
+            await session.execute(insert(stage), records)
+
+        res = await session.execute(text(
+            f"DELETE FROM {table.name} t WHERE NOT EXISTS ("
+            f"SELECT 1 FROM {stage.name} s WHERE {match})"))
+        logger.info(f"Delete {res.rowcount} rows from {table}")
+
+        if set_increment is not None:
+            # rows written by the pandas mode may be ahead of the sequence
+            await session.execute(text(
+                f"SELECT setval('{seq}', x.m) "
+                f"FROM (SELECT max({set_increment}) AS m "
+                f"FROM {table.name}) x, {seq} q WHERE x.m >= q.last_value"))
+
+        upsert = text(
+            f"INSERT INTO {table.name} ({', '.join(insert_cols)}) "
+            f"SELECT {', '.join(select_cols)} "
+            f"FROM {stage.name} s LEFT JOIN {table.name} t ON {match} "
+            f"WHERE {where} "
+            f"ON CONFLICT ON CONSTRAINT {table.name}_pkey "
+            + (f"DO UPDATE SET {updates} " if updates else "DO NOTHING ")
+            + f"RETURNING {', '.join(db_keys)}")
+        # typed columns, so enum labels are read back as members
+        res = await session.execute(
+            upsert.columns(*[table.c[x] for x in db_keys]))
+        rows = res.all()
+    logger.info(f"Upsert {len(rows)} rows to {table}")
+
+    df = pd.DataFrame(rows, columns=db_keys)
+    for col in db_keys:
+        dtype = table.c[col].type
+        if isinstance(dtype, Enum) and dtype.enum_class is not None:
+            df[col] = df[col].map(get_enum_values(dtype.enum_class))
+    return df
+
+
+# postgres protocol limit of bind parameters in one statement
+MAX_BIND_PARAMS = 32767
+_bulk_tables = itertools.count()
+
+
+@lru_cache(maxsize=None)
+def get_enum_labels(dtype: Enum) -> dict:
+    """Mapping of members to the labels stored in db of an Enum column"""
+    return {
+        x: x.value if x.value in dtype.enums else x.name
+        for x in dtype.enum_class}
+
+
+def to_records(df: pd.DataFrame, table: dbmodel.Base) -> List[tuple]:
+    """Rows of `df` as tuples of python values for COPY.
+    Nulls are cast to None and Enum members to their labels.
+    """
+    values = []
+    for col in df.columns:
+        s = df[col].astype(object)
+        x = s.where(s.notnull(), None).tolist()
+        dtype = table.c[col].type
+        if isinstance(dtype, Enum) and dtype.enum_class is not None:
+            labels = get_enum_labels(dtype)
+            x = [labels.get(v, v) for v in x]
+        elif isinstance(dtype, DateTime):
+            x = [v.to_pydatetime() if isinstance(v, pd.Timestamp) else v
+                 for v in x]
+        values.append(x)
+    return list(zip(*values))
+
+
+def chunk_rows(n_cols: int) -> int:
+    """Rows of a multi-row insert within MAX_BIND_PARAMS"""
+    return max(1, MAX_BIND_PARAMS // max(1, n_cols))
+
+
+async def bulk_write(
+        *, df: pd.DataFrame,
+        session: AsyncSession,
+        table: dbmodel.Base,
+        logger: logging.Logger,
+        on_conflict: str = None,
+        mode: str = None) -> int:
+    """Write rows of `df` to `table` in one transaction
+
+    Parameters
+    ----------
+    on_conflict : str, optional
+        "nothing" to skip rows conflicting on the primary key, "update"
+        to overwrite their other columns in `df`, by default raise
+    mode : str, optional
+        "copy" or "insert", by default `BULK_WRITE_MODE`. "copy" falls
+        back to "insert" if the driver does not support COPY
+
+    Returns
+    -------
+    int
+        number of rows inserted or updated
+    """
+    mode = mode or settings.BULK_WRITE_MODE
+    cols = list(df.columns)
+    pkeys = get_db_keys(table, primary=True)
+    sub_keys = [x for x in cols if x not in pkeys]
+    if df.empty:
+        return 0
+
+    started = time.perf_counter()
+    async with transaction(session):
+        raw = None
+        if mode == "copy":
+            conn = await session.connection()
+            raw = (await conn.get_raw_connection()).driver_connection
+            if not hasattr(raw, "copy_records_to_table"):
+                raw, mode = None, "insert"
+
+        if raw is not None:
+            tmp = f"bulk_{table.name}_{next(_bulk_tables)}"
+            conflict = ""
+            if on_conflict == "nothing" or (
+                    on_conflict == "update" and not sub_keys):
+                conflict = "ON CONFLICT DO NOTHING"
+            elif on_conflict == "update":
+                conflict = (
+                    f"ON CONFLICT ON CONSTRAINT {table.name}_pkey "
+                    "DO UPDATE SET " + ", ".join(
+                        f"{x} = EXCLUDED.{x}" for x in sub_keys))
+            await session.execute(text(
+                f"CREATE TEMPORARY TABLE {tmp} ON COMMIT DROP AS "
+                f"SELECT {', '.join(cols)} FROM {table.name} WITH NO DATA"))
+            await raw.copy_records_to_table(
+                tmp, records=to_records(df, table), columns=cols)
+            res = await session.execute(text(
+                f"INSERT INTO {table.name} ({', '.join(cols)}) "
+                f"SELECT {', '.join(cols)} FROM {tmp} {conflict}"))
+            n = res.rowcount
+        else:
+            records = df.to_dict("records")
+            size = chunk_rows(len(cols))
+            n = 0
+            for i in range(0, len(records), size):
+                stmt = insert(table).values(records[i:i + size])
+                if on_conflict == "nothing" or (
+                        on_conflict == "update" and not sub_keys):
+                    stmt = stmt.on_conflict_do_nothing()
+                elif on_conflict == "update":
+                    stmt = stmt.on_conflict_do_update(
+                        constraint=f"{table.name}_pkey",
+                        set_={k: stmt.excluded[k] for k in sub_keys})
+                n += (await session.execute(stmt)).rowcount
+
+    seconds = time.perf_counter() - started
+    logger.info(
+        f"Wrote {n} of {len(df)} rows to {table} with {mode} "
+        f"in {seconds:.3f} s ({len(df) / max(seconds, 1e-9):.0f} rows/s)")
+    return n
+
+
 async def upsert_rows(
         *, df: pd.DataFrame,
         session: AsyncSession,
         table: dbmodel.Base,
         logger: logging.Logger):
     assert_model_types(table)
-    pkeys = [x.name for x in table.primary_key]
-    sub_keys = set([x.name for x in table.columns]) - set(pkeys)
-
-    insert_stmt = insert(table).values(df.to_dict("records"))
-
-    do_update_stmt = insert_stmt.on_conflict_do_update(
-        constraint=f"{table.name}_pkey",
-        set_={
-            k: insert_stmt.excluded[k]
-            for k in sub_keys
-            if k in df.columns
-        })
-    async with session.begin():
-        await session.execute(do_update_stmt)
-        await session.commit()
+    return await bulk_write(
+        df=df, session=session, table=table, logger=logger,
+        on_conflict="update")
 
 
 async def insert_rows(
@@ -260,13 +547,9 @@ async def insert_rows(
         logger: logging.Logger,
         on_conflict_do_nothing: bool = False,
 ):
-    insert_stmt = insert(table).values(df.to_dict("records"))
-    if on_conflict_do_nothing:
-        insert_stmt = insert_stmt.on_conflict_do_nothing()
-    
-    async with session.begin():
-        await session.execute(insert_stmt)
-        await session.commit()
+    return await bulk_write(
+        df=df, session=session, table=table, logger=logger,
+        on_conflict="nothing" if on_conflict_do_nothing else None)
 
 
 async def update_rows(
@@ -288,9 +571,8 @@ async def update_rows(
         values({col: bindparam(f"b_{col}") for col in sub_keys})
     
     df = format_df(df, table=table, logger=logger)
-    async with session.begin():
+    async with transaction(session):
         await session.execute(stmt, df.add_prefix("b_").to_dict("records"))
-        await session.commit()
 
 
 async def delete_row(
@@ -304,6 +586,5 @@ async def delete_row(
         stmt = stmt.where(
             table.c[col] == bindparam(col, table.c[col].type)
         )
-    async with session.begin():
+    async with transaction(session):
         await session.execute(stmt, df.to_dict("records"))
-        await session.commit()
@@ -0,0 +1,197 @@
+"""Versioned schema migrations
+
+Files in `migrations/` named `<version>_<name>.sql` are applied in version
+order, each in its own transaction, and recorded in schema_migrations.
+An advisory lock keeps concurrent workers from applying them twice.
+init.sql only runs on the first boot of the database container, so any
+schema change after it must come as a migration, written to be a no-op
+on databases already created from init.sql.
+
+Usage (from src/app)::
+
+    python -m database.migrate
+    python -m database.migrate --check   # EXPLAIN the hot queries
+"""
+from typing import Dict, List
+import argparse
+import asyncio
+import hashlib
+import logging
+import pathlib
+from dataclasses import dataclass
+
+import asyncpg
+
+from .database import PG_DSN
+
+
+MIGRATIONS_DIR = pathlib.Path(__file__).parent / "migrations"
+# any constant shared by every process migrating the database
+LOCK_KEY = 7778_0001
+
+CREATE_VERSIONS = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+  version integer PRIMARY KEY,
+  name text NOT NULL,
+  checksum text NOT NULL,
+  applied_at timestamp NOT NULL DEFAULT now()
+)
+"""
+
+# query name: (sql, index the plan must use)
+HOT_QUERIES = {
+    "upcoming clock tasks": (
+        "SELECT user_id, run_date, run_type, run_time FROM t_clock_schedules "
+        "WHERE active = true AND applied = 'pending' "
+        "AND run_time IS NOT NULL ORDER BY run_time LIMIT 100",
+        "ix_t_clock_schedules_pending"),
+    "upcoming apply tasks": (
+        "SELECT user_id, run_date, run_type, run_time "
+        "FROM t_applied_schedules "
+        "WHERE active = true AND applied = 'pending' "
+        "AND run_time IS NOT NULL ORDER BY run_time LIMIT 100",
+        "ix_t_applied_schedules_pending"),
+    "due clock tasks": (
+        "SELECT user_id, run_date, run_type FROM t_clock_schedules "
+        "WHERE active = true AND applied = 'pending' AND run_time <= now() "
+        "ORDER BY run_time FOR UPDATE SKIP LOCKED",
+        "ix_t_clock_schedules_pending"),
+    "expired clock leases": (
+        "SELECT user_id FROM t_clock_schedules "
+        "WHERE applied = 'running' AND lease_expires < now()",
+        "ix_t_clock_schedules_running"),
+    "expired apply leases": (
+        "SELECT user_id FROM t_applied_schedules "
+        "WHERE applied = 'running' AND lease_expires < now()",
+        "ix_t_applied_schedules_running"),
+    "page of user tasks": (
+        "SELECT run_date, run_type FROM t_clock_schedules WHERE user_id = 1 "
+        "AND run_date >= '2024-01-01' ORDER BY run_date, run_type LIMIT 100",
+        "t_clock_schedules_pkey"),
+    "user by email": (
+        "SELECT * FROM m_users WHERE email = 'user@example.com'",
+        "m_users_email_key"),
+    "work type by name": (
+        "SELECT * FROM m_work_types WHERE type_name = 'type'",
+        "m_work_types_type_name_key"),
+    "users of a work type": (
+        "SELECT user_id FROM t_basic_types WHERE clockin_type_name = 'type'",
+        "ix_t_basic_types_clockin_type_name"),
+}
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    sql: str
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.sql.encode()).hexdigest()
+
+
+def load_migrations(path: pathlib.Path = MIGRATIONS_DIR) -> List[Migration]:
+    migrations = []
+    for file in sorted(path.glob("*.sql")):
+        version, _, name = file.stem.partition("_")
+        migrations.append(Migration(
+            version=int(version), name=name, sql=file.read_text()))
+
+    versions = [x.version for x in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicated migration versions in {path}")
+    return sorted(migrations, key=lambda x: x.version)
+
+
+async def apply_migrations(
+        conn: asyncpg.Connection,
+        logger: logging.Logger,
+        migrations: List[Migration] = None) -> List[Migration]:
+    """Apply migrations not recorded in schema_migrations yet
+
+    Returns
+    -------
+    List[Migration]
+        applied migrations
+    """
+    migrations = load_migrations() if migrations is None else migrations
+    await conn.execute("SELECT pg_advisory_lock($1)", LOCK_KEY)
+    try:
+        await conn.execute(CREATE_VERSIONS)
+        done = {
+            x["version"]: x["checksum"] for x in await conn.fetch(
+                "SELECT version, checksum FROM schema_migrations")}
+
+        applied = []
+        for x in migrations:
+            if x.version in done:
+                if done[x.version] != x.checksum:
+                    logger.warning(
+                        f"Migration {x.version} ({x.name}) was changed "
+                        "after it was applied")
+                continue
+            async with conn.transaction():
+                await conn.execute(x.sql)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, name, checksum) "
+                    "VALUES ($1, $2, $3)", x.version, x.name, x.checksum)
+            logger.info(f"Applied migration {x.version} ({x.name})")
+            applied.append(x)
+        return applied
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", LOCK_KEY)
+
+
+async def migrate(logger: logging.Logger) -> List[Migration]:
+    conn = await asyncpg.connect(PG_DSN)
+    try:
+        return await apply_migrations(conn, logger)
+    finally:
+        await conn.close()
+
+
+async def check_hot_queries(conn: asyncpg.Connection) -> Dict[str, bool]:
+    """EXPLAIN the hot queries and tell if they use their index
+
+    Sequential scans are disabled while explaining, since small tables
+    are scanned anyway. A False means the index is missing or unusable.
+    """
+    res = {}
+    async with conn.transaction():
+        await conn.execute("SET LOCAL enable_seqscan = off")
+        for name, (sql, index) in HOT_QUERIES.items():
+            plan = "\n".join(
+                x[0] for x in await conn.fetch(f"EXPLAIN {sql}"))
+            res[name] = index in plan
+    return res
+
+
+async def _main(check: bool) -> int:
+    logger = logging.getLogger("migrate")
+    conn = await asyncpg.connect(PG_DSN)
+    try:
+        await apply_migrations(conn, logger)
+        if not check:
+            return 0
+        res = await check_hot_queries(conn)
+    finally:
+        await conn.close()
+
+    for name, ok in res.items():
+        print(f"{'ok' if ok else 'NO INDEX':<10}{name}")
+    return 0 if all(res.values()) else 1
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m database.migrate")
+    parser.add_argument(
+        "--check", action="store_true",
+        help="check the hot queries use their indexes")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    return asyncio.run(_main(args.check))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
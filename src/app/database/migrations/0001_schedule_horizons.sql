@@ -0,0 +1,7 @@
+-- schedules of each user are built for days before built_until
+CREATE TABLE IF NOT EXISTS t_schedule_horizons (
+  user_id integer PRIMARY KEY,
+  built_until timestamp NOT NULL,
+  updated_at timestamp,
+  FOREIGN KEY (user_id) references m_users(user_id) ON DELETE cascade
+);
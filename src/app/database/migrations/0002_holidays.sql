@@ -0,0 +1,4 @@
+-- holidays used by BUILD_MODE = "sql", synced from the holiday calendar
+CREATE TABLE IF NOT EXISTS m_holidays (
+  holiday date PRIMARY KEY
+);
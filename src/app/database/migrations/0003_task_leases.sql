@@ -0,0 +1,5 @@
+-- runner holding a task while it is running, see core.lease
+ALTER TABLE t_clock_schedules ADD COLUMN IF NOT EXISTS lease_owner text;
+ALTER TABLE t_clock_schedules ADD COLUMN IF NOT EXISTS lease_expires timestamp;
+ALTER TABLE t_applied_schedules ADD COLUMN IF NOT EXISTS lease_owner text;
+ALTER TABLE t_applied_schedules ADD COLUMN IF NOT EXISTS lease_expires timestamp;
@@ -0,0 +1,28 @@
+-- upcoming and due tasks, see core.task.get_upcoming_tasks and core.lease.claim
+CREATE INDEX IF NOT EXISTS ix_t_clock_schedules_pending
+  ON t_clock_schedules (run_time) WHERE active AND applied = 'pending';
+CREATE INDEX IF NOT EXISTS ix_t_applied_schedules_pending
+  ON t_applied_schedules (run_time) WHERE active AND applied = 'pending';
+
+-- expired leases, see core.lease.reclaim_expired
+CREATE INDEX IF NOT EXISTS ix_t_clock_schedules_running
+  ON t_clock_schedules (lease_expires) WHERE applied = 'running';
+CREATE INDEX IF NOT EXISTS ix_t_applied_schedules_running
+  ON t_applied_schedules (lease_expires) WHERE applied = 'running';
+
+-- same names as the UNIQUE constraints of init.sql, so databases
+-- created from it keep a single index
+CREATE UNIQUE INDEX IF NOT EXISTS m_users_email_key
+  ON m_users (email);
+CREATE UNIQUE INDEX IF NOT EXISTS m_work_types_type_name_key
+  ON m_work_types (type_name);
+CREATE UNIQUE INDEX IF NOT EXISTS m_work_schedule_types_type_name_key
+  ON m_work_schedule_types (type_name);
+
+-- type name joins and cascades from the type tables
+CREATE INDEX IF NOT EXISTS ix_t_basic_types_clockin_type_name
+  ON t_basic_types (clockin_type_name);
+CREATE INDEX IF NOT EXISTS ix_t_basic_types_clockout_type_name
+  ON t_basic_types (clockout_type_name);
+CREATE INDEX IF NOT EXISTS ix_t_basic_types_schedule_type_name
+  ON t_basic_types (schedule_type_name);
@@ -0,0 +1,15 @@
+-- ids of new master rows in the server side merge of
+-- database.db_utils.merge_table, named "<table>_<column>_seq"
+CREATE SEQUENCE IF NOT EXISTS m_users_user_id_seq OWNED BY m_users.user_id;
+SELECT setval('m_users_user_id_seq',
+              COALESCE((SELECT max(user_id) FROM m_users), 0) + 1, false);
+
+CREATE SEQUENCE IF NOT EXISTS m_work_types_id_seq OWNED BY m_work_types.id;
+SELECT setval('m_work_types_id_seq',
+              COALESCE((SELECT max(id) FROM m_work_types), 0) + 1, false);
+
+CREATE SEQUENCE IF NOT EXISTS m_work_schedule_types_id_seq
+  OWNED BY m_work_schedule_types.id;
+SELECT setval('m_work_schedule_types_id_seq',
+              COALESCE((SELECT max(id) FROM m_work_schedule_types), 0) + 1,
+              false);
@@ -0,0 +1,76 @@
+-- versions bumped by triggers on every write, read by database.versions
+-- to answer conditional GETs of the read api without loading the rows.
+-- master tables are versioned as a whole, tasks per user
+CREATE TABLE IF NOT EXISTS t_table_versions (
+  table_name text PRIMARY KEY,
+  version bigint NOT NULL DEFAULT 0,
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- no foreign key: the tasks of a deleted user are deleted by cascade,
+-- which bumps the version of a user_id no longer in m_users
+CREATE TABLE IF NOT EXISTS t_user_task_versions (
+  user_id integer PRIMARY KEY,
+  version bigint NOT NULL DEFAULT 0,
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO t_table_versions AS v (table_name, version, updated_at)
+  VALUES (TG_TABLE_NAME, 1, now())
+  ON CONFLICT (table_name) DO UPDATE
+  SET version = v.version + 1, updated_at = EXCLUDED.updated_at;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- statement level with transition tables, so a bulk write bumps each
+-- user once. users are locked in order to avoid deadlocks
+CREATE OR REPLACE FUNCTION bump_user_task_version() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO t_user_task_versions AS v (user_id, version, updated_at)
+  SELECT DISTINCT user_id, 1, now() FROM changed_rows ORDER BY user_id
+  ON CONFLICT (user_id) DO UPDATE
+  SET version = v.version + 1, updated_at = EXCLUDED.updated_at;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER m_users_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON m_users
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+CREATE OR REPLACE TRIGGER m_work_types_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON m_work_types
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+CREATE OR REPLACE TRIGGER m_work_schedule_types_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON m_work_schedule_types
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+CREATE OR REPLACE TRIGGER t_basic_types_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON t_basic_types
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+-- a trigger with transition tables takes a single event
+CREATE OR REPLACE TRIGGER t_clock_schedules_version_ins
+  AFTER INSERT ON t_clock_schedules REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_user_task_version();
+CREATE OR REPLACE TRIGGER t_clock_schedules_version_upd
+  AFTER UPDATE ON t_clock_schedules REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_user_task_version();
+CREATE OR REPLACE TRIGGER t_clock_schedules_version_del
+  AFTER DELETE ON t_clock_schedules REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_user_task_version();
+CREATE OR REPLACE TRIGGER t_applied_schedules_version_ins
+  AFTER INSERT ON t_applied_schedules REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_user_task_version();
+CREATE OR REPLACE TRIGGER t_applied_schedules_version_upd
+  AFTER UPDATE ON t_applied_schedules REFERENCING NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_user_task_version();
+CREATE OR REPLACE TRIGGER t_applied_schedules_version_del
+  AFTER DELETE ON t_applied_schedules REFERENCING OLD TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_user_task_version();
+
+INSERT INTO t_table_versions (table_name)
+VALUES ('m_users'), ('m_work_types'), ('m_work_schedule_types'),
+       ('t_basic_types')
+ON CONFLICT DO NOTHING;
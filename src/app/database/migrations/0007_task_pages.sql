@@ -0,0 +1,6 @@
+-- pages of the tasks of a user in (run_date, run_type) order,
+-- see core.task.get_tasks_page
+CREATE INDEX IF NOT EXISTS ix_t_clock_schedules_user_run_date
+  ON t_clock_schedules (user_id, run_date, run_type);
+CREATE INDEX IF NOT EXISTS ix_t_applied_schedules_user_run_date
+  ON t_applied_schedules (user_id, run_date, run_type);
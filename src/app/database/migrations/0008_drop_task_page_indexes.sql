@@ -0,0 +1,5 @@
+-- the primary keys already serve the pages of 0007: (user_id, run_date,
+-- run_type) of t_clock_schedules is its primary key, and run_date is
+-- unique per user in t_applied_schedules
+DROP INDEX IF EXISTS ix_t_clock_schedules_user_run_date;
+DROP INDEX IF EXISTS ix_t_applied_schedules_user_run_date;
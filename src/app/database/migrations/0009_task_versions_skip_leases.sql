@@ -0,0 +1,35 @@
+-- renewing a lease changes nothing the read api returns, so updates of
+-- the tasks bump only the users with a row changed outside the lease
+-- columns. UPDATE OF would do, but postgres takes no column list on a
+-- trigger with transition tables, so the old and new rows are compared
+CREATE OR REPLACE FUNCTION bump_user_task_version_on_update()
+RETURNS trigger AS $$
+BEGIN
+  INSERT INTO t_user_task_versions AS v (user_id, version, updated_at)
+  SELECT DISTINCT user_id, 1, now() FROM (
+    (SELECT user_id, to_jsonb(n) - 'lease_owner' - 'lease_expires' AS r
+     FROM changed_rows n
+     EXCEPT
+     SELECT user_id, to_jsonb(o) - 'lease_owner' - 'lease_expires'
+     FROM old_rows o)
+    UNION
+    (SELECT user_id, to_jsonb(o) - 'lease_owner' - 'lease_expires'
+     FROM old_rows o
+     EXCEPT
+     SELECT user_id, to_jsonb(n) - 'lease_owner' - 'lease_expires'
+     FROM changed_rows n)
+  ) AS changed ORDER BY user_id
+  ON CONFLICT (user_id) DO UPDATE
+  SET version = v.version + 1, updated_at = EXCLUDED.updated_at;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER t_clock_schedules_version_upd
+  AFTER UPDATE ON t_clock_schedules
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_user_task_version_on_update();
+CREATE OR REPLACE TRIGGER t_applied_schedules_version_upd
+  AFTER UPDATE ON t_applied_schedules
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS changed_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_user_task_version_on_update();
@@ -6,8 +6,8 @@ from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.schema import Table
 from sqlalchemy import MetaData
 from sqlalchemy import ForeignKey
-from sqlalchemy import Table, Column, Integer, String
-from sqlalchemy import Enum, Time, Boolean, DateTime
+from sqlalchemy import Table, Column, Integer, BigInteger, String
+from sqlalchemy import Enum, Time, Boolean, DateTime, Date
 
 
 class ConfigModel(BaseModel):
@@ -43,6 +43,11 @@ class Base(DeclarativeBase):
 metadata = MetaData()
 
 
+# columns of t_clock_schedules and t_applied_schedules
+# written by core.lease only
+LEASE_COLUMNS = ["lease_owner", "lease_expires"]
+
+
 class ENUM_RUN_TYPE_NAME(enum.Enum):
     cin = "出勤"
     cout = "退勤"
@@ -86,6 +91,9 @@ t_clock_schedules = Table(
     Column('run_time', DateTime),
     Column('applied', Enum(ENUM_TASK_STATUS), default=ENUM_TASK_STATUS.pending),
     Column('active', Boolean, default=True),
+    # runner holding the row while it is running, see core.lease
+    Column('lease_owner', String),
+    Column('lease_expires', DateTime),
 )
 
 
@@ -151,4 +159,43 @@ t_applied_schedules = Table(
     Column('apply_date', DateTime, nullable=False),
     Column('applied', Enum(ENUM_TASK_STATUS), default=ENUM_TASK_STATUS.pending),
     Column('active', Boolean, default=True),
+    # runner holding the row while it is running, see core.lease
+    Column('lease_owner', String),
+    Column('lease_expires', DateTime),
+)
+
+
+# how far schedules of each user are built, see core.task.build_tasks
+t_schedule_horizons = Table(
+    "t_schedule_horizons", metadata,
+    Column('user_id', Integer,
+           ForeignKey("m_users.user_id", ondelete="CASCADE"),
+           primary_key=True),
+    # days before this date are built
+    Column('built_until', DateTime, nullable=False),
+    Column('updated_at', DateTime),
+)
+
+
+# holidays used by BUILD_MODE = "sql", synced from core.holiday
+m_holidays = Table(
+    "m_holidays", metadata,
+    Column('holiday', Date, primary_key=True),
+)
+
+
+# bumped by triggers, see migrations/0006_table_versions.sql
+t_table_versions = Table(
+    "t_table_versions", metadata,
+    Column('table_name', String, primary_key=True),
+    Column('version', BigInteger, nullable=False),
+    Column('updated_at', DateTime(timezone=True), nullable=False),
+)
+
+
+t_user_task_versions = Table(
+    "t_user_task_versions", metadata,
+    Column('user_id', Integer, primary_key=True),
+    Column('version', BigInteger, nullable=False),
+    Column('updated_at', DateTime(timezone=True), nullable=False),
 )
@@ -1,3 +1,4 @@
+from typing import Optional
 from enum import Enum
 import datetime
 
@@ -33,7 +34,7 @@ class M_USERS(BaseModel):
     user_id: int
     email: str
     password: str
-    memo: str
+    memo: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -61,7 +62,7 @@ class T_CLOCK_SCHEDULES(BaseModel):
 class M_WORK_SCHEDULE_TYPES(BaseModel):
     id: int
     type_name: str
-    memo: str
+    memo: Optional[str] = None
     run_time: datetime.time
     telework: bool
     clock_type: str
@@ -69,7 +70,7 @@ class M_WORK_SCHEDULE_TYPES(BaseModel):
     clockout: datetime.time
     breakin: datetime.time
     breakout: datetime.time
-    msg: str
+    msg: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -0,0 +1,117 @@
+"""Versions of the read api responses
+
+Triggers bump t_table_versions on every write of a master table and
+t_user_task_versions on every write of the tasks of a user but lease
+renewals, see migrations/0006_table_versions.sql and
+0009_task_versions_skip_leases.sql. A response is identified by the
+versions it was built from, so a conditional GET is answered with one
+indexed lookup, before any row is read.
+"""
+from typing import Dict, List, Optional
+import datetime
+import hashlib
+import json
+from dataclasses import dataclass
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response
+from sqlalchemy import Table, String, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import transaction
+
+
+# "tasks" is the version of the tasks of the user of `email`, if any
+VERSIONS_SQL = """
+SELECT table_name AS name, version, updated_at
+FROM t_table_versions
+WHERE table_name = ANY(:tables)
+UNION ALL
+SELECT 'tasks', v.version, v.updated_at
+FROM m_users u
+JOIN t_user_task_versions v ON v.user_id = u.user_id
+WHERE u.email = :email
+"""
+
+
+@dataclass
+class Version:
+    # name: version
+    parts: Dict[str, int]
+    last_modified: Optional[datetime.datetime] = None
+
+    def etag(self, variant: str = "") -> str:
+        """Weak ETag of a response built from these versions.
+        `variant` tells apart responses of different parameters.
+        """
+        key = json.dumps([sorted(self.parts.items()), variant])
+        return f'W/"{hashlib.sha1(key.encode()).hexdigest()[:20]}"'
+
+    def headers(self, variant: str = "") -> Dict[str, str]:
+        headers = {"ETag": self.etag(variant), "Cache-Control": "no-cache"}
+        if self.last_modified is not None:
+            headers["Last-Modified"] = format_datetime(
+                self.last_modified.astimezone(datetime.timezone.utc),
+                usegmt=True)
+        return headers
+
+    def matches(self, request: Request, variant: str = "") -> bool:
+        """Tell if the client already has this version"""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [x.strip() for x in if_none_match.split(",")]
+            return ("*" in tags) or (self.etag(variant) in tags)
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if (if_modified_since is None) or (self.last_modified is None):
+            return False
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        # the header has a precision of seconds
+        return self.last_modified.replace(microsecond=0) <= since
+
+
+async def get_version(
+        session: AsyncSession,
+        tables: List[Table],
+        email: str = None) -> Version:
+    """Versions of `tables`, with the tasks of the user of `email`"""
+    stmt = text(VERSIONS_SQL).bindparams(
+        bindparam("tables", type_=ARRAY(String)),
+        bindparam("email", type_=String))
+    async with transaction(session):
+        res = await session.execute(
+            stmt, {"tables": [x.name for x in tables], "email": email})
+        res = res.all()
+
+    parts = {x.name: x.version for x in res}
+    if email is not None:
+        parts.setdefault("tasks", 0)
+    modified = [x.updated_at for x in res if x.updated_at is not None]
+    return Version(parts=parts,
+                   last_modified=max(modified) if modified else None)
+
+
+async def check_not_modified(
+        request: Request,
+        response: Response,
+        session: AsyncSession,
+        tables: List[Table],
+        email: str = None) -> Optional[Response]:
+    """Set the version headers of `response`.
+
+    Return a 304 response to send instead, if the client is up to date.
+    Responses of different query parameters have different ETags.
+    """
+    version = await get_version(session, tables, email=email)
+    variant = str(request.url.query)
+    headers = version.headers(variant)
+    response.headers.update(headers)
+    if version.matches(request, variant):
+        return Response(status_code=304, headers=headers)
+    return None
@@ -1,6 +1,7 @@
 from distutils.util import strtobool
 from typing import List, Dict, Literal
 import json
+import os
 import datetime
 from contextlib import asynccontextmanager
 
@@ -8,21 +9,32 @@ import pandas as pd
 import numpy as np
 
 from fastapi import FastAPI
-from fastapi import Request
+from fastapi import Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import delete
-from fastapi import Depends
+from fastapi import Depends, Query
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
 from fastapi import HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from custom_logger import set_logger
 # from model import ConfigModel
-from database import model, db_utils
-from database.database import get_session
+from database import model, db_utils, cache, versions
+from database.database import (
+    async_session,
+    get_pool_stats,
+    get_session,
+    transaction,
+    unit_of_work,
+)
+from database.migrate import migrate
 from core import task
+from core.holiday import get_calendar, background_holiday_refresher
+from core.pool import get_pool
+from core.driver_pool import get_driver_pool
+from core.session_store import get_session_store
 
 
 # CORS config
@@ -32,12 +44,17 @@ middleware = [
         allow_origins=['*'],
         allow_credentials=True,
         allow_methods=['*'],
-        allow_headers=['*']
+        allow_headers=['*'],
+        expose_headers=['ETag', 'Last-Modified', 'X-Next-Cursor'],
     )
 ]
 
 logger = set_logger(__name__, fname=None)
 
+# page size of /api/tasks, and of the reads behind its full list
+TASKS_PAGE_LIMIT = 1000
+TASKS_PAGE_LIMIT_MAX = 10000
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -53,6 +70,17 @@ app = FastAPI(middleware=middleware)
 @app.on_event("startup")
 async def startup_event():
     import asyncio
+    # bring the schema of existing databases up to date
+    await migrate(logger)
+
+    # cache master tables, invalidated by the other workers on change
+    master_cache = cache.set_master_cache(cache.MasterCache())
+    asyncio.create_task(master_cache.listen(logger))
+
+    # load holidays from local cache before any task is built
+    get_calendar()
+    asyncio.create_task(background_holiday_refresher(logger))
+
     # update schedules and init runners
     asyncio.create_task(task.background_runner(logger))
     asyncio.create_task(task.background_updater(logger))
@@ -71,6 +99,8 @@ def index(request: Request):
 
 @app.get("/api/users")
 async def get_users(
+        request: Request,
+        response: Response,
         brief: str = "False",
         session: AsyncSession = Depends(get_session)):
     """_summary_
@@ -93,7 +123,12 @@ async def get_users(
     _type_
         _description_
     """
-    m_users = await db_utils.get_rows(
+    not_modified = await versions.check_not_modified(
+        request, response, session, [model.m_users])
+    if not_modified is not None:
+        return not_modified
+
+    m_users = await cache.get_master_rows(
         session=session, table=model.m_users, logger=logger)
     if m_users.empty:
         logger.info("Empty m_users")
@@ -110,31 +145,33 @@ async def get_users(
 async def insert_user(
         users: List[Dict],
         session: AsyncSession = Depends(get_session)):
-    df = pd.DataFrame(users)
-    upserted_df: pd.DataFrame = await db_utils.update_table(
-        df=df,
-        session=session,
-        table=model.m_users,
-        unique_keys="email",
-        set_increment="user_id",
-        logger=logger,
-    )
+    async with unit_of_work(session):
+        df = pd.DataFrame(users)
+        upserted_df: pd.DataFrame = await db_utils.update_table(
+            df=df,
+            session=session,
+            table=model.m_users,
+            unique_keys="email",
+            set_increment="user_id",
+            logger=logger,
+        )
+        await cache.notify_master_changed(session, model.m_users)
 
-    # insert users to t_basic_types
-    keys = [x.name for x in model.t_basic_types.c]
-    t_basic = await db_utils.get_rows(
-        session=session, table=model.t_basic_types, logger=logger)
-    upserted_df = pd.merge(upserted_df, t_basic, on="user_id",
-                           suffixes=("_drop", ""), how="left")
-
-    await db_utils.update_table(
-        df=upserted_df[keys],
-        session=session,
-        table=model.t_basic_types,
-        unique_keys="user_id",
-        logger=logger,
-    )
-    return "OK"
+        # insert users to t_basic_types
+        keys = [x.name for x in model.t_basic_types.c]
+        t_basic = await db_utils.get_rows(
+            session=session, table=model.t_basic_types, logger=logger)
+        upserted_df = pd.merge(upserted_df, t_basic, on="user_id",
+                               suffixes=("_drop", ""), how="left")
+
+        await db_utils.update_table(
+            df=upserted_df[keys],
+            session=session,
+            table=model.t_basic_types,
+            unique_keys="user_id",
+            logger=logger,
+        )
+        return "OK"
 
 
 @app.get("/api/users/delete")
@@ -144,21 +181,33 @@ async def delete_user(
         email: str,
         password: str,
         session: AsyncSession = Depends(get_session)):
-    df = pd.DataFrame({"user_id": [uid], "name": [name],
-                       "email": [email], "password": [password]})
-    await db_utils.delete_row(
-        session=session, table=model.m_users, df=df, logger=logger
-    )
-    return "OK"
+    async with unit_of_work(session):
+        df = pd.DataFrame({"user_id": [uid], "name": [name],
+                           "email": [email], "password": [password]})
+        await db_utils.delete_row(
+            session=session, table=model.m_users, df=df, logger=logger
+        )
+        await cache.notify_master_changed(session, model.m_users)
+        await task.notify_schedules_changed(session)
+        return "OK"
 
 
 # work types
 @app.get("/api/selectTypes")
-async def get_all_types(session: AsyncSession = Depends(get_session)):
-    wtypes: pd.DataFrame = await db_utils.get_rows(
+async def get_all_types(
+        request: Request,
+        response: Response,
+        session: AsyncSession = Depends(get_session)):
+    not_modified = await versions.check_not_modified(
+        request, response, session,
+        [model.m_work_types, model.m_work_schedule_types])
+    if not_modified is not None:
+        return not_modified
+
+    wtypes: pd.DataFrame = await cache.get_master_rows(
         session=session, table=model.m_work_types, logger=logger)
 
-    stypes: pd.DataFrame = await db_utils.get_rows(
+    stypes: pd.DataFrame = await cache.get_master_rows(
         session=session, table=model.m_work_schedule_types, logger=logger)
     
     return list(set((wtypes["type_name"]).to_list()) |
@@ -168,10 +217,17 @@ async def get_all_types(session: AsyncSession = Depends(get_session)):
 # work types
 @app.get("/api/worktypes")
 async def get_work_types(
+        request: Request,
+        response: Response,
         brief: str = "false",
         type: Literal["in", "out"] = "in",
         session: AsyncSession = Depends(get_session)):
-    types: pd.DataFrame = await db_utils.get_rows(
+    not_modified = await versions.check_not_modified(
+        request, response, session, [model.m_work_types])
+    if not_modified is not None:
+        return not_modified
+
+    types: pd.DataFrame = await cache.get_master_rows(
         session=session, table=model.m_work_types, logger=logger)
 
     if strtobool(brief):
@@ -193,24 +249,33 @@ async def get_work_types(
 async def add_work_types(
         work_types: List[Dict],
         session: AsyncSession = Depends(get_session)):
-    df = pd.DataFrame(work_types)
-    await db_utils.update_table(
-        df=df,
-        session=session,
-        table=model.m_work_types,
-        unique_keys=["run_type", "run_time", "gps"],
-        set_increment="id",
-        logger=logger,
-    )
-    return "OK"
+    async with unit_of_work(session):
+        df = pd.DataFrame(work_types)
+        await db_utils.update_table(
+            df=df,
+            session=session,
+            table=model.m_work_types,
+            unique_keys=["run_type", "run_time", "gps"],
+            set_increment="id",
+            logger=logger,
+        )
+        await cache.notify_master_changed(session, model.m_work_types)
+        return "OK"
 
 
 # work_schedule_types
 @app.get("/api/stypes")
 async def get_work_stypes(
+        request: Request,
+        response: Response,
         brief: str = "false",
         session: AsyncSession = Depends(get_session)):
-    types: pd.DataFrame = await db_utils.get_rows(
+    not_modified = await versions.check_not_modified(
+        request, response, session, [model.m_work_schedule_types])
+    if not_modified is not None:
+        return not_modified
+
+    types: pd.DataFrame = await cache.get_master_rows(
         session=session, table=model.m_work_schedule_types, logger=logger)
     if strtobool(brief):
         return list(types["type_name"].unique())
@@ -222,16 +287,39 @@ async def get_work_stypes(
 async def update_work_stypes(
         stypes: List[Dict],
         session: AsyncSession = Depends(get_session)):
-    df = pd.DataFrame(stypes)
-    await db_utils.update_table(
-        df=df,
-        session=session,
-        table=model.m_work_schedule_types,
-        unique_keys=["type_name"],
-        set_increment="id",
-        logger=logger,
-    )
-    return "OK"
+    async with unit_of_work(session):
+        df = pd.DataFrame(stypes)
+        await db_utils.update_table(
+            df=df,
+            session=session,
+            table=model.m_work_schedule_types,
+            unique_keys=["type_name"],
+            set_increment="id",
+            logger=logger,
+        )
+        await cache.notify_master_changed(session, model.m_work_schedule_types)
+        return "OK"
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Runtime stats of this worker process.
+    Pools are null in the worker which does not run tasks.
+    """
+    pool = get_pool()
+    driver_pool = get_driver_pool()
+    session_store = get_session_store()
+    master_cache = cache.get_master_cache()
+    return {
+        "pid": os.getpid(),
+        "clocker_pool": None if pool is None else pool.stats(),
+        "driver_pool": None if driver_pool is None else driver_pool.stats(),
+        "session_store": (
+            None if session_store is None else session_store.stats()),
+        "master_cache": (
+            None if master_cache is None else master_cache.stats()),
+        "db_pool": get_pool_stats(),
+    }
 
 
 @app.get("/api/run_types")
@@ -250,10 +338,9 @@ async def get_something(session: AsyncSession = Depends(get_session)):
         table.c.run_time == select(func.min(table.c.run_time)).scalar_subquery())
     logger.info(stmt)
 
-    async with session.begin():
+    async with transaction(session):
         res = await session.execute(stmt)
         res = res.all()
-        await session.commit()
     logger.info(res)
     from database import schemas
     res_t = schemas.T_CLOCK_SCHEDULES(**(dict(zip([x.name for x in table.c], res[0]))))
@@ -269,172 +356,172 @@ async def get_something(session: AsyncSession = Depends(get_session)):
 async def update_all_tasks(
         tasks: Dict,
         session: AsyncSession = Depends(get_session)):
+    async with unit_of_work(session):
+        email = tasks.pop("email")
+        tasks = tasks["tasks"]
+        assert (email is not None) and (tasks is not None)
+
+        # get user id
+        users: pd.DataFrame = await cache.get_master_rows(
+            session=session, table=model.m_users,
+            email=email, logger=logger)
+
+        if users.empty:
+            return []
+        uid = users["user_id"].values[0]
+
+        rename = {
+            "task_name": "run_type",
+            "task_type": "type_name",
+            "runtime": "run_time",
+            "actions": "active",
+            "status": "applied",
+        }
+        df = pd.DataFrame(json.loads(tasks))[list(rename.keys())].rename(columns=rename)
+        df["run_date"] = pd.to_datetime(pd.to_datetime(df["run_time"]).dt.date)
+
+        # update the part of t_clock_schedules
+        ctask_df = df[df["run_type"].isin([
+            model.ENUM_RUN_TYPE_NAME.cin.value,
+            model.ENUM_RUN_TYPE_NAME.cout.value,
+        ])].reset_index(drop=True)
+        # ctask_df["run_date"] = pd.to_datetime(ctask_df["run_time"]).dt.date()
+        ctask_df["user_id"] = uid
+
+        # merge work types id
+        ctypes: pd.DataFrame = await cache.get_master_rows(
+            session=session, table=model.m_work_types, logger=logger)
+        ctask_df = pd.merge(ctask_df, ctypes.add_prefix("work_type_"),
+                            left_on="type_name", right_on="work_type_type_name",
+                            how="left")
     
-    email = tasks.pop("email")
-    tasks = tasks["tasks"]
-    assert (email is not None) and (tasks is not None)
-
-    # get user id
-    users: pd.DataFrame = await db_utils.get_rows(
-        session=session, table=model.m_users,
-        email=email, logger=logger)
-
-    if users.empty:
-        return []
-    uid = users["user_id"].values[0]
-
-    rename = {
-        "task_name": "run_type",
-        "task_type": "type_name",
-        "runtime": "run_time",
-        "actions": "active",
-        "status": "applied",
-    }
-    df = pd.DataFrame(json.loads(tasks))[list(rename.keys())].rename(columns=rename)
-    df["run_date"] = pd.to_datetime(pd.to_datetime(df["run_time"]).dt.date)
-
-    # update the part of t_clock_schedules
-    ctask_df = df[df["run_type"].isin([
-        model.ENUM_RUN_TYPE_NAME.cin.value,
-        model.ENUM_RUN_TYPE_NAME.cout.value,
-    ])].reset_index(drop=True)
-    # ctask_df["run_date"] = pd.to_datetime(ctask_df["run_time"]).dt.date()
-    ctask_df["user_id"] = uid
-
-    # merge work types id
-    ctypes: pd.DataFrame = await db_utils.get_rows(
-        session=session, table=model.m_work_types, logger=logger)
-    ctask_df = pd.merge(ctask_df, ctypes.add_prefix("work_type_"),
-                        left_on="type_name", right_on="work_type_type_name",
-                        how="left")
-    
-    db_keys = db_utils.get_db_keys(model.t_clock_schedules)
-    pkeys = db_utils.get_db_keys(model.t_clock_schedules, primary=True)
-    subkeys = db_utils.get_db_sub_keys(model.t_clock_schedules)
-
-    ctask_df = ctask_df.reset_index(drop=True)
-
-    # getold table and overwrite run time when type is changed
-    old_ctasks: pd.DataFrame = await db_utils.get_rows(
-        session=session, table=model.t_clock_schedules,
-        logger=logger, user_id=uid)
-    # old_ctasks["run_type"] = old_ctasks["run_type"].apply(lambda x: x.value)
-    # old_ctasks["applied"] = old_ctasks["applied"].apply(lambda x: x.value)
-
-    ctask_df = pd.merge(ctask_df, old_ctasks,
-                        on=pkeys, how="left", suffixes=("", "_old"))
-
-    same_row = pd.Series(True, index=ctask_df.index)
-    for col in subkeys:
-        same_row = same_row & (ctask_df[col] == ctask_df[f"{col}_old"])
-    ctask_df = ctask_df.loc[~same_row].reset_index(drop=True)
-
-    if not ctask_df.empty:        
-        # renew run_time by changed run_type
-        ctask_df["run_time"] = pd.to_datetime(
-            ctask_df["run_date"].astype(str) + " " +
-            ctask_df["work_type_run_time"].astype(str))
-
-        # add random time diff
-        ctask_df["run_time"] = ctask_df["run_time"] + pd.to_timedelta(
-            np.random.randint(-300, 300, size=len(ctask_df)), unit="s")
+        pkeys = db_utils.get_db_keys(model.t_clock_schedules, primary=True)
+        subkeys = set(db_utils.get_db_sub_keys(model.t_clock_schedules)) - set(
+            model.LEASE_COLUMNS)
+
+        ctask_df = ctask_df.reset_index(drop=True)
+
+        # getold table and overwrite run time when type is changed
+        old_ctasks: pd.DataFrame = await db_utils.get_rows(
+            session=session, table=model.t_clock_schedules,
+            columns=task.get_built_columns(model.t_clock_schedules),
+            logger=logger, user_id=uid)
+        # old_ctasks["run_type"] = old_ctasks["run_type"].apply(lambda x: x.value)
+        # old_ctasks["applied"] = old_ctasks["applied"].apply(lambda x: x.value)
+
+        ctask_df = pd.merge(ctask_df, old_ctasks,
+                            on=pkeys, how="left", suffixes=("", "_old"))
+
+        same_row = pd.Series(True, index=ctask_df.index)
+        for col in subkeys:
+            same_row = same_row & (ctask_df[col] == ctask_df[f"{col}_old"])
+        ctask_df = ctask_df.loc[~same_row].reset_index(drop=True)
+
+        if not ctask_df.empty:        
+            # renew run_time by changed run_type
+            ctask_df["run_time"] = pd.to_datetime(
+                ctask_df["run_date"].astype(str) + " " +
+                ctask_df["work_type_run_time"].astype(str))
+
+            # add random time diff
+            ctask_df["run_time"] = ctask_df["run_time"] + pd.to_timedelta(
+                np.random.randint(-300, 300, size=len(ctask_df)), unit="s")
+
+            await db_utils.update_rows(
+                df=ctask_df,
+                session=session,
+                table=model.t_clock_schedules,
+                logger=logger,
+            )
+
+        # update the part of t_applied_schedules
+        stask_df = df[df["run_type"].isin([
+            model.ENUM_RUN_TYPE_NAME.schedule.value,
+        ])].reset_index(drop=True)
+        stask_df["user_id"] = uid
+        # stask_df["run_date"] = pd.to_datetime(stask_df["run_date"]).dt.date
+
+        # merge schedule types
+        stypes: pd.DataFrame = await cache.get_master_rows(
+            session=session, table=model.m_work_schedule_types, logger=logger)
+        stask_df = pd.merge(stask_df, stypes.add_prefix("schedule_type_"),
+                            left_on="type_name", right_on="schedule_type_type_name",
+                            how="left")
 
         await db_utils.update_rows(
-            df=ctask_df,
+            df=stask_df,
             session=session,
-            table=model.t_clock_schedules,
+            table=model.t_applied_schedules,
             logger=logger,
         )
-
-    # update the part of t_applied_schedules
-    stask_df = df[df["run_type"].isin([
-        model.ENUM_RUN_TYPE_NAME.schedule.value,
-    ])].reset_index(drop=True)
-    stask_df["user_id"] = uid
-    # stask_df["run_date"] = pd.to_datetime(stask_df["run_date"]).dt.date
-
-    # merge schedule types
-    stypes: pd.DataFrame = await db_utils.get_rows(
-        session=session, table=model.m_work_schedule_types, logger=logger)
-    stask_df = pd.merge(stask_df, stypes.add_prefix("schedule_type_"),
-                        left_on="type_name", right_on="schedule_type_type_name",
-                        how="left")
-
-    await db_utils.update_rows(
-        df=stask_df,
-        session=session,
-        table=model.t_applied_schedules,
-        logger=logger,
-    )
+        await task.notify_schedules_changed(session)
 
 @app.get("/api/tasks")
 async def get_all_tasks(
         email: str,
+        request: Request,
+        response: Response,
+        cursor: str = None,
+        limit: int = Query(None, ge=1, le=TASKS_PAGE_LIMIT_MAX),
+        date_from: datetime.date = Query(None, alias="from"),
+        date_to: datetime.date = Query(None, alias="to"),
+        status: List[model.ENUM_TASK_STATUS] = Query(None),
+        run_type: List[model.ENUM_RUN_TYPE_NAME] = Query(None),
+        stream: str = "false",
         session: AsyncSession = Depends(get_session)):
-    return await get_merged_tasks(email=email, session=session)
-
+    """Tasks of a user in (run_date, run_type) order
 
-async def get_merged_tasks(email: str, session: AsyncSession):
-
-    # get user id
-    users: pd.DataFrame = await db_utils.get_rows(
-        session=session, table=model.m_users,
-        email=email, logger=logger)
-
-    if users.empty:
-        return []
-    uid = users["user_id"].values[0]
-
-    # get planned clock tasks
-    clock_tasks: pd.DataFrame = await db_utils.get_rows(
-        session=session, table=model.t_clock_schedules,
-        logger=logger, user_id=uid)
-    clock_tasks = clock_tasks[clock_tasks["user_id"] == uid]
-    
-    # get planned apply tasks
-    apply_tasks: pd.DataFrame = await db_utils.get_rows(
-        session=session, table=model.t_applied_schedules,
-        logger=logger, user_id=uid)
-    apply_tasks = apply_tasks[apply_tasks["user_id"] == uid]
-
-    # return empty result if no tasks created yet
-    if clock_tasks.empty and apply_tasks.empty:
-        return []
-
-    # transfer id to name
-    tmp: pd.DataFrame = await db_utils.get_rows(
-        session=session, table=model.m_work_types, logger=logger)
-    clock_tasks = pd.merge(clock_tasks, tmp, left_on="work_type_id",
-                           right_on="id", how="left", suffixes=("", "_drop"))
-
-    # format date to response webapp
-    clock_tasks["apply_date"] = clock_tasks["run_time"].copy()
+    Without `limit` and `cursor` every task is returned, like the webapp
+    expects. Otherwise a page of `limit` (by default TASKS_PAGE_LIMIT)
+    is returned, with the cursor of the next page in the X-Next-Cursor
+    header. With `stream`, all pages from `cursor` are streamed as NDJSON.
+    """
+    # task names come from the type tables
+    not_modified = await versions.check_not_modified(
+        request, response, session,
+        [model.m_users, model.m_work_types, model.m_work_schedule_types],
+        email=email)
+    if not_modified is not None:
+        return not_modified
+
+    if cursor is not None:
+        try:
+            task.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    filters = dict(date_from=date_from, date_to=date_to,
+                   statuses=status, run_types=run_type)
+
+    if strtobool(stream):
+        return StreamingResponse(
+            stream_tasks(email, cursor, limit or TASKS_PAGE_LIMIT, filters),
+            media_type="application/x-ndjson",
+            headers=dict(response.headers))
+
+    if (limit is None) and (cursor is None):
+        return [x async for x in task.iter_tasks(
+            session, email, limit=TASKS_PAGE_LIMIT, **filters)]
+
+    tasks, next_cursor = await task.get_tasks_page(
+        session, email, limit=limit or TASKS_PAGE_LIMIT, cursor=cursor,
+        **filters)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return tasks
+
+
+async def stream_tasks(email: str, cursor: str, limit: int, filters: Dict):
+    # the request session is closed once the response starts
+    async with async_session() as session:
+        async for x in task.iter_tasks(
+                session, email, cursor=cursor, limit=limit, **filters):
+            yield json.dumps(x, ensure_ascii=False) + "\n"
 
-    tmp: pd.DataFrame = await db_utils.get_rows(
-        session=session, table=model.m_work_schedule_types, logger=logger)
-    apply_tasks = pd.merge(apply_tasks, tmp, left_on="schedule_type_id",
-                           right_on="id", how="left", suffixes=("", "_drop"))
-
-    # merge clock_tasks with details
-    rename = {
-        "run_type": "task_name",
-        "type_name": "task_type",
-        "run_time": "runtime",
-        "applied": "status",
-        "active": "actions",
-        "apply_date": "apply_date",
-    }
-    cols = list(set(rename.values()))
-    res = pd.concat([
-        clock_tasks.rename(columns=rename)[cols],
-        apply_tasks.rename(columns=rename)[cols],
-    ], axis=0).reset_index(drop=True)
 
-    # format date to response webapp
-    res["apply_date"] = pd.to_datetime(
-        res["apply_date"]).dt.strftime("%Y-%m-%d").fillna("")
-    res["runtime"] = pd.to_datetime(res["runtime"]).dt.strftime("%Y-%m-%d %H:%M:%S")
-    return res.to_dict('records')
+async def get_merged_tasks(email: str, session: AsyncSession):
+    return [x async for x in task.iter_tasks(
+        session, email, limit=TASKS_PAGE_LIMIT)]
 
 
 @app.get("/api/tasks/delete")
@@ -447,25 +534,34 @@ async def delete_old_tasks(
     async def delete_lt_now_rows(table, time_col: str):
         stmt = delete(table).where(
             table.c[time_col] < datetime.datetime.now())
-        async with session.begin():
+        async with transaction(session):
             await session.execute(stmt)
             logger.info(stmt)
-            await session.commit()
 
-    await delete_lt_now_rows(model.t_clock_schedules, "run_time")
-    await delete_lt_now_rows(model.t_applied_schedules, "run_time")
+    async with unit_of_work(session):
+        await delete_lt_now_rows(model.t_clock_schedules, "run_time")
+        await delete_lt_now_rows(model.t_applied_schedules, "run_time")
+        await task.notify_schedules_changed(session)
     return await get_merged_tasks(email=email, session=session)
 
 
 # work_schedule_types
 @app.get("/api/usersBasic")
-async def get_basic(session: AsyncSession = Depends(get_session)):
+async def get_basic(
+        request: Request,
+        response: Response,
+        session: AsyncSession = Depends(get_session)):
+    not_modified = await versions.check_not_modified(
+        request, response, session, [model.t_basic_types, model.m_users])
+    if not_modified is not None:
+        return not_modified
+
     types: pd.DataFrame = await db_utils.get_rows(
         session=session, table=model.t_basic_types, logger=logger)
     if types.empty:
         return []
     
-    users: pd.DataFrame = await db_utils.get_rows(
+    users: pd.DataFrame = await cache.get_master_rows(
         session=session, table=model.m_users, logger=logger)
     types = pd.merge(types, users, on="user_id", validate="1:1")
     return types[["email", "clockin_type_name",
@@ -476,24 +572,27 @@ async def get_basic(session: AsyncSession = Depends(get_session)):
 async def update_basic(
         types: List[Dict],
         session: AsyncSession = Depends(get_session)):
-    df = pd.DataFrame(types)
-
-    # merge user_id to email
-    users: pd.DataFrame = await db_utils.get_rows(
-        session=session, table=model.m_users, logger=logger)
-    df = pd.merge(df, users, how="left", on="email", validate="1:1")
-
-    # update t_basic_types
-    keys = [x.name for x in model.t_basic_types.c]
-    await db_utils.update_table(
-        df=df[keys],
-        session=session,
-        table=model.t_basic_types,
-        unique_keys=["user_id"],
-        set_increment=None,
-        logger=logger,
-    )
+    async with unit_of_work(session):
+        df = pd.DataFrame(types)
+
+        # merge user_id to email
+        users: pd.DataFrame = await cache.get_master_rows(
+            session=session, table=model.m_users, logger=logger)
+        df = pd.merge(df, users, how="left", on="email", validate="1:1")
+
+        # update t_basic_types
+        keys = [x.name for x in model.t_basic_types.c]
+        upserted_df = await db_utils.update_table(
+            df=df[keys],
+            session=session,
+            table=model.t_basic_types,
+            unique_keys=["user_id"],
+            set_increment=None,
+            logger=logger,
+        )
 
-    # update t_clock_schedules and t_applied_schedules
-    await task.build_tasks(session ,logger)
-    return "OK"
\ No newline at end of file
+        # rebuild t_clock_schedules and t_applied_schedules of changed users
+        await task.rebuild_tasks(
+            session, logger, user_ids=upserted_df["user_id"].tolist())
+        await task.notify_schedules_changed(session)
+        return "OK"
\ No newline at end of file
@@ -0,0 +1 @@
+from .site import StubSite
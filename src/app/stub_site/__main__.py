@@ -0,0 +1,25 @@
+"""Run the attendance site stand-in
+
+    python -m stub_site --port 8765
+
+Point clockers to it with ATTENDANCE_ORIGIN=http://127.0.0.1:8765
+"""
+import argparse
+import time
+
+from stub_site import StubSite
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=8765)
+parser.add_argument("--latency", type=float, default=0.)
+args = parser.parse_args()
+
+with StubSite(host=args.host, port=args.port, latency=args.latency) as site:
+    print(f"Serving stub attendance site on {site.origin}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,212 @@
+"""Local stand-in of the attendance site
+
+Serves recorded pages with the element ids, classes, xpaths and form
+fields `Clocker` and `HttpBackend` rely on, and records every submitted
+action, so clockers run without network and without a real account.
+"""
+from typing import Dict, List
+import json
+import pathlib
+import secrets
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from jinja2 import Environment, FileSystemLoader
+
+
+PATH_PAGES = pathlib.Path(__file__).parent / "pages"
+SESSION_COOKIE = "_stub_session"
+
+templates = Environment(loader=FileSystemLoader(PATH_PAGES), autoescape=True)
+
+
+class StubSite:
+    """Attendance site stand-in running in a background thread
+
+    Parameters
+    ----------
+    users : Dict[str, str], optional
+        email to password. Accept any credentials when None
+    latency : float, optional
+        seconds slept before every response, by default 0.
+    """
+
+    def __init__(
+            self,
+            host: str = "127.0.0.1",
+            port: int = 0,
+            users: Dict[str, str] = None,
+            latency: float = 0.) -> None:
+        self.users = users
+        self.latency = latency
+        self.csrf = secrets.token_hex(16)
+        # session id to email of logged in users
+        self.sessions: Dict[str, str] = {}
+        # session id to email entered on the first mfid page
+        self.pending: Dict[str, str] = {}
+        self.flashes: Dict[str, str] = {}
+        self.events: List[dict] = []
+        self._lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.site = self
+        self._thread: threading.Thread = None
+
+    @property
+    def origin(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubSite":
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "StubSite":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def record(self, action: str, email: str, fields: dict) -> None:
+        with self._lock:
+            self.events.append({
+                "action": action,
+                "email": email,
+                "fields": fields,
+                "at": time.time(),
+            })
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "StubAttendance/1.0"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    @property
+    def site(self) -> StubSite:
+        return self.server.site
+
+    # helpers
+    def _session_id(self) -> str:
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        if SESSION_COOKIE in cookie:
+            return cookie[SESSION_COOKIE].value
+        if not hasattr(self, "_new_sid"):
+            self._new_sid = secrets.token_hex(16)
+        return self._new_sid
+
+    def _send(self, status: int, body: bytes = b"",
+              content_type: str = "text/html; charset=utf-8",
+              headers: Dict[str, str] = {}) -> None:
+        if self.site.latency:
+            time.sleep(self.site.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if hasattr(self, "_new_sid"):
+            self.send_header(
+                "Set-Cookie", f"{SESSION_COOKIE}={self._new_sid}; Path=/")
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _render(self, name: str, **context) -> None:
+        sid = self._session_id()
+        flash = self.site.flashes.pop(sid, None)
+        body = templates.get_template(name).render(
+            csrf=self.site.csrf, flash=flash, **context)
+        self._send(200, body.encode("utf-8"))
+
+    def _redirect(self, location: str) -> None:
+        self._send(302, headers={"Location": location})
+
+    def _form(self) -> Dict[str, str]:
+        length = int(self.headers.get("Content-Length", 0))
+        data = parse_qs(
+            self.rfile.read(length).decode("utf-8"), keep_blank_values=True)
+        return {k: v[-1] for k, v in data.items()}
+
+    def _csrf_ok(self, form: Dict[str, str]) -> bool:
+        token = form.get("authenticity_token") or self.headers.get(
+            "X-CSRF-Token")
+        return token == self.site.csrf
+
+    # routes
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        sid = self._session_id()
+        email = self.site.sessions.get(sid)
+
+        if url.path == "/__stub__/events":
+            body = json.dumps(self.site.events, ensure_ascii=False)
+            return self._send(200, body.encode("utf-8"), "application/json")
+        if url.path == "/users/sign_in":
+            return self._render("login.html")
+        if url.path == "/mfid/sign_in":
+            return self._render("mfid_email.html")
+        if url.path == "/mfid/sign_in/password":
+            return self._render("mfid_password.html")
+
+        if url.path.startswith("/my_page") and email is None:
+            return self._redirect("/users/sign_in")
+        if url.path == "/my_page":
+            return self._render("my_page.html", email=email)
+        if url.path == "/my_page/workflow_requests/attendances/new":
+            return self._render(
+                "workflow_new.html", date=query.get("date", ""))
+        if url.path == "/my_page/workflow_requests":
+            n_requests = sum(
+                x["email"] == email and x["action"] == "apply_telework"
+                for x in self.site.events)
+            return self._render("workflow_index.html", n_requests=n_requests)
+        return self._send(404, b"not found")
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        form = self._form()
+        sid = self._session_id()
+        if not self._csrf_ok(form):
+            return self._send(422, b"invalid authenticity token")
+
+        if url.path == "/users/auth/mfid":
+            return self._redirect("/mfid/sign_in")
+        if url.path == "/mfid/sign_in":
+            self.site.pending[sid] = form.get("mfid_user[email]", "")
+            return self._redirect("/mfid/sign_in/password")
+        if url.path == "/mfid/sign_in/password":
+            email = self.site.pending.pop(sid, None)
+            users = self.site.users
+            if (email is None) or (
+                    users is not None and
+                    users.get(email) != form.get("mfid_user[password]")):
+                return self._render(
+                    "mfid_password.html", error="ログインに失敗しました")
+            self.site.sessions[sid] = email
+            return self._redirect("/my_page")
+
+        email = self.site.sessions.get(sid)
+        if email is None:
+            return self._redirect("/users/sign_in")
+        if url.path == "/my_page/web_time_recorder":
+            self.site.record(
+                form.get("web_time_recorder_form[event]"), email, form)
+            self.site.flashes[sid] = "打刻しました"
+            return self._redirect("/my_page")
+        if url.path == "/my_page/workflow_requests/attendances":
+            self.site.record("apply_telework", email, form)
+            self.site.flashes[sid] = "申請しました"
+            return self._redirect("/my_page/workflow_requests")
+        return self._send(404, b"not found")
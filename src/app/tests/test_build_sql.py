@@ -0,0 +1,91 @@
+import asyncio
+import datetime
+import logging
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from bench.build_tasks import PostgresDB, make_seed
+from core import holiday, task
+from core.config import settings
+
+
+JITTER = datetime.timedelta(seconds=300)
+QUERIES = {
+    "clock": (
+        "SELECT user_id, run_date, run_type::text AS run_type, "
+        "work_type_id, run_time, applied::text AS applied, active "
+        "FROM t_clock_schedules"),
+    "applied": (
+        "SELECT user_id, run_date, run_type::text AS run_type, "
+        "schedule_type_id, run_time, apply_date, "
+        "applied::text AS applied, active "
+        "FROM t_applied_schedules"),
+    "horizons": "SELECT user_id, built_until FROM t_schedule_horizons",
+}
+
+
+@pytest.fixture(autouse=True)
+def calendar(tmp_path, monkeypatch):
+    # bundled holidays, warning past them, so the test keeps running
+    calendar = holiday.HolidayCalendar(
+        source=holiday.PATH_FIXTURE_CSV,
+        cache_path=tmp_path / "holiday_cache.json",
+        stale_policy="warn").load()
+    monkeypatch.setattr(holiday, "_calendar", calendar)
+    return calendar
+
+
+async def build(dsn: str, seed) -> dict:
+    db = PostgresDB(dsn)
+    await db.setup(seed)
+    try:
+        async with db.session() as session:
+            await task.build_tasks(session, logging.getLogger("test"))
+        async with db.engine.connect() as conn:
+            return {
+                name: pd.DataFrame((await conn.execute(text(sql))).all())
+                for name, sql in QUERIES.items()}
+    finally:
+        await db.teardown()
+
+
+def test_modes_build_equivalent_rows(pg_dsn, monkeypatch):
+    seed = make_seed(50)
+    built = {}
+    for mode in ("pandas", "sql"):
+        monkeypatch.setattr(settings, "BUILD_MODE", mode)
+        built[mode] = asyncio.run(build(pg_dsn, seed))
+    pandas_rows, sql_rows = built["pandas"], built["sql"]
+
+    pd.testing.assert_frame_equal(
+        pandas_rows["horizons"].sort_values("user_id", ignore_index=True),
+        sql_rows["horizons"].sort_values("user_id", ignore_index=True))
+
+    # run times of today depend on jitter and the time of each build
+    today = pd.Timestamp.now().normalize()
+    for name, type_id in (("clock", "work_type_id"),
+                          ("applied", "schedule_type_id")):
+        x, y = pandas_rows[name], sql_rows[name]
+        assert len(x) and len(y)
+        keys = ["user_id", "run_date", "run_type"]
+        x, y = x[x["run_date"] > today], y[y["run_date"] > today]
+        merged = pd.merge(x, y, on=keys, how="outer", indicator=True,
+                          suffixes=("", "_sql"))
+        assert (merged["_merge"] == "both").all(), merged[
+            merged["_merge"] != "both"]
+
+        for col in set(x.columns) - set(keys) - {"run_time"}:
+            assert (merged[col] == merged[f"{col}_sql"]).all(), col
+        assert merged[type_id].notnull().all()
+        # equal up to the jitter of both modes
+        diff = (merged["run_time"] - merged["run_time_sql"]).abs()
+        assert (diff < 2 * JITTER).all()
+        for rows in (x, y):
+            assert (rows["run_date"] == rows["run_time"].dt.normalize()).all()
+            assert (rows["applied"] == "pending").all()
+
+    applied = sql_rows["applied"]
+    assert applied["apply_date"].notnull().all()
+    assert (applied["apply_date"] > applied["run_date"]).all()
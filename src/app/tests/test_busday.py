@@ -0,0 +1,81 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from core import busday
+from core.holiday import (
+    PATH_FIXTURE_CSV, HolidayCalendar, HolidayCalendarOutdated)
+
+from .test_holiday import UNREACHABLE
+
+
+def days(*dates) -> np.ndarray:
+    return np.array(dates, dtype="datetime64[D]")
+
+
+@pytest.fixture
+def calendar(tmp_path) -> HolidayCalendar:
+    """Bundled holidays, up to 2027-11-23"""
+    return HolidayCalendar(
+        source=UNREACHABLE,
+        cache_path=tmp_path / "holiday_cache.json",
+        seed_path=PATH_FIXTURE_CSV,
+        stale_policy="raise").load()
+
+
+def test_weekends_are_skipped(calendar):
+    # fri, sat, sun, mon
+    mask = busday.is_business_day(
+        ["2025-06-06", "2025-06-07", "2025-06-08", "2025-06-09"],
+        calendar=calendar)
+    assert mask.tolist() == [True, False, False, True]
+
+    assert busday.next_business_day(
+        "2025-06-06", calendar=calendar) == days("2025-06-09")
+    # rolled forward to monday, then shifted
+    assert busday.offset_business_days(
+        "2025-06-07", 1, calendar=calendar) == days("2025-06-10")
+
+
+def test_golden_week_is_skipped(calendar):
+    # 4/29 and 5/3-5/6 are holidays, 5/3 and 5/4 a weekend too
+    assert np.array_equal(
+        busday.business_days("2025-04-28", "2025-05-09", calendar=calendar),
+        days("2025-04-28", "2025-04-30", "2025-05-01", "2025-05-02",
+             "2025-05-07", "2025-05-08"))
+
+    dates = pd.Series(pd.to_datetime(["2025-04-28", "2025-05-02"]))
+    assert np.array_equal(
+        busday.next_business_day(dates, calendar=calendar),
+        days("2025-04-30", "2025-05-07"))
+    assert np.array_equal(
+        busday.offset_business_days(dates, 2, calendar=calendar),
+        days("2025-05-01", "2025-05-08"))
+    assert not busday.is_business_day(
+        "2025-05-06", calendar=calendar).any()
+
+
+def test_stale_calendar_raise(calendar):
+    assert busday.next_business_day(
+        "2027-11-19", calendar=calendar) == days("2027-11-22")
+
+    # past the newest bundled holiday
+    with pytest.raises(HolidayCalendarOutdated):
+        busday.next_business_day("2027-11-30", calendar=calendar)
+    with pytest.raises(HolidayCalendarOutdated):
+        busday.business_days("2027-11-29", "2027-12-06", calendar=calendar)
+    # weekends need no csv
+    assert busday.is_business_day(
+        ["2027-12-04", "2027-12-05"], calendar=calendar).tolist() == [
+            False, False]
+
+
+def test_stale_calendar_warn(calendar, caplog):
+    calendar.stale_policy = "warn"
+
+    with caplog.at_level(logging.WARNING, logger="core.holiday"):
+        res = busday.next_business_day("2027-11-30", calendar=calendar)
+    assert res == days("2027-12-01")
+    assert "outdated" in caplog.text
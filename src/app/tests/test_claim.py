@@ -0,0 +1,132 @@
+import datetime
+import logging
+
+from sqlalchemy import text
+
+from core import task
+from core.task import ApplyTask, ClockTask
+
+
+OWNER = "test:1"
+LOGGER = logging.getLogger("test")
+CLOCK_ROW = (
+    "INSERT INTO t_clock_schedules (user_id, work_type_id, run_type, "
+    "run_date, run_time, applied, active) VALUES (:user_id, :type_id, "
+    "'出勤', :run_date, :run_time, 'pending', true)")
+APPLIED_ROW = (
+    "INSERT INTO t_applied_schedules (user_id, schedule_type_id, run_type, "
+    "run_date, run_time, apply_date, applied, active) VALUES (:user_id, "
+    ":type_id, '実績スケジュール申請', :run_date, :run_time, :apply_date, "
+    "'pending', true)")
+
+
+def due(minutes: int = 1) -> dict:
+    run_time = datetime.datetime.now().replace(microsecond=0) - \
+        datetime.timedelta(minutes=minutes)
+    run_date = datetime.datetime.combine(run_time.date(), datetime.time())
+    return {"run_time": run_time, "run_date": run_date,
+            "apply_date": run_date + datetime.timedelta(days=1)}
+
+
+async def insert(db, sql: str, **params) -> None:
+    async with db.engine.begin() as conn:
+        await conn.execute(text(sql), params)
+
+
+async def statuses(db) -> list:
+    async with db.engine.connect() as conn:
+        res = await conn.execute(text(
+            "SELECT user_id, applied::text, lease_owner "
+            "FROM t_clock_schedules UNION ALL "
+            "SELECT user_id, applied::text, lease_owner "
+            "FROM t_applied_schedules ORDER BY 1, 2"))
+        return [tuple(x) for x in res.all()]
+
+
+def test_empty_tables(run):
+    async def scenario(db):
+        assert await task.fetch_tasks() == []
+        assert await task.get_upcoming_tasks(10) == []
+        assert await task.claim_due_tasks(OWNER, logger=LOGGER) == []
+
+    run(scenario)
+
+
+def test_ties_are_claimed_together(run):
+    async def scenario(db):
+        at = due()
+        await insert(db, CLOCK_ROW, user_id=1, type_id=1, **at)
+        await insert(db, CLOCK_ROW, user_id=2, type_id=2, **at)
+        await insert(db, APPLIED_ROW, user_id=1, type_id=1, **at)
+
+        assert len(await task.fetch_tasks()) == 3
+        assert len(await task.get_upcoming_tasks(10)) == 3
+
+        tasks = await task.claim_due_tasks(OWNER, logger=LOGGER)
+        assert [(type(x), x.user_id) for x in tasks] == [
+            (ApplyTask, 1), (ClockTask, 1), (ClockTask, 2)]
+        assert all(x.run_time == at["run_time"] for x in tasks)
+        assert tasks[1].sup_info.id == 1
+        assert tasks[0].user.email == "user1@example.com"
+        assert tasks[0].sup_info.msg is None
+        assert await statuses(db) == [
+            (1, "running", OWNER), (1, "running", OWNER),
+            (2, "running", OWNER)]
+
+        # claimed already
+        assert await task.claim_due_tasks(OWNER, logger=LOGGER) == []
+        assert await task.fetch_tasks() == []
+
+    run(scenario)
+
+
+def test_claim_limit_counts_users(run):
+    async def scenario(db):
+        await insert(db, CLOCK_ROW, user_id=2, type_id=1, **due(2))
+        await insert(db, APPLIED_ROW, user_id=2, type_id=1, **due(1))
+        await insert(db, CLOCK_ROW, user_id=1, type_id=1, **due(1))
+
+        tasks = await task.claim_due_tasks(
+            OWNER, logger=LOGGER, window=300, limit=1)
+        assert [x.user_id for x in tasks] == [2, 2]
+        assert await statuses(db) == [
+            (1, "pending", None), (2, "running", OWNER),
+            (2, "running", OWNER)]
+
+    run(scenario)
+
+
+def test_row_without_type_is_failed(run):
+    async def scenario(db):
+        at = due()
+        await insert(db, CLOCK_ROW, user_id=1, type_id=None, **at)
+        await insert(db, CLOCK_ROW, user_id=2, type_id=1, **at)
+
+        # scheduled, so claiming it is not left to other tasks
+        assert len(await task.get_upcoming_tasks(10)) == 2
+        tasks = await task.claim_due_tasks(OWNER, logger=LOGGER)
+        assert [x.user_id for x in tasks] == [2]
+        assert await statuses(db) == [
+            (1, "failed", None), (2, "running", OWNER)]
+
+    run(scenario)
+
+
+def test_window_claims_tasks_due_soon(run):
+    async def scenario(db):
+        await insert(db, CLOCK_ROW, user_id=1, type_id=1, **due(1))
+        # due in a minute and in 10 minutes
+        soon = due(-1)
+        await insert(db, APPLIED_ROW, user_id=1, type_id=1, **soon)
+        later = due(-10)
+        later["run_date"] += datetime.timedelta(days=1)
+        await insert(db, APPLIED_ROW, user_id=1, type_id=1, **later)
+
+        tasks = await task.claim_due_tasks(OWNER, logger=LOGGER, window=180)
+        assert [type(x) for x in tasks] == [ClockTask, ApplyTask]
+        assert tasks[1].run_time == soon["run_time"]
+        assert await statuses(db) == [
+            (1, "pending", None), (1, "running", OWNER),
+            (1, "running", OWNER)]
+
+    run(scenario)
@@ -0,0 +1,74 @@
+import itertools
+import json
+import logging
+
+from core.clocker import MY_PAGE_URL
+from core.driver_pool import DriverPool
+
+
+LOGGER = logging.getLogger("test")
+
+
+class Driver:
+    """WebDriver session recording the CDP commands of `send_cdp`"""
+    ids = itertools.count()
+
+    def __init__(self, logger=None) -> None:
+        self.session_id = f"session-{next(self.ids)}"
+        self.current_url = "about:blank"
+        self.cdp = []
+        self.command_executor = self
+        self._url = ""
+
+    def _request(self, method: str, url: str, body: str) -> dict:
+        self.cdp.append(json.loads(body)["cmd"])
+        return {"value": {}}
+
+    def get(self, url: str) -> None:
+        self.current_url = url
+
+    def quit(self) -> None:
+        pass
+
+
+def test_session_kept_for_the_same_user():
+    pool = DriverPool(size=2, factory=Driver)
+    driver = pool.checkout(LOGGER, user="a")
+    assert pool.session_user(driver) is None
+
+    pool.checkin(driver, LOGGER, user="a")
+    assert driver.cdp == []
+    assert pool.checkout(LOGGER, user="a") is driver
+    assert pool.session_user(driver) == "a"
+    assert driver.current_url == MY_PAGE_URL
+
+    # reset only once another user gets it
+    pool.checkin(driver, LOGGER, user="a")
+    assert pool.checkout(LOGGER, user="b") is driver
+    assert pool.session_user(driver) is None
+    assert "Network.clearBrowserCookies" in driver.cdp
+    assert driver.current_url == "about:blank"
+    assert pool.stats()["hits"] == 2
+
+
+def test_checkout_prefers_the_session_of_the_user():
+    pool = DriverPool(size=2, factory=Driver)
+    a = pool.checkout(LOGGER, user="a")
+    b = pool.checkout(LOGGER, user="b")
+    pool.checkin(a, LOGGER, user="a")
+    pool.checkin(b, LOGGER, user="b")
+
+    assert pool.checkout(LOGGER, user="a") is a
+    assert pool.checkout(LOGGER, user="a") is b
+    assert b.cdp != []
+
+
+def test_checkin_without_user_resets():
+    pool = DriverPool(size=2, factory=Driver)
+    driver = pool.checkout(LOGGER)
+    pool.checkin(driver, LOGGER)
+
+    assert "Network.clearBrowserCookies" in driver.cdp
+    assert driver.current_url == "about:blank"
+    assert pool.checkout(LOGGER, user="a") is driver
+    assert pool.session_user(driver) is None
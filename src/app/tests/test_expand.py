@@ -0,0 +1,94 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from core import busday, task
+from core.expand import expand_schedules, time_of_day_ns
+from core.holiday import PATH_FIXTURE_CSV, HolidayCalendar
+from database import model
+
+from .test_holiday import UNREACHABLE
+
+
+NOW = datetime.datetime(2025, 4, 30, 12, 0)
+COLUMNS = ["user_id", "id", "run_type"]
+
+
+class MinJitter:
+    """Shifts every run time by -jitter"""
+
+    def integers(self, low, high, size):
+        return np.full(size, low)
+
+
+@pytest.fixture
+def days(tmp_path) -> np.ndarray:
+    """Business days from 4/28 to 5/8 2025, Golden Week excluded"""
+    calendar = HolidayCalendar(
+        source=UNREACHABLE,
+        cache_path=tmp_path / "holiday_cache.json",
+        seed_path=PATH_FIXTURE_CSV).load()
+    return busday.business_days("2025-04-28", "2025-05-09", calendar=calendar)
+
+
+def work_types(times, build_from) -> pd.DataFrame:
+    """Clock rows of user 1, 2, ... as build_tasks gives them"""
+    return pd.DataFrame({
+        "user_id": np.arange(1, len(times) + 1),
+        "id": np.arange(1, len(times) + 1),
+        "run_type": [model.ENUM_RUN_TYPE_NAME.cin.value] * len(times),
+        "run_time": time_of_day_ns(times),
+        "build_from": pd.to_datetime(build_from),
+    })
+
+
+def test_masks_past_and_days_before_build_from(days):
+    rows = work_types(
+        [datetime.time(9), datetime.time(18), None],
+        ["2025-04-28", "2025-05-01", "2025-04-28"])
+    res = expand_schedules(
+        rows, days, columns=COLUMNS, jitter_seconds=0, now=NOW)
+
+    run_times = res.groupby("user_id")["run_time"].apply(list).to_dict()
+    # 9:00 of 4/30 is past, user 2 is built from 5/1 on, user 3 has no time
+    assert run_times == {
+        1: list(pd.to_datetime([
+            "2025-05-01 09:00", "2025-05-02 09:00",
+            "2025-05-07 09:00", "2025-05-08 09:00"])),
+        2: list(pd.to_datetime([
+            "2025-05-01 18:00", "2025-05-02 18:00",
+            "2025-05-07 18:00", "2025-05-08 18:00"])),
+    }
+    assert (res["run_time"] > NOW).all()
+
+
+def test_columns_match_build_tasks(days):
+    rows = work_types([datetime.time(9)], ["2025-04-28"])
+    res = expand_schedules(rows, days, columns=COLUMNS, now=NOW)
+
+    assert list(res.columns) == COLUMNS + ["run_time", "run_date"]
+    assert res["user_id"].dtype == np.int64
+    assert res["id"].dtype == np.int64
+    assert res["run_time"].dtype == "datetime64[ns]"
+    assert res["run_date"].dtype == "datetime64[ns]"
+
+    # as build_tasks completes them before inserting
+    res.rename(columns={"id": "work_type_id"}, inplace=True)
+    res["applied"] = model.ENUM_TASK_STATUS.pending.value
+    res["active"] = True
+    assert set(res.columns) == set(
+        task.get_built_columns(model.t_clock_schedules))
+
+
+def test_run_date_of_jittered_run_time(days):
+    # 1 minute after midnight, 5 minutes earlier with the jitter
+    rows = work_types([datetime.time(0, 1)], ["2025-04-28"])
+    res = expand_schedules(
+        rows, days, columns=COLUMNS, now=NOW, rng=MinJitter())
+
+    assert res["run_time"].tolist() == list(pd.to_datetime([
+        "2025-04-30 23:56", "2025-05-01 23:56",
+        "2025-05-06 23:56", "2025-05-07 23:56"]))
+    assert (res["run_date"] == res["run_time"].dt.normalize()).all()
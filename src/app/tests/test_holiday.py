@@ -0,0 +1,120 @@
+import datetime
+import json
+import logging
+
+import pytest
+
+from core.holiday import HolidayCalendar, HolidayCalendarOutdated
+
+from .conftest import PATH_DATA
+
+
+FIXTURE_CSV = PATH_DATA / "syukujitsu.csv"
+# must never be fetched by a lookup
+UNREACHABLE = "http://127.0.0.1:9/syukujitsu.csv"
+
+
+def make_calendar(tmp_path, source=UNREACHABLE, **kwargs) -> HolidayCalendar:
+    return HolidayCalendar(
+        source=source,
+        cache_path=tmp_path / "holiday_cache.json",
+        seed_path=FIXTURE_CSV,
+        **kwargs,
+    )
+
+
+def test_load_seed_without_cache(tmp_path):
+    calendar = make_calendar(tmp_path).load()
+
+    assert len(calendar.holidays) == 5
+    assert calendar.newest == datetime.date(2025, 5, 6)
+    # never fetched, refreshed as soon as the refresher runs
+    assert calendar.fetched_at is None
+    assert calendar.is_stale()
+    assert calendar.next_refresh_in() == 0
+
+
+def test_is_holiday(tmp_path):
+    calendar = make_calendar(tmp_path)
+
+    assert calendar.is_holiday(datetime.date(2025, 1, 13))
+    assert calendar.is_holiday("2025-05-05")
+    # saturday
+    assert calendar.is_holiday(datetime.date(2025, 1, 11))
+    assert not calendar.is_holiday(datetime.date(2025, 1, 14))
+
+
+def test_refresh_persists_cache(tmp_path):
+    calendar = make_calendar(tmp_path, source=FIXTURE_CSV).refresh()
+    assert calendar.fetched_at is not None
+    assert not calendar.is_stale()
+
+    with open(tmp_path / "holiday_cache.json") as f:
+        cache = json.load(f)
+    assert cache["holidays"][0] == "2025-01-01"
+    assert len(cache["holidays"]) == 5
+
+    # a restart reads the cache and needs no network
+    restarted = make_calendar(tmp_path).load()
+    assert restarted.fetched_at == calendar.fetched_at
+    assert list(restarted.holidays) == list(calendar.holidays)
+    assert restarted.is_holiday(datetime.date(2025, 2, 11))
+
+
+def test_stale_after_refresh_interval(tmp_path):
+    calendar = make_calendar(
+        tmp_path, source=FIXTURE_CSV,
+        refresh_interval=datetime.timedelta(hours=24)).refresh()
+    fetched_at = calendar.fetched_at
+
+    later = fetched_at + datetime.timedelta(hours=23)
+    assert not calendar.is_stale(later)
+    assert calendar.next_refresh_in(later) == pytest.approx(3600)
+    assert calendar.is_stale(fetched_at + datetime.timedelta(hours=24))
+
+
+@pytest.mark.parametrize("cache", [
+    '{"holidays": []}',
+    '{"holidays": ["2025-01-01"], "fetched_at": null}',
+    '["2025-01-01"]',
+    '{"holidays": ["2025-01-01"], "fetched_at": "yesterday"}',
+])
+def test_broken_cache_falls_back_to_seed(tmp_path, cache):
+    (tmp_path / "holiday_cache.json").write_text(cache)
+    calendar = make_calendar(tmp_path).load()
+
+    assert len(calendar.holidays) == 5
+    assert calendar.fetched_at is None
+
+
+def test_failed_refresh_keeps_index(tmp_path):
+    calendar = make_calendar(tmp_path).load()
+    with pytest.raises(Exception):
+        calendar.refresh()
+
+    assert len(calendar.holidays) == 5
+    assert not (tmp_path / "holiday_cache.json").exists()
+
+
+def test_check_covered_raise(tmp_path):
+    calendar = make_calendar(tmp_path, stale_policy="raise").load()
+
+    calendar.check_covered(datetime.date(2025, 5, 1))
+    assert not calendar.is_holiday(datetime.date(2025, 5, 2))
+    with pytest.raises(HolidayCalendarOutdated):
+        calendar.is_holiday(datetime.date(2025, 5, 7))
+    # weekends need no csv
+    assert calendar.is_holiday(datetime.date(2025, 5, 10))
+
+
+def test_check_covered_warn(tmp_path, caplog):
+    calendar = make_calendar(tmp_path, stale_policy="warn").load()
+
+    with caplog.at_level(logging.WARNING, logger="core.holiday"):
+        assert not calendar.is_holiday(datetime.date(2025, 5, 7))
+    assert "outdated" in caplog.text
+
+
+def test_invalid_stale_policy(tmp_path):
+    with pytest.raises(ValueError):
+        make_calendar(tmp_path, stale_policy="ignore")
@@ -0,0 +1,157 @@
+import asyncio
+import datetime
+import logging
+
+import httpx
+import pytest
+from bs4 import BeautifulSoup
+
+from core.backends import BackendError, HttpBackend, Page
+from core.clocker import (
+    Clocker,
+    FIELD_SCHEDULE_TEMPLATE,
+    FIELD_SCHEDULE_START,
+    FIELD_BREAK_END,
+)
+from database.model import ENUM_RUN_TYPE_NAME
+from database.schemas import M_WORK_SCHEDULE_TYPES
+from stub_site import StubSite
+
+
+LOGGER = logging.getLogger("test")
+EMAIL = "user@example.com"
+PASSWORD = "secret"
+DAY = "2025-05-07"
+ATTENDANCE = "workflow_request[workflow_request_content_attendance_attributes]"
+FIELD_DATE = f"{ATTENDANCE}[date]"
+FIELD_TELEWORK_COUNT = f"{ATTENDANCE}[remote_work_count]"
+
+
+@pytest.fixture
+def site():
+    with StubSite(users={EMAIL: PASSWORD}) as site:
+        yield site
+
+
+def clock(runner: ENUM_RUN_TYPE_NAME, password: str = PASSWORD) -> Clocker:
+    return Clocker(
+        email=EMAIL, password=password, gps="35.681236,139.767125",
+        runner=runner, backend="http")
+
+
+def apply(schedule_type: str, telework: bool = True) -> Clocker:
+    details = M_WORK_SCHEDULE_TYPES(
+        id=1, type_name="test", memo="", run_time=datetime.time(8),
+        telework=telework, clock_type=schedule_type,
+        clockin=datetime.time(9, 30), clockout=datetime.time(18, 30),
+        breakin=datetime.time(12), breakout=datetime.time(13),
+        msg="テレワーク")
+    return Clocker(
+        email=EMAIL, password=PASSWORD, schedule_type=schedule_type,
+        details=details, day2apply=DAY, runner="apply_telework",
+        backend="http")
+
+
+def submitted(site: StubSite) -> list:
+    return [(x["action"], x["email"]) for x in site.events]
+
+
+def test_clock_in_and_out_in_one_login(site):
+    backend = HttpBackend(
+        clock(ENUM_RUN_TYPE_NAME.cin), LOGGER, origin=site.origin)
+    results = asyncio.run(backend.run_batch([
+        clock(ENUM_RUN_TYPE_NAME.cin), clock(ENUM_RUN_TYPE_NAME.cout)]))
+
+    assert results == [None, None]
+    assert backend.submitted
+    assert submitted(site) == [("clock_in", EMAIL), ("clock_out", EMAIL)]
+    assert len(site.sessions) == 1
+    fields = site.events[0]["fields"]
+    assert fields["web_time_recorder_form[latitude]"] == "35.681236"
+    assert fields["web_time_recorder_form[longitude]"] == "139.767125"
+    assert fields["authenticity_token"] == site.csrf
+
+
+def test_login_failure(site):
+    backend = HttpBackend(
+        clock(ENUM_RUN_TYPE_NAME.cin, password="wrong"), LOGGER,
+        origin=site.origin)
+    with pytest.raises(BackendError, match="Login failed"):
+        asyncio.run(backend())
+
+    assert not backend.submitted
+    assert site.events == []
+
+
+def test_submit_sends_the_meta_token(site):
+    """Forms without a token field pass with the token of the page"""
+    html = (
+        '<meta name="csrf-token" content="{}">'
+        '<form action="/users/auth/mfid" method="post">'
+        '<button class="attendance-button-mfid">login</button></form>')
+
+    async def main(token: str) -> Page:
+        backend = HttpBackend(
+            clock(ENUM_RUN_TYPE_NAME.cin), LOGGER, origin=site.origin)
+        await backend.open()
+        try:
+            page = Page(url=f"{site.origin}/users/sign_in",
+                        soup=BeautifulSoup(html.format(token), "html.parser"))
+            return await backend.submit(page, page.soup.find("form"))
+        finally:
+            await backend.close()
+
+    page = asyncio.run(main(site.csrf))
+    assert page.url == f"{site.origin}/mfid/sign_in"
+    assert page.soup.find(id="mfid_user[email]") is not None
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(main("forged"))
+
+
+def test_apply_telework_custom_times(site):
+    asyncio.run(HttpBackend(
+        apply("カスタム"), LOGGER, origin=site.origin)())
+
+    assert submitted(site) == [("apply_telework", EMAIL)]
+    fields = site.events[0]["fields"]
+    assert fields["workflow_request[comment]"] == "テレワーク"
+    assert fields[FIELD_DATE] == DAY
+    assert fields[FIELD_TELEWORK_COUNT] == "1"
+    assert fields[FIELD_SCHEDULE_TEMPLATE] == ""
+    assert fields[FIELD_SCHEDULE_START] == "09:30:00"
+    assert fields[FIELD_BREAK_END] == "13:00:00"
+    assert fields["commit"] == "申請する"
+
+
+def test_apply_telework_schedule_type(site):
+    asyncio.run(HttpBackend(
+        apply("通常勤務", telework=False), LOGGER, origin=site.origin)())
+
+    fields = site.events[0]["fields"]
+    assert fields[FIELD_SCHEDULE_TEMPLATE] == "1"
+    # left as the page has them
+    assert fields[FIELD_SCHEDULE_START] == "09:00"
+    assert fields[FIELD_TELEWORK_COUNT] == "0"
+
+
+def test_apply_telework_without_form():
+    html = (
+        '<textarea id="workflow_request_comment" name="c"></textarea>'
+        f'<select name="{FIELD_SCHEDULE_TEMPLATE}"></select>')
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, text=html))
+
+    async def main(backend: HttpBackend) -> None:
+        await backend.open()
+        try:
+            await backend.apply_telework()
+        finally:
+            await backend.close()
+
+    backend = HttpBackend(
+        apply("カスタム", telework=False), LOGGER, origin="http://stub",
+        transport=transport)
+    with pytest.raises(BackendError, match="Form"):
+        asyncio.run(main(backend))
+    assert not backend.submitted
@@ -0,0 +1,66 @@
+import datetime
+
+from core import task
+
+from .test_claim import APPLIED_ROW, CLOCK_ROW, insert
+
+
+EMAIL = "user1@example.com"
+
+
+async def insert_days(db, n_days: int) -> None:
+    start = datetime.datetime(2025, 1, 6)
+    for i in range(n_days):
+        run_date = start + datetime.timedelta(days=i)
+        at = {"run_date": run_date, "run_time": run_date.replace(hour=9),
+              "apply_date": run_date + datetime.timedelta(days=1)}
+        await insert(db, CLOCK_ROW, user_id=1, type_id=1, **at)
+        await insert(db, APPLIED_ROW, user_id=1, type_id=1, **at)
+    # tasks of other users are left out
+    await insert(db, CLOCK_ROW, user_id=2, type_id=1, **at)
+
+
+def test_iter_tasks_reads_every_page(run):
+    async def scenario(db):
+        await insert_days(db, 5)
+        async with db.session() as session:
+            tasks = [x async for x in task.iter_tasks(
+                session, EMAIL, limit=3)]
+            first, cursor = await task.get_tasks_page(
+                session, EMAIL, limit=3)
+            assert len(first) == 3 and cursor is not None
+            everything, cursor = await task.get_tasks_page(
+                session, EMAIL, limit=20)
+            assert cursor is None
+
+        assert tasks == everything
+        assert len(tasks) == 10
+        assert [x["runtime"][:10] for x in tasks[:4]] == [
+            "2025-01-06", "2025-01-06", "2025-01-07", "2025-01-07"]
+        assert tasks[:3] == first
+
+    run(scenario)
+
+
+def test_iter_tasks_with_filters(run):
+    async def scenario(db):
+        await insert_days(db, 5)
+        async with db.session() as session:
+            tasks = [x async for x in task.iter_tasks(
+                session, EMAIL, limit=1,
+                date_from=datetime.date(2025, 1, 7),
+                date_to=datetime.date(2025, 1, 8),
+                run_types=[task.model.ENUM_RUN_TYPE_NAME.cin])]
+        assert [x["runtime"] for x in tasks] == [
+            "2025-01-07 09:00:00", "2025-01-08 09:00:00"]
+
+    run(scenario)
+
+
+def test_iter_tasks_of_unknown_user(run):
+    async def scenario(db):
+        async with db.session() as session:
+            assert [x async for x in task.iter_tasks(
+                session, "nobody@example.com")] == []
+
+    run(scenario)
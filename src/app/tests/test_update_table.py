@@ -0,0 +1,84 @@
+import asyncio
+import datetime
+import logging
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from bench.build_tasks import PostgresDB, make_seed
+from database import db_utils, model
+
+
+LOGGER = logging.getLogger("test")
+
+
+def work_types_input() -> pd.DataFrame:
+    """m_work_types as posted by the webapp: without ids, with one row
+    changed, one deleted and one added
+    """
+    df = make_seed(1)[model.m_work_types.name].copy()
+    df.loc[df["id"] == 2, "type_name"] = "出勤1 (renamed)"
+    df = df[df["id"] != 3].drop(columns="id")
+    new = {"type_name": "出勤new", "run_type": "出勤",
+           "run_time": datetime.time(6, 30), "gps": "35.0,139.0"}
+    return pd.concat([df, pd.DataFrame([new])], ignore_index=True)
+
+
+def users_input() -> pd.DataFrame:
+    """m_users as posted by the webapp: without user ids"""
+    df = make_seed(3)[model.m_users.name].drop(columns="user_id")
+    df.loc[0, "password"] = "changed"
+    df = df[df["email"] != "user2@example.com"]
+    new = {"email": "new@example.com", "password": "password", "memo": None}
+    return pd.concat([df, pd.DataFrame([new])], ignore_index=True)
+
+
+CASES = {
+    "m_work_types": (
+        work_types_input, ["run_type", "run_time", "gps"], "id",
+        "SELECT id, type_name, run_type::text AS run_type, run_time, gps "
+        "FROM m_work_types ORDER BY id"),
+    "m_users": (
+        users_input, "email", "user_id",
+        "SELECT * FROM m_users ORDER BY user_id"),
+}
+
+
+async def update(dsn: str, name: str) -> tuple:
+    make_input, unique_keys, set_increment, sql = CASES[name]
+    db = PostgresDB(dsn)
+    await db.setup(make_seed(3))
+    try:
+        async with db.session() as session:
+            res = await db_utils.update_table(
+                df=make_input(), session=session,
+                table=model.metadata.tables[name],
+                unique_keys=unique_keys, set_increment=set_increment,
+                logger=LOGGER)
+        async with db.engine.connect() as conn:
+            rows = (await conn.execute(text(sql))).all()
+        return res, pd.DataFrame(rows)
+    finally:
+        await db.teardown()
+
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_modes_return_and_write_the_same_rows(pg_dsn, monkeypatch, name):
+    res = {}
+    for mode in ("pandas", "sql"):
+        monkeypatch.setattr(db_utils.settings, "UPDATE_TABLE_MODE", mode)
+        res[mode] = asyncio.run(update(pg_dsn, name))
+
+    table = model.metadata.tables[name]
+    keys = db_utils.get_db_keys(table)
+    pkey = db_utils.get_db_keys(table, primary=True)[0]
+    returned = {
+        mode: x[0][keys].sort_values(pkey, ignore_index=True).astype(object)
+        for mode, x in res.items()}
+    # the changed row and the new one
+    assert len(returned["sql"]) == 2
+    pd.testing.assert_frame_equal(returned["pandas"], returned["sql"])
+    pd.testing.assert_frame_equal(res["pandas"][1], res["sql"][1])
+    if "run_type" in keys:
+        assert set(returned["sql"]["run_type"]) == {"出勤"}
@@ -0,0 +1,33 @@
+from sqlalchemy import text
+
+from core import lease, task
+from database import model
+
+from .test_claim import CLOCK_ROW, LOGGER, OWNER, due, insert
+
+
+async def task_version(db, user_id: int) -> int:
+    async with db.engine.connect() as conn:
+        res = await conn.execute(text(
+            "SELECT version FROM t_user_task_versions WHERE user_id = :id"),
+            {"id": user_id})
+        return res.scalar_one()
+
+
+def test_lease_renewal_keeps_task_version(run):
+    async def scenario(db):
+        await insert(db, CLOCK_ROW, user_id=1, type_id=1, **due())
+        inserted = await task_version(db, 1)
+
+        [claimed] = await task.claim_due_tasks(OWNER, logger=LOGGER)
+        assert await task_version(db, 1) == inserted + 1
+
+        assert await lease.renew(OWNER) == 1
+        assert await task_version(db, 1) == inserted + 1
+
+        assert await lease.release(
+            claimed.table, OWNER, claimed.key,
+            model.ENUM_TASK_STATUS.success)
+        assert await task_version(db, 1) == inserted + 2
+
+    run(scenario)
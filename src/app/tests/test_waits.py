@@ -0,0 +1,33 @@
+import logging
+
+from core.waits import Waiter
+
+
+class FakeElement:
+    def __init__(self, enabled_after: int = None) -> None:
+        # disabled once checked this many times, never if None
+        self.enabled_after = enabled_after
+        self.checks = 0
+
+    def is_enabled(self) -> bool:
+        self.checks += 1
+        return self.enabled_after is None or self.checks < self.enabled_after
+
+
+class FakeDriver:
+    current_url = "https://attendance.example.com/my_page"
+
+
+def make_waiter() -> Waiter:
+    return Waiter(FakeDriver(), timeouts={"default": 0.05}, poll=0.01,
+                  banner_xpath="")
+
+
+def test_confirmed():
+    assert make_waiter().confirmed(FakeElement(enabled_after=3), "clock_in")
+
+
+def test_unconfirmed_submission_does_not_raise(caplog):
+    with caplog.at_level(logging.WARNING, logger="core.waits"):
+        assert not make_waiter().confirmed(FakeElement(), "clock_in")
+    assert "Submitted but not confirmed" in caplog.text